@@ -0,0 +1,480 @@
+"""
+Local stand-ins for the GitHub and Jira REST APIs with fault injection, so that the sync can be benchmarked
+against outages, error storms, rate limits, slow responses and dropped connections without network access.
+
+The fakes implement only the endpoints the sync uses, with the data shapes PyGithub and the jira library expect.
+"""
+import datetime
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+log = logging.getLogger(__name__)
+
+# fault kinds
+DROP = "drop"  # the connection is closed without a response (an outage when it lasts)
+ERROR = "error"  # 500, 502 and 503 responses in turn
+RATE_LIMIT = "rate_limit"  # 429 with Retry-After
+SLOW = "slow"  # responses are delayed
+
+_real_sleep = time.sleep
+
+
+class Clock:
+    """
+    Virtual time of a benchmark. Sleeps of the clients (retry waits, backoff, throttling) advance it instead of
+    blocking, so that waits of minutes are measured without waiting for them.
+    """
+
+    def __init__(self, start: Optional[datetime.datetime] = None) -> None:
+        self._start = start or datetime.datetime(2024, 1, 1)
+        self._offset = 0.0
+        self._lock = threading.Lock()
+        self.slept = 0.0
+
+    def now(self) -> datetime.datetime:
+        with self._lock:
+            return self._start + datetime.timedelta(seconds=self._offset)
+
+    def seconds(self) -> float:
+        with self._lock:
+            return self._offset
+
+    def advance(self, seconds: float):
+        with self._lock:
+            self._offset += max(0.0, seconds)
+
+    def advance_to(self, seconds: float):
+        with self._lock:
+            self._offset = max(self._offset, seconds)
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self._offset += max(0.0, seconds)
+            self.slept += max(0.0, seconds)
+
+
+@dataclass
+class Fault:
+    """
+    Injects a fault into the responses of a fake. The fault starts with the `after`-th request and lasts
+    for `requests` requests or, if `seconds` is given, for that many seconds of virtual time.
+    With `every` only every n-th request in the window is affected. With `processed` the request is processed
+    before the fault is injected, i.e. the response of a successful write is lost.
+    """
+    kind: str
+    after: int = 0
+    requests: Optional[int] = None
+    seconds: Optional[float] = None
+    every: int = 1
+    retry_after: int = 30
+    delay: float = 5.0
+    processed: bool = False
+    started_at: Optional[float] = None
+    ended_at: Optional[float] = None
+    injected: int = 0
+
+    def applies(self, request_no: int, clock: Clock) -> bool:
+        if request_no < self.after:
+            return False
+        now = clock.seconds()
+        if self.started_at is None:
+            self.started_at = now
+        if self.seconds is not None and now - self.started_at >= self.seconds:
+            return False
+        if self.requests is not None and request_no >= self.after + self.requests:
+            return False
+        if (request_no - self.after) % self.every:
+            return False
+        self.ended_at = now
+        self.injected += 1
+        return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeServer"
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _handle(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        url = urlparse(self.path)
+        fault = self.server.next_fault(method, url.path)
+        if fault is not None and fault.processed:
+            self._route(method, url, body)
+        if fault is not None:
+            if fault.kind == DROP:
+                self.close_connection = True
+                self.connection.close()
+                return
+            if fault.kind == ERROR:
+                self._send((500, 502, 503)[fault.injected % 3], {"message": "fault"})
+                return
+            if fault.kind == RATE_LIMIT:
+                self._send(429, {"message": "rate limited"}, {"Retry-After": str(fault.retry_after)})
+                return
+            if fault.kind == SLOW:
+                self.server.clock.advance(fault.delay)
+                _real_sleep(0.001)
+        self._send(*self._route(method, url, body))
+
+    def _route(self, method: str, url, body: bytes):
+        try:
+            return self.server.route(method, url.path, parse_qs(url.query), json.loads(body) if body else None)
+        except Exception as e:
+            log.exception(f"Fake {self.server.name} failed on {method} {self.path}")
+            return 500, {"message": str(e)}, {}
+
+    def _send(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    Base of the fakes: serves on a free local port in a background thread, counts requests and writes
+    and injects the configured faults.
+    """
+    daemon_threads = True
+    name = "server"
+
+    def __init__(self, clock: Clock, faults: Optional[List[Fault]] = None) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.clock = clock
+        self.faults = faults or []
+        self.requests = 0
+        self.writes: List[Tuple[str, str]] = []
+        self.lock = threading.RLock()
+        self._thread = threading.Thread(target=self.serve_forever, name=f"fake-{self.name}", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def next_fault(self, method: str, path: str) -> Optional[Fault]:
+        with self.lock:
+            self.requests += 1
+            return next((f for f in self.faults if f.applies(self.requests, self.clock)), None)
+
+    def route(self, method: str, path: str, query: Dict[str, List[str]], body: Any) -> Tuple[int, Any, Dict]:
+        raise NotImplementedError()
+
+    def handle_error(self, request, client_address):
+        # dropped connections fail when the handler finishes, which is intended
+        log.debug(f"Fake {self.name} connection from {client_address} ended with an error")
+
+    def record_write(self, method: str, what: str):
+        self.writes.append((method, what))
+
+    def timestamp(self) -> datetime.datetime:
+        # whole seconds like the real APIs
+        return self.clock.now().replace(microsecond=0)
+
+
+@dataclass
+class GithubIssue:
+    number: int
+    title: str
+    body: str
+    state: str = "open"
+    comments: List[str] = field(default_factory=list)
+    updated_at: Optional[datetime.datetime] = None
+    closed_at: Optional[datetime.datetime] = None
+    comments_updated_at: List[datetime.datetime] = field(default_factory=list)
+
+
+class FakeGithub(FakeServer):
+    """
+    The GitHub REST API of one repository: listing, reading and editing issues and reading comments.
+    The URL to configure is `url` + "/api/v3".
+    """
+    name = "github"
+
+    def __init__(self, clock: Clock, faults: Optional[List[Fault]] = None, owner: str = "octo",
+                 repo: str = "repo") -> None:
+        super().__init__(clock, faults)
+        self.owner = owner
+        self.repo = repo
+        self.issues: Dict[int, GithubIssue] = {}
+
+    def add_issue(self, title: str, body: str = "", comments: Optional[List[str]] = None) -> GithubIssue:
+        with self.lock:
+            now = self.timestamp()
+            issue = GithubIssue(len(self.issues) + 1, title, body, comments=list(comments or []), updated_at=now,
+                                comments_updated_at=[now] * len(comments or []))
+            self.issues[issue.number] = issue
+            return issue
+
+    def add_comment(self, number: int, body: str):
+        with self.lock:
+            issue = self.issues[number]
+            issue.updated_at = self.timestamp()
+            issue.comments.append(body)
+            issue.comments_updated_at.append(issue.updated_at)
+
+    def edit_issue(self, number: int, **changes) -> GithubIssue:
+        with self.lock:
+            issue = self.issues[number]
+            for name, value in changes.items():
+                setattr(issue, name, value)
+            issue.updated_at = self.timestamp()
+            if changes.get("state") == "closed":
+                issue.closed_at = issue.updated_at
+            return issue
+
+    def route(self, method, path, query, body):
+        base = f"/api/v3/repos/{self.owner}/{self.repo}"
+        if path == base and method == "GET":
+            return 200, self._repository(), {}
+        if path == f"{base}/issues" and method == "GET":
+            return 200, self._list_issues(query), {}
+        if path == f"{base}/issues/comments" and method == "GET":
+            return 200, self._list_comments(query), {}
+        match = re.fullmatch(rf"{base}/issues/(\d+)(/comments)?", path)
+        if match is None or int(match.group(1)) not in self.issues:
+            return 404, {"message": "Not Found"}, {}
+        with self.lock:
+            issue = self.issues[int(match.group(1))]
+            if match.group(2):
+                return 200, [self._comment(issue, index) for index in range(len(issue.comments))], {}
+            if method == "PATCH":
+                self.record_write("PATCH", f"issue {issue.number}")
+                self.edit_issue(issue.number, **{k: v for k, v in body.items() if k in ("title", "body", "state")})
+            return 200, self._issue(issue), {}
+
+    def _repository(self):
+        return {"id": 1, "name": self.repo, "full_name": f"{self.owner}/{self.repo}",
+                "url": f"{self.url}/api/v3/repos/{self.owner}/{self.repo}",
+                "html_url": f"{self.url}/{self.owner}/{self.repo}", "owner": {"login": self.owner}}
+
+    def _list_issues(self, query):
+        since = query.get("since", [None])[0]
+        per_page = int(query.get("per_page", ["30"])[0])
+        page = int(query.get("page", ["1"])[0])
+        with self.lock:
+            issues = sorted(self.issues.values(), key=lambda i: (i.updated_at, i.number))
+            if since:
+                issues = [i for i in issues if i.updated_at >= _parse_github_time(since)]
+            return [self._issue(i) for i in issues[(page - 1) * per_page:page * per_page]]
+
+    def _list_comments(self, query):
+        since = _parse_github_time(query.get("since", [None])[0])
+        with self.lock:
+            comments = sorted((issue.comments_updated_at[index], issue.number, index)
+                              for issue in self.issues.values() for index in range(len(issue.comments)))
+            return [self._comment(self.issues[number], index) for updated_at, number, index in comments
+                    if since is None or updated_at >= since]
+
+    def _issue(self, issue: GithubIssue):
+        return {"number": issue.number, "id": issue.number, "title": issue.title, "body": issue.body,
+                "state": issue.state, "comments": len(issue.comments),
+                "updated_at": _github_time(issue.updated_at), "created_at": _github_time(issue.updated_at),
+                "closed_at": _github_time(issue.closed_at) if issue.closed_at else None,
+                "url": f"{self.url}/api/v3/repos/{self.owner}/{self.repo}/issues/{issue.number}",
+                "html_url": f"{self.url}/{self.owner}/{self.repo}/issues/{issue.number}",
+                "repository": self._repository(), "labels": [], "assignees": [], "milestone": None,
+                "pull_request": None}
+
+    def _comment(self, issue: GithubIssue, index: int):
+        return {"id": issue.number * 1000 + index, "body": issue.comments[index], "user": {"login": "octocat"},
+                "updated_at": _github_time(issue.comments_updated_at[index]),
+                "created_at": _github_time(issue.comments_updated_at[index]),
+                "issue_url": f"{self.url}/api/v3/repos/{self.owner}/{self.repo}/issues/{issue.number}"}
+
+
+@dataclass
+class JiraIssue:
+    id: int
+    key: str
+    summary: str
+    description: str
+    labels: List[str]
+    status: str = "Open"
+    comments: Dict[int, str] = field(default_factory=dict)
+    updated: Optional[datetime.datetime] = None
+
+
+class FakeJira(FakeServer):
+    """
+    The Jira Server REST API (v2) of one project: search with the JQL the sync uses, reading, creating and
+    editing issues, comments and transitions.
+    """
+    name = "jira"
+
+    TRANSITIONS = {"11": "New", "31": "Done"}
+
+    def __init__(self, clock: Clock, faults: Optional[List[Fault]] = None, project: str = "SYNC") -> None:
+        super().__init__(clock, faults)
+        self.project = project
+        self.issues: Dict[str, JiraIssue] = {}
+        self._next_comment_id = 1
+
+    def route(self, method, path, query, body):
+        api = "/rest/api/2"
+        if path == f"{api}/serverInfo":
+            return 200, {"baseUrl": self.url, "version": "9.4.0", "versionNumbers": [9, 4, 0],
+                         "deploymentType": "Server", "serverTitle": "Fake Jira"}, {}
+        if path == f"{api}/field":
+            return 200, [], {}
+        if path == f"{api}/project/{self.project}":
+            return 200, {"id": "1", "key": self.project, "name": self.project}, {}
+        if path == f"{api}/search":
+            return 200, self._search(query), {}
+        if path == f"{api}/issue" and method == "POST":
+            return 201, self._create(body["fields"]), {}
+        match = re.fullmatch(rf"{api}/issue/([\w-]+)(?:/(comment|transitions)(?:/(\d+))?)?", path)
+        with self.lock:
+            issue = match and self._find(match.group(1))
+            if issue is None:
+                return 404, {"errorMessages": ["Issue Does Not Exist"]}, {}
+            if match.group(2) == "transitions":
+                if method == "GET":
+                    return 200, {"transitions": [{"id": i, "name": n} for i, n in self.TRANSITIONS.items()]}, {}
+                self.record_write("POST", f"transition {issue.key}")
+                issue.status = self.TRANSITIONS[body["transition"]["id"]]
+                issue.updated = self.timestamp()
+                return 204, None, {}
+            if match.group(2) == "comment":
+                return self._comment_route(method, issue, match.group(3), body)
+            if method == "PUT":
+                self.record_write("PUT", f"issue {issue.key}")
+                fields = body.get("fields", {})
+                issue.summary = fields.get("summary", issue.summary)
+                issue.description = fields.get("description", issue.description)
+                issue.labels = fields.get("labels", issue.labels)
+                issue.updated = self.timestamp()
+                return 204, None, {}
+            return 200, self._issue(issue), {}
+
+    def issues_with_label(self, label: str) -> List[JiraIssue]:
+        with self.lock:
+            return [i for i in self.issues.values() if label in i.labels]
+
+    def _find(self, key_or_id: str) -> Optional[JiraIssue]:
+        return self.issues.get(key_or_id) or next((i for i in self.issues.values() if str(i.id) == key_or_id), None)
+
+    def _create(self, fields):
+        with self.lock:
+            number = len(self.issues) + 1
+            issue = JiraIssue(10000 + number, f"{self.project}-{number}", fields.get("summary", ""),
+                              fields.get("description") or "", list(fields.get("labels", [])),
+                              updated=self.timestamp())
+            self.issues[issue.key] = issue
+            self.record_write("POST", f"create {issue.key}")
+            return {"id": str(issue.id), "key": issue.key, "self": f"{self.url}/rest/api/2/issue/{issue.id}"}
+
+    def _comment_route(self, method, issue: JiraIssue, comment_id: Optional[str], body):
+        if comment_id is None:
+            if method != "POST":
+                return 200, {"comments": [self._comment(issue, i) for i in issue.comments]}, {}
+            comment_id = self._next_comment_id
+            self._next_comment_id += 1
+            issue.comments[comment_id] = body["body"]
+            issue.updated = self.timestamp()
+            self.record_write("POST", f"comment {issue.key}")
+            return 201, self._comment(issue, comment_id), {}
+        comment_id = int(comment_id)
+        if comment_id not in issue.comments:
+            return 404, {"errorMessages": ["Comment Does Not Exist"]}, {}
+        if method == "PUT":
+            issue.comments[comment_id] = body["body"]
+            self.record_write("PUT", f"comment {issue.key}")
+        elif method == "DELETE":
+            del issue.comments[comment_id]
+            self.record_write("DELETE", f"comment {issue.key}")
+            return 204, None, {}
+        return 200, self._comment(issue, comment_id), {}
+
+    def _search(self, query):
+        jql = query.get("jql", [""])[0]
+        start = int(query.get("startAt", ["0"])[0])
+        max_results = int(query.get("maxResults", ["50"])[0])
+        with self.lock:
+            issues = sorted(self.issues.values(), key=lambda i: i.id)
+            match = re.search(r"key in \(([^)]*)\)", jql)
+            if match:
+                keys = {k.strip() for k in match.group(1).split(",")}
+                issues = [i for i in issues if i.key in keys]
+            match = re.search(r"labels in \(([^)]*)\)", jql)
+            if match:
+                labels = {label.strip().strip('"') for label in match.group(1).split(",")}
+                issues = [i for i in issues if labels & set(i.labels)]
+            match = re.search(r"""summary ~ '"(.*)"'""", jql)
+            if match:
+                title = match.group(1).replace("\\'", "'").replace('\\\\"', '"')
+                # a phrase matches whole words, like in Jira: "Issue 2" does not find "Issue 20"
+                phrase = re.compile(r"\b" + re.escape(title) + r"\b", re.IGNORECASE)
+                issues = [i for i in issues if phrase.search(i.summary)]
+            match = re.search(r"updated >= -(\d+)m", jql)
+            if match:
+                since = self.clock.now() - datetime.timedelta(minutes=int(match.group(1)))
+                issues = sorted((i for i in issues if i.updated >= since), key=lambda i: i.updated, reverse=True)
+            page = issues[start:start + max_results]
+            return {"startAt": start, "maxResults": max_results, "total": len(issues),
+                    "issues": [self._issue(i) for i in page]}
+
+    def _issue(self, issue: JiraIssue):
+        return {"id": str(issue.id), "key": issue.key, "self": f"{self.url}/rest/api/2/issue/{issue.id}",
+                "fields": {"project": {"id": "1", "key": self.project, "name": self.project},
+                           "summary": issue.summary, "description": issue.description,
+                           "status": {"name": issue.status}, "labels": list(issue.labels),
+                           "issuetype": {"name": "Story"}, "assignee": None, "fixVersions": [],
+                           "updated": _jira_time(issue.updated),
+                           "comment": {"comments": [self._comment(issue, i) for i in issue.comments],
+                                       "total": len(issue.comments), "startAt": 0,
+                                       "maxResults": len(issue.comments)}}}
+
+    def _comment(self, issue: JiraIssue, comment_id: int):
+        return {"id": str(comment_id), "self": f"{self.url}/rest/api/2/issue/{issue.id}/comment/{comment_id}",
+                "body": issue.comments[comment_id], "author": {"displayName": "sync"},
+                "updated": _jira_time(issue.updated)}
+
+
+def _github_time(time: datetime.datetime) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_github_time(time: Optional[str]) -> Optional[datetime.datetime]:
+    return datetime.datetime.fromisoformat(time.replace("Z", "")).replace(tzinfo=None) if time else None
+
+
+def _jira_time(time: datetime.datetime) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000+0000")
@@ -0,0 +1,444 @@
+"""
+Microbenchmarks of the CPU-heavy hot paths: converting GitHub and Jira issues, transforming them with the sync
+strategy, saving the state and updating Jira comments. Each path gets synthetic payloads of realistic and of
+extreme size (10k comments, 1 MB bodies, 100k mappings in the state) built from raw API data offline, and is measured
+for time (the best of several repeats) and allocations (the peak of memory allocated while it runs).
+
+The results are compared with stored baselines; with --check a regression of more than the configured margin fails:
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --case github.convert_to_base_issue --check
+    python -m benchmarks.micro --update-baseline
+
+Times are machine dependent, so every run times a fixed calibration workload too and the baseline times are scaled by
+how much faster or slower it ran than when the baseline was recorded. Allocations are only compared on the Python
+version the baseline was recorded with.
+"""
+import datetime
+import gc
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+from unittest.mock import patch
+
+import click
+import github
+import github.Issue
+import github.IssueComment
+import jira.resources
+import requests
+
+from issues_sync.config import JiraConfig
+from issues_sync.file_state import InFileState
+from issues_sync.github_connection import convert_to_base_issue
+from issues_sync.jira_connection import JiraConnection
+from issues_sync.metrics import Metrics
+from issues_sync.sync_strategy import GithubToJiraSyncStrategy
+
+log = logging.getLogger(__name__)
+
+BASELINE_FILE = str(Path(__file__).with_name("micro_baseline.json"))
+# a change regresses a benchmark when it is slower (or allocates more) than the baseline by more than the margin
+TIME_MARGIN = 0.5
+MEMORY_MARGIN = 0.2
+
+REPO = "my-repo"
+JIRA_URL = "https://jira.example.com"
+
+_PARAGRAPH = """## Steps to reproduce
+
+1. Run `sync --profile sync.prof` on a **large** repository
+2. Open the [profile](https://github.com/tozka/github-jira-sync/issues) and look at the _slowest_ issues
+   * nested item with ~~old~~ new text
+
+```python
+for issue in issues:
+    sync(issue)
+```
+
+> quoted reply from the previous comment
+
+| phase | seconds |
+|-------|---------|
+| Jira write | 12.5 |
+
+"""
+
+
+def markdown(size: int) -> str:
+    """
+    Returns GitHub flavored Markdown of about `size` characters, using all the constructs the converter handles.
+    """
+    return (_PARAGRAPH * (size // len(_PARAGRAPH) + 1))[:size]
+
+
+@dataclass
+class Case:
+    name: str
+    size: str
+    # builds a fresh payload (untimed) and returns the call to measure
+    prepare: Callable[[], Callable[[], Any]]
+    # calls per timing, so that fast paths are timed over a measurable duration
+    number: int = 1
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}[{self.size}]"
+
+
+@dataclass
+class Measurement:
+    seconds: float
+    peak_bytes: int
+
+
+class _OfflineIssue(github.Issue.Issue):
+    """
+    A GitHub issue built from raw API data whose comment thread is served from memory.
+    """
+
+    def get_comments(self, since=None):
+        return self.benchmark_comments
+
+
+def github_issue(comments: int = 20, body_size: int = 4096, comment_size: int = 512) -> github.Issue.Issue:
+    client = github.Github()
+    updated_at = "2024-03-01T12:00:00Z"
+    issue = client.create_from_raw_data(_OfflineIssue, {
+        "number": 42, "title": "Sync is slow for issues with long threads", "body": markdown(body_size),
+        "state": "open", "comments": comments, "created_at": "2024-01-01T12:00:00Z", "updated_at": updated_at,
+        "closed_at": None, "html_url": f"https://github.com/tozka/{REPO}/issues/42",
+        "url": f"https://api.github.com/repos/tozka/{REPO}/issues/42",
+        "repository": {"name": REPO, "url": f"https://api.github.com/repos/tozka/{REPO}"},
+        "labels": [{"name": "bug"}, {"name": "good first issue"}],
+        "assignees": [{"login": "octocat"}],
+        "milestone": {"title": "v1.0", "number": 1},
+    })
+    body = markdown(comment_size)
+    issue.benchmark_comments = [
+        client.create_from_raw_data(github.IssueComment.IssueComment, {
+            "id": number, "body": f"{number} {body}", "updated_at": updated_at, "user": {"login": f"user{number % 50}"}
+        })
+        for number in range(comments)]
+    return issue
+
+
+def jira_issue(comments: int = 20, body_size: int = 4096, comment_size: int = 512) -> jira.resources.Issue:
+    updated = "2024-03-01T12:00:00.000+0000"
+    body = markdown(comment_size)
+    return jira.resources.Issue({"server": JIRA_URL}, None, raw={
+        "key": "SYNC-42",
+        "self": f"{JIRA_URL}/rest/api/2/issue/10042",
+        "fields": {
+            "project": {"name": "Sync"}, "summary": "Sync is slow for issues with long threads",
+            "description": markdown(body_size), "updated": updated, "status": {"name": "In Progress"},
+            "labels": [f"gh-{REPO}-42", "bug"], "assignee": None, "fixVersions": [],
+            "comment": {"comments": [
+                {"id": str(number), "body": f"{number} {body}", "updated": updated,
+                 "author": {"displayName": f"User {number % 50}"},
+                 "self": f"{JIRA_URL}/rest/api/2/issue/10042/comment/{number}"}
+                for number in range(comments)]},
+        },
+    })
+
+
+class _OfflineJira:
+    """
+    Stands in for the jira client: the writes are accepted and dropped, so only the sync's own work is measured.
+    """
+
+    def __init__(self, server, **kwargs):
+        self._options = {"server": server}
+        self._is_cloud = True
+        self._session = requests.Session()
+        self._created = 0
+
+    def create_issue(self, fields):
+        self._created += 1
+        return SimpleNamespace(key=f"SYNC-{self._created}")
+
+    def add_comment(self, issue, body):
+        pass
+
+    def transition_issue(self, issue, transition):
+        pass
+
+    def search_users(self, **kwargs):
+        return [SimpleNamespace(accountId="5b10ac8d82e05b22cc7d4ef5")]
+
+    def project_versions(self, project):
+        return [SimpleNamespace(name="v1.0", id="10000")]
+
+
+def jira_connection() -> JiraConnection:
+    with patch("issues_sync.jira_connection.JIRA", _OfflineJira):
+        return JiraConnection(JiraConfig(url=JIRA_URL, project="SYNC"), metrics=Metrics())
+
+
+def strategy() -> GithubToJiraSyncStrategy:
+    # a new strategy has an empty markup cache, so every measured call converts the Markdown
+    return GithubToJiraSyncStrategy(jira_connection(), github_connection=None)
+
+
+def state(mappings: int, directory: str) -> InFileState:
+    file = Path(directory) / "mapping.state.json"
+    file.write_text(json.dumps({
+        "mapping_github_to_jira": {str(n): f"SYNC-{n}" for n in range(mappings)},
+        "mapping_jira_to_github": {f"SYNC-{n}": str(n) for n in range(mappings)},
+        "last_sync_time": "2024-03-01T12:00:00",
+        "last_synced_keys": [str(n) for n in range(100)],
+    }))
+    return InFileState(str(file))
+
+
+def _convert_github(comments: int, body_size: int):
+    def prepare():
+        issue = github_issue(comments, body_size)
+        return lambda: convert_to_base_issue(issue)
+    return prepare
+
+
+def _convert_jira(comments: int, body_size: int):
+    def prepare():
+        connection, issue = jira_connection(), jira_issue(comments, body_size)
+        return lambda: connection._convert_to_base_issue(issue)
+    return prepare
+
+
+def _transform(method: str, comments: int, body_size: int):
+    def prepare():
+        base_issue = convert_to_base_issue(github_issue(comments, body_size))
+        jira = jira_connection()._convert_to_base_issue(jira_issue(comments, body_size))
+        transform = getattr(strategy(), method)
+        return lambda: transform(jira, base_issue)
+    return prepare
+
+
+def _create_jira_issue(comments: int, body_size: int):
+    def prepare():
+        base_issue, create = convert_to_base_issue(github_issue(comments, body_size)), strategy().create_jira_issue
+        return lambda: create(base_issue)
+    return prepare
+
+
+def _save_state(mappings: int):
+    # the temporary directories are removed when the benchmark ends
+    directories: List[tempfile.TemporaryDirectory] = []
+
+    def prepare():
+        directories.append(tempfile.TemporaryDirectory())
+        return state(mappings, directories[-1].name)._save_state
+    return prepare
+
+
+def _update_jira_comments(comments: int, new_comments: int):
+    """
+    The Jira issue has `comments` comments of which the desired ones keep all and add `new_comments`.
+    """
+
+    def prepare():
+        connection = jira_connection()
+        current = connection._convert_to_base_issue(jira_issue(comments))
+        desired = connection._convert_to_base_issue(jira_issue(comments + new_comments))
+        return lambda: connection._update_comments(current.key, current.comments, desired)
+    return prepare
+
+
+CASES = [
+    Case("github.convert_to_base_issue", "20 comments", _convert_github(20, 4096), number=50),
+    Case("github.convert_to_base_issue", "10k comments", _convert_github(10_000, 4096)),
+    Case("github.convert_to_base_issue", "1 MB body", _convert_github(20, 1 << 20), number=50),
+    Case("jira.convert_to_base_issue", "20 comments", _convert_jira(20, 4096), number=200),
+    Case("jira.convert_to_base_issue", "10k comments", _convert_jira(10_000, 4096)),
+    Case("jira.convert_to_base_issue", "1 MB body", _convert_jira(20, 1 << 20), number=50),
+    Case("strategy.update_issue_fields", "4 KB body", _transform("_update_issue_fields", 0, 4096), number=20),
+    Case("strategy.update_issue_fields", "1 MB body", _transform("_update_issue_fields", 0, 1 << 20)),
+    Case("strategy.update_comments", "20 comments", _transform("_update_comments", 20, 0), number=10),
+    Case("strategy.update_comments", "10k comments", _transform("_update_comments", 10_000, 0)),
+    Case("strategy.create_jira_issue", "20 comments", _create_jira_issue(20, 4096), number=10),
+    Case("strategy.create_jira_issue", "10k comments, 1 MB body", _create_jira_issue(10_000, 1 << 20)),
+    Case("state.save", "1k mappings", _save_state(1000), number=10),
+    Case("state.save", "100k mappings", _save_state(100_000)),
+    Case("jira.update_comments", "20 unchanged", _update_jira_comments(20, 0), number=200),
+    Case("jira.update_comments", "10k unchanged", _update_jira_comments(10_000, 0)),
+    Case("jira.update_comments", "10k + 10k new", _update_jira_comments(10_000, 10_000)),
+]
+
+
+def measure(case: Case, repeat: int = 5) -> Measurement:
+    """
+    Times the case `repeat` times (`number` calls each, on fresh payloads, with the garbage collector off like
+    timeit) and keeps the best time, then measures the allocation peak of one more call with tracemalloc.
+    """
+    timings = []
+    for _ in range(repeat):
+        calls = [case.prepare() for _ in range(case.number)]
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for call in calls:
+                call()
+            timings.append((time.perf_counter() - start) / case.number)
+        finally:
+            gc.enable()
+        del calls
+    call = case.prepare()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        allocated = tracemalloc.get_traced_memory()[0]
+        call()
+        peak_bytes = tracemalloc.get_traced_memory()[1] - allocated
+    finally:
+        tracemalloc.stop()
+    return Measurement(min(timings), peak_bytes)
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    Times a fixed workload of the kind the hot paths do (object and dict building, string handling, JSON and regular
+    expressions), to scale baseline times recorded on another machine.
+    """
+    text = markdown(64 * 1024)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = [SimpleNamespace(key=str(n), body=text[n % 1000:n % 1000 + 200], labels=["bug", f"gh-{n}"])
+                 for n in range(20_000)]
+        data = json.dumps({item.key: {"body": item.body.strip(), "labels": item.labels} for item in items})
+        json.loads(data)
+        text.replace("\n", "\\n").split("|")
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@dataclass
+class Result:
+    case: Case
+    measurement: Measurement
+    # the baseline scaled to this machine (time) and the regressions beyond the margins
+    expected_seconds: Optional[float] = None
+    expected_peak_bytes: Optional[int] = None
+    time_regressed: bool = False
+    memory_regressed: bool = False
+
+
+def compare(cases: List[Case], measurements: Dict[str, Measurement], baseline: dict, calibration: float,
+            time_margin: float, memory_margin: float) -> List[Result]:
+    scale = calibration / baseline["calibration_seconds"] if baseline.get("calibration_seconds") else 1.0
+    same_python = baseline.get("python") == _python_version()
+    results = []
+    for case in cases:
+        result = Result(case, measurements[case.key])
+        recorded = baseline.get("benchmarks", {}).get(case.key)
+        if recorded is not None:
+            result.expected_seconds = recorded["seconds"] * scale
+            result.time_regressed = result.measurement.seconds > result.expected_seconds * (1 + time_margin)
+            if same_python:
+                result.expected_peak_bytes = recorded["peak_bytes"]
+                result.memory_regressed = result.measurement.peak_bytes > recorded["peak_bytes"] * (1 + memory_margin)
+        results.append(result)
+    return results
+
+
+def load_baseline(file: str) -> dict:
+    path = Path(file)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_baseline(file: str, baseline: dict, measurements: Dict[str, Measurement], calibration: float):
+    """
+    Stores the measurements as the new baselines. Benchmarks that were not run keep their baselines, unless the
+    calibration changed: then all are recorded anew, so that they are on the same scale.
+    """
+    benchmarks = {}
+    if baseline.get("python") == _python_version() and baseline.get("calibration_seconds"):
+        scale = calibration / baseline["calibration_seconds"]
+        benchmarks = {key: {"seconds": recorded["seconds"] * scale, "peak_bytes": recorded["peak_bytes"]}
+                      for key, recorded in baseline.get("benchmarks", {}).items()}
+    benchmarks.update({key: {"seconds": float(f"{m.seconds:.4g}"), "peak_bytes": m.peak_bytes}
+                       for key, m in measurements.items()})
+    data = {
+        "recorded_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat(),
+        "python": _python_version(),
+        "machine": platform.machine(),
+        "calibration_seconds": float(f"{calibration:.4g}"),
+        "margins": baseline.get("margins", {"seconds": TIME_MARGIN, "peak_bytes": MEMORY_MARGIN}),
+        "benchmarks": {key: benchmarks[key] for key in sorted(benchmarks)},
+    }
+    Path(file).write_text(json.dumps(data, indent=2) + "\n")
+
+
+def _python_version() -> str:
+    return f"{sys.version_info.major}.{sys.version_info.minor}"
+
+
+def _format(result: Result) -> str:
+    m = result.measurement
+    time_change = _change(m.seconds, result.expected_seconds, result.time_regressed)
+    memory_change = _change(m.peak_bytes, result.expected_peak_bytes, result.memory_regressed)
+    return (f"{result.case.key:<60} {m.seconds * 1000:>10.3f}ms {time_change:>10} "
+            f"{m.peak_bytes / 1024:>9.1f}KB {memory_change:>10}")
+
+
+def _change(value: float, expected: Optional[float], regressed: bool) -> str:
+    if not expected:
+        return "new"
+    return f"{(value / expected - 1) * 100:+.0f}%{' !' if regressed else ''}"
+
+
+HEADER = f"{'benchmark':<60} {'time':>12} {'vs base':>10} {'peak alloc':>11} {'vs base':>10}"
+
+
+@click.command()
+@click.option("--case", "names", multiple=True, type=click.Choice(sorted({c.name for c in CASES})),
+              help="Benchmarks to run (default: all).")
+@click.option("--repeat", default=5, show_default=True, help="Timings per benchmark, the best one counts.")
+@click.option("--baseline", "baseline_file", default=BASELINE_FILE, show_default=True, help="Baseline file.")
+@click.option("--time-margin", type=float,
+              help=f"Allowed slowdown against the baseline, 0.5 = 50% (default: the baseline's or {TIME_MARGIN}).")
+@click.option("--memory-margin", type=float,
+              help=f"Allowed increase of the allocation peak (default: the baseline's or {MEMORY_MARGIN}).")
+@click.option("--check", is_flag=True, help="Exit with an error if a benchmark regressed beyond the margins.")
+@click.option("--update-baseline", is_flag=True, help="Store the results as the new baselines.")
+def main(names, repeat, baseline_file, time_margin, memory_margin, check, update_baseline):
+    cases = [c for c in CASES if not names or c.name in names]
+    baseline = load_baseline(baseline_file)
+    margins = baseline.get("margins", {})
+    time_margin = time_margin if time_margin is not None else margins.get("seconds", TIME_MARGIN)
+    memory_margin = memory_margin if memory_margin is not None else margins.get("peak_bytes", MEMORY_MARGIN)
+
+    calibration = statistics.median([calibrate(), calibrate()])
+    measurements = {}
+    click.echo(HEADER)
+    results = []
+    for case in cases:
+        measurements[case.key] = measure(case, repeat)
+        result = compare([case], measurements, baseline, calibration, time_margin, memory_margin)[0]
+        results.append(result)
+        click.echo(_format(result))
+    if baseline and baseline.get("python") != _python_version():
+        click.echo(f"Allocations not compared: the baseline was recorded with Python {baseline.get('python')}.")
+
+    if update_baseline:
+        save_baseline(baseline_file, baseline, measurements, calibration)
+        click.echo(f"Baselines written to {baseline_file}")
+    elif check and any(r.time_regressed or r.memory_regressed for r in results):
+        click.echo(f"Some benchmarks regressed by more than {time_margin:.0%} in time "
+                   f"or {memory_margin:.0%} in allocations.", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    main()
@@ -0,0 +1,257 @@
+"""
+Outage-recovery benchmark: runs the sync on a schedule against local fake GitHub and Jira servers that inject
+outages, error storms, rate limits, slow responses and dropped connections partway through a run, and measures
+
+* time to recover: virtual time from the end of the faults until GitHub and Jira agree again,
+* duplicated writes: Jira issues created twice for one GitHub issue and comments added twice,
+* lost updates: GitHub issues (and edits made during the faults) not in Jira after the last run,
+* wasted API calls: requests beyond those of the same scenario without faults.
+
+Client sleeps (retry waits, backoff, throttling) advance a virtual clock instead of blocking, so that the benchmark
+runs in seconds without network access:
+
+    python -m benchmarks.outage
+    python -m benchmarks.outage --scenario jira_outage --scenario jira_5xx_storm --check
+"""
+import datetime
+import logging
+import sys
+import time
+import types
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+from unittest.mock import patch
+
+import click
+
+from benchmarks.fakes import Clock, Fault, FakeGithub, FakeJira, GithubIssue, JiraIssue, DROP, ERROR, RATE_LIMIT, SLOW
+from issues_sync.config import GithubConfig, JiraConfig
+from issues_sync.github_connection import GithubConnection
+from issues_sync.issue import github_label
+from issues_sync.jira_connection import JiraConnection
+from issues_sync.metrics import Metrics
+from issues_sync.sync_engine import SyncEngine
+from issues_sync.sync_strategy import GithubToJiraSyncStrategy
+from issues_sync.utils import InMemoryState
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    github_faults: Callable[[], List[Fault]] = list
+    jira_faults: Callable[[], List[Fault]] = list
+
+
+SCENARIOS: Dict[str, Scenario] = {s.name: s for s in [
+    Scenario("baseline", "no faults"),
+    Scenario("jira_outage", "Jira unreachable for 15 minutes from its 20th request",
+             jira_faults=lambda: [Fault(DROP, after=20, seconds=15 * 60)]),
+    Scenario("github_outage", "GitHub unreachable for 15 minutes from its 5th request",
+             github_faults=lambda: [Fault(DROP, after=5, seconds=15 * 60)]),
+    Scenario("jira_5xx_storm", "Jira answers 30 requests with 500, 502 and 503 from its 20th request",
+             jira_faults=lambda: [Fault(ERROR, after=20, requests=30)]),
+    Scenario("github_5xx_storm", "GitHub answers 30 requests with 500, 502 and 503 from its 5th request",
+             github_faults=lambda: [Fault(ERROR, after=5, requests=30)]),
+    Scenario("jira_lost_responses", "Jira processes 10 requests from its 20th request but answers them with 502",
+             jira_faults=lambda: [Fault(ERROR, after=20, requests=10, processed=True)]),
+    Scenario("jira_rate_limit", "Jira answers 20 requests with 429 (Retry-After 30s) from its 20th request",
+             jira_faults=lambda: [Fault(RATE_LIMIT, after=20, requests=20)]),
+    Scenario("github_rate_limit", "GitHub answers 20 requests with 429 (Retry-After 30s) from its 5th request",
+             github_faults=lambda: [Fault(RATE_LIMIT, after=5, requests=20)]),
+    Scenario("jira_slow", "Jira answers 100 requests 5 seconds late from its 20th request",
+             jira_faults=lambda: [Fault(SLOW, after=20, requests=100, delay=5)]),
+    Scenario("dropped_connections", "every 7th Jira and every 11th GitHub connection is dropped",
+             github_faults=lambda: [Fault(DROP, after=5, every=11)],
+             jira_faults=lambda: [Fault(DROP, after=5, every=7)]),
+]}
+
+
+@dataclass
+class Result:
+    scenario: str
+    converged: bool
+    runs: int
+    failed_runs: int
+    recovery_seconds: Optional[float]
+    retry_wait_seconds: float
+    requests: int
+    wasted_calls: Optional[int]
+    duplicated_writes: int
+    lost_updates: int
+    wall_seconds: float
+    faults_injected: int
+    errors: List[str] = field(default_factory=list)
+
+
+def run_scenario(scenario: Scenario, issues: int = 20, interval: datetime.timedelta = datetime.timedelta(minutes=5),
+                 max_runs: int = 48, pipeline: bool = False) -> Result:
+    """
+    Syncs `issues` GitHub issues every `interval` (in virtual time) until Jira agrees with GitHub or `max_runs`
+    runs are done. Before the second run a few issues are edited and closed, so that edits made during the faults
+    are checked as well.
+    """
+    started = time.perf_counter()
+    clock = Clock()
+    github_faults = scenario.github_faults()
+    jira_faults = scenario.jira_faults()
+    state = InMemoryState()
+    errors = []
+    with FakeGithub(clock, github_faults) as github_server, FakeJira(clock, jira_faults) as jira_server, \
+            _virtual_time(clock):
+        for number in range(issues):
+            github_server.add_issue(f"Issue {number + 1}", f"Description of issue {number + 1}",
+                                    comments=[f"Comment {c + 1}" for c in range(number % 3)])
+        state.update_last_sync_time(clock.now() - datetime.timedelta(minutes=1))
+        clock.advance(60)
+
+        converged_at = None
+        runs = 0
+        failed_runs = 0
+        next_run = 60.0
+        while runs < max_runs:
+            # like a scheduled job, a run that takes longer than the interval skips the runs it overlaps
+            while next_run < clock.seconds():
+                next_run += interval.total_seconds()
+            clock.advance_to(next_run)
+            next_run += interval.total_seconds()
+            if runs == 1:
+                _edit_issues(github_server)
+            runs += 1
+            try:
+                _sync_once(github_server, jira_server, state, pipeline)
+            except Exception as e:
+                failed_runs += 1
+                errors.append(f"run {runs}: {type(e).__name__}: {e}")
+                log.info(f"Run {runs} of {scenario.name} failed: {e}")
+            if runs > 1 and _lost_updates(github_server, jira_server) == 0:
+                converged_at = clock.seconds()
+                break
+
+        faults = github_faults + jira_faults
+        fault_end = max((f.ended_at for f in faults if f.ended_at is not None), default=None)
+        recovery = None
+        if converged_at is not None:
+            recovery = converged_at - fault_end if fault_end is not None else 0.0
+        return Result(scenario=scenario.name,
+                      converged=converged_at is not None,
+                      runs=runs,
+                      failed_runs=failed_runs,
+                      recovery_seconds=recovery,
+                      retry_wait_seconds=clock.slept,
+                      requests=github_server.requests + jira_server.requests,
+                      wasted_calls=None,
+                      duplicated_writes=_duplicated_writes(github_server, jira_server),
+                      lost_updates=_lost_updates(github_server, jira_server),
+                      wall_seconds=time.perf_counter() - started,
+                      faults_injected=sum(f.injected for f in faults),
+                      errors=errors)
+
+
+def _sync_once(github_server: FakeGithub, jira_server: FakeJira, state: InMemoryState, pipeline: bool):
+    # every run connects anew, like a scheduled job
+    github = GithubConnection(GithubConfig(url=f"{github_server.url}/api/v3",
+                                           project=f"{github_server.owner}/{github_server.repo}"))
+    jira = JiraConnection(JiraConfig(url=jira_server.url, project=jira_server.project))
+    strategy = GithubToJiraSyncStrategy(jira, github)
+    engine = SyncEngine(github, jira, strategy, state, metrics=Metrics(), pipeline={} if pipeline else None)
+    engine.sync()
+
+
+def _edit_issues(github_server: FakeGithub):
+    github_server.edit_issue(1, title="Issue 1 (edited)")
+    github_server.edit_issue(2, body="Description of issue 2 (edited)")
+    github_server.edit_issue(3, state="closed")
+    github_server.add_comment(4, "Comment added later")
+
+
+def _jira_issues(github_server: FakeGithub, jira_server: FakeJira, number: int):
+    return jira_server.issues_with_label(github_label(github_server.repo, str(number)))
+
+
+def _lost_updates(github_server: FakeGithub, jira_server: FakeJira) -> int:
+    # duplicates are counted separately, so an issue is lost only if none of its Jira issues is up to date
+    return sum(1 for issue in list(github_server.issues.values())
+               if not any(_up_to_date(issue, j) for j in _jira_issues(github_server, jira_server, issue.number)))
+
+
+def _up_to_date(issue: GithubIssue, jira_issue: JiraIssue) -> bool:
+    return jira_issue.summary == issue.title \
+        and issue.body in jira_issue.description \
+        and (jira_issue.status == "Done") == (issue.state == "closed") \
+        and len(jira_issue.comments) >= len(issue.comments)
+
+
+def _duplicated_writes(github_server: FakeGithub, jira_server: FakeJira) -> int:
+    duplicated = 0
+    for issue in list(github_server.issues.values()):
+        jira_issues = _jira_issues(github_server, jira_server, issue.number)
+        duplicated += max(0, len(jira_issues) - 1)
+        duplicated += sum(max(0, len(j.comments) - len(issue.comments)) for j in jira_issues)
+    return duplicated
+
+
+@contextmanager
+def _virtual_time(clock: Clock):
+    """
+    Lets the sync and its HTTP clients run on the virtual clock: sleeps advance it and "now" is read from it.
+    """
+
+    class VirtualDatetime(datetime.datetime):
+        @classmethod
+        def utcnow(cls):
+            return clock.now()
+
+    datetime_module = types.SimpleNamespace(datetime=VirtualDatetime, timedelta=datetime.timedelta)
+    with patch("time.sleep", clock.sleep), \
+            patch("issues_sync.sync_engine.datetime", VirtualDatetime), \
+            patch("issues_sync.jira_connection.datetime", datetime_module):
+        yield
+
+
+def _format(result: Result) -> str:
+    recovery = f"{result.recovery_seconds:.0f}s" if result.recovery_seconds is not None else "not recovered"
+    wasted = result.wasted_calls if result.wasted_calls is not None else "-"
+    return (f"{result.scenario:<22} {recovery:>14} {result.runs:>5} {result.failed_runs:>7} "
+            f"{result.retry_wait_seconds:>10.0f}s {result.requests:>9} {wasted:>7} {result.duplicated_writes:>11} "
+            f"{result.lost_updates:>5} {result.faults_injected:>7} {result.wall_seconds:>7.1f}s")
+
+
+HEADER = (f"{'scenario':<22} {'recovery':>14} {'runs':>5} {'failed':>7} {'retry wait':>11} {'requests':>9} "
+          f"{'wasted':>7} {'duplicated':>11} {'lost':>5} {'faults':>7} {'wall':>8}")
+
+
+@click.command()
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(sorted(SCENARIOS)),
+              help="Scenarios to run (default: all).")
+@click.option("--issues", default=20, show_default=True, help="GitHub issues to sync.")
+@click.option("--max-runs", default=48, show_default=True, help="Scheduled runs (every 5 minutes) to recover in.")
+@click.option("--pipeline", is_flag=True, help="Sync with the pipelined engine.")
+@click.option("--check", is_flag=True, help="Exit with an error if any scenario duplicates writes or loses updates.")
+def main(scenarios, issues, max_runs, pipeline, check):
+    baseline = run_scenario(SCENARIOS["baseline"], issues, max_runs=max_runs, pipeline=pipeline)
+    results = []
+    for name in scenarios or SCENARIOS:
+        result = baseline if name == "baseline" else run_scenario(SCENARIOS[name], issues, max_runs=max_runs,
+                                                                  pipeline=pipeline)
+        result.wasted_calls = result.requests - baseline.requests
+        results.append(result)
+
+    click.echo(HEADER)
+    for result in results:
+        click.echo(_format(result))
+    for result in results:
+        for error in result.errors[:3]:
+            click.echo(f"{result.scenario}: {error}")
+
+    if check and any(r.duplicated_writes or r.lost_updates for r in results):
+        click.echo("Some scenarios duplicated writes or lost updates.", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    main()
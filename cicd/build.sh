@@ -26,4 +26,11 @@ pip install  -r requirements.txt
 
 pytest --junitxml=tests.xml --cov issues_sync --cov-report term-missing --cov-report xml:coverage.xml
 
+echo "Run the outage-recovery benchmark against local fake servers"
+python -m benchmarks.outage --check
+python -m benchmarks.outage --check --pipeline
+
+echo "Run the hot-path microbenchmarks against their baselines (shared build machines are noisy, so times get more margin)"
+python -m benchmarks.micro --check --time-margin 1.0
+
 python setup.py sdist --formats=gztar
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import mimetypes
+import re
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from issues_sync.github_connection import GithubConnection
+from issues_sync.issue import BaseIssue
+from issues_sync.jira_connection import JiraConnection
+from issues_sync.state import State
+from issues_sync.tracing import span
+
+log = logging.getLogger(__name__)
+
+# files and images uploaded to GitHub issues and comments
+ATTACHMENT_URL = re.compile(
+    r"https://(?:(?:private-)?user-images\.githubusercontent\.com"
+    r"|github\.com/user-attachments/(?:assets|files)"
+    r"|github\.com/[\w.-]+/[\w.-]+/(?:assets|files))"
+    r"/[^\s)\"'<>\]|!]+")
+
+# downloads larger than this are spooled to a temporary file instead of memory
+SPOOL_SIZE = 1024 * 1024
+
+
+def find_attachment_urls(issue: BaseIssue) -> List[str]:
+    """
+    Returns the attachment URLs in the description and comments of an issue in order of appearance (without duplicates).
+    """
+    texts = [issue.description.value] + [c.body.value for c in issue.comments or []]
+    urls = {}
+    for text in texts:
+        for match in ATTACHMENT_URL.finditer(text or ""):
+            urls[match.group(0)] = None
+    return list(urls)
+
+
+@dataclass
+class MirroredAttachment:
+    jira_issue_key: str
+    url: str
+    digest: str
+    attachment_id: Optional[str]
+    name: Optional[str] = None
+
+
+class AttachmentMirror:
+    """
+    Copies the attachments of GitHub issues to the Jira issues in a bounded background pool, so that large media
+    does not hold up the text sync. Downloads are streamed in chunks and uploads are deduplicated by content hash.
+
+    Only the thread calling submit() and collect() uses the state: results of the pool are recorded by collect().
+    """
+
+    def __init__(self, github: GithubConnection, jira: JiraConnection, state: State,
+                 workers: int = 2, max_pending: int = 16, chunk_size: int = 64 * 1024) -> None:
+        self._github = github
+        self._jira = jira
+        self._state = state
+        self._chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="attachments")
+        # submit() blocks while max_pending issues are queued or running
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending: List[Tuple[Future, Set[Tuple[str, str]]]] = []
+        self._queued: Set[Tuple[str, str]] = set()
+
+    def submit(self, jira_issue_key: str, github_issue: BaseIssue):
+        """
+        Queues the attachments of the GitHub issue that are not on the Jira issue yet.
+        The attachments of one issue are mirrored one after the other, so equal files are uploaded once.
+        """
+        uploaded = self._state.get_attachments(jira_issue_key)
+        urls = []
+        for url in find_attachment_urls(github_issue):
+            digest = self._state.get_attachment_digest(url)
+            if (digest is None or digest not in uploaded) and (jira_issue_key, url) not in self._queued:
+                urls.append(url)
+        if not urls:
+            return
+        queued = {(jira_issue_key, url) for url in urls}
+        self._queued |= queued
+        self._slots.acquire()
+        # the file names of the attachments by content hash, for the URLs whose content is attached already
+        names = {self._state.get_attachment_digest(url): name
+                 for url, name in self._state.get_attachment_names(jira_issue_key).items()}
+        future = self._executor.submit(self._mirror_all, jira_issue_key, urls, dict(uploaded), names)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append((future, queued))
+        self.collect()
+
+    def collect(self, wait: bool = False) -> int:
+        """
+        Records the finished attachments in the state. With wait all queued attachments are awaited.
+        :return: the number of issues whose attachments are still queued
+        """
+        pending = []
+        for future, queued in self._pending:
+            if not wait and not future.done():
+                pending.append((future, queued))
+                continue
+            self._queued -= queued
+            for result in future.result():
+                self._state.update_attachment(result.jira_issue_key, result.url, result.digest, result.attachment_id,
+                                              result.name)
+        self._pending = pending
+        return len(pending)
+
+    def close(self):
+        self.collect(wait=True)
+        self._executor.shutdown()
+
+    def _mirror_all(self, jira_issue_key: str, urls: List[str], uploaded: Dict[str, str],
+                    names: Dict[str, str]) -> List[MirroredAttachment]:
+        results = []
+        for url in urls:
+            try:
+                result = self._mirror(jira_issue_key, url, uploaded, names)
+            except Exception as e:
+                # not recorded, so the attachment is mirrored again on the next sync of the issue
+                log.error(f"Failed to mirror attachment {url} to {jira_issue_key}: {e}")
+                continue
+            uploaded[result.digest] = result.attachment_id
+            names[result.digest] = result.name
+            results.append(result)
+        linked = {result.url: result.name for result in results if result.name}
+        if linked:
+            # the texts were written with the GitHub URLs, which need a GitHub login for private repositories
+            try:
+                self._jira.link_attachments(jira_issue_key, linked)
+            except Exception as e:
+                # the sync strategy links them on the next update of the issue
+                log.error(f"Failed to link the attachments of {jira_issue_key}: {e}")
+        return results
+
+    def _mirror(self, jira_issue_key: str, url: str, uploaded: Dict[str, str],
+                names: Dict[str, str]) -> MirroredAttachment:
+        with span("attachments.mirror", jira_issue=jira_issue_key), \
+                tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as file:
+            sha256 = hashlib.sha256()
+            content_type, chunks = self._github.download(url, self._chunk_size)
+            for chunk in chunks:
+                sha256.update(chunk)
+                file.write(chunk)
+            digest = sha256.hexdigest()
+            if digest in uploaded:
+                log.info(f"Attachment {url} is already attached to {jira_issue_key}")
+                return MirroredAttachment(jira_issue_key, url, digest, uploaded[digest], names.get(digest))
+            file.seek(0)
+            name = _file_name(url, content_type)
+            attachment_id = self._jira.add_attachment(jira_issue_key, file, name)
+            return MirroredAttachment(jira_issue_key, url, digest, attachment_id, name)
+
+
+def _file_name(url: str, content_type: Optional[str]) -> str:
+    name = urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+    if "." not in name and content_type:
+        name += mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return name
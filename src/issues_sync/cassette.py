@@ -0,0 +1,307 @@
+"""
+Records the HTTP traffic of a run (GitHub and Jira) into a cassette and replays it without network access,
+so that a slow run can be reproduced, profiled and benchmarked offline with exactly the same responses.
+
+    with recording("run.cassette.gz", state_file):
+        ...  # a sync
+
+    with replaying("run.cassette.gz", timing_scale=1.0) as cassette:
+        state_file = cassette.restore_state(directory)
+        ...  # the same sync on the restored state
+
+The traffic is captured at the transport adapter of `requests`, which both PyGithub and the jira library use,
+so it includes the requests made while connecting and by all threads.
+"""
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from issues_sync.file_state import outbox_file
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+REDACTED = "REDACTED"
+SECRET_HEADERS = {"authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key", "x-amz-security-token"}
+SECRET_PARAMS = {"access_token", "token", "password", "client_secret", "api_key", "apikey", "sig", "signature", "jwt"}
+# e.g. the credential, signature and session token of the pre-signed S3 URLs that attachment downloads redirect to
+SECRET_PARAM_PREFIXES = ("x-amz-",)
+# the body is stored decoded, so headers describing the encoding on the wire are not replayed
+WIRE_HEADERS = {"content-encoding", "transfer-encoding", "content-length"}
+
+_original_send = HTTPAdapter.send
+
+
+class CassetteMiss(requests.ConnectionError):
+    """A request for which the cassette has no recorded response."""
+
+
+@dataclass
+class Interaction:
+    method: str
+    # URL with credentials redacted
+    url: str
+    request_headers: Dict[str, str]
+    # digest of the request body (bodies are not stored, they can be large uploads)
+    body_digest: Optional[str]
+    # seconds since the start of the recording and duration of the exchange
+    offset: float
+    elapsed: float
+    status: Optional[int] = None
+    reason: Optional[str] = None
+    response_headers: Dict[str, str] = field(default_factory=dict)
+    # the response body as text, or base64 encoded if it is not UTF-8
+    body: Optional[str] = None
+    body_base64: bool = False
+    # the exception class and message if the request failed (e.g. a dropped connection)
+    error: Optional[Tuple[str, str]] = None
+
+    def content(self) -> bytes:
+        if self.body is None:
+            return b""
+        return base64.b64decode(self.body) if self.body_base64 else self.body.encode("utf-8")
+
+
+class Cassette:
+
+    def __init__(self, interactions: Optional[List[Interaction]] = None, metadata: Optional[Dict[str, Any]] = None,
+                 state: Optional[str] = None, outbox: Optional[str] = None) -> None:
+        self.interactions = interactions or []
+        self.metadata = metadata or {}
+        # the state file and its outbox log at the start of the recording
+        self.state = state
+        self.outbox = outbox
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        # per match level (see take): key -> indexes of the interactions not replayed yet, in recorded order
+        self._queues: List[Dict[Tuple, Deque[int]]] = []
+        self._replayed = set()
+        self.misses = 0
+
+    def add(self, interaction: Interaction):
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def offset(self) -> float:
+        return time.perf_counter() - self._started
+
+    def save(self, file: str):
+        path = Path(file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"version": VERSION, "metadata": self.metadata, "state": self.state,
+                                "outbox": self.outbox}) + "\n")
+            with self._lock:
+                for interaction in self.interactions:
+                    f.write(json.dumps(asdict(interaction)) + "\n")
+
+    @classmethod
+    def load(cls, file: str) -> "Cassette":
+        with gzip.open(file, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != VERSION:
+                raise ValueError(f"Unsupported cassette version {header.get('version')} in {file}")
+            interactions = []
+            for line in f:
+                data = json.loads(line)
+                data["error"] = tuple(data["error"]) if data.get("error") else None
+                interactions.append(Interaction(**data))
+        return cls(interactions, header.get("metadata"), header.get("state"), header.get("outbox"))
+
+    def restore_state(self, directory: str) -> str:
+        """
+        Writes the state recorded with the cassette to a state file in the directory and returns its path,
+        so that a replay starts from the same state (e.g. the same last sync time) without changing the real one.
+        """
+        path = Path(directory) / "mapping.state.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.state is not None:
+            path.write_text(self.state)
+        if self.outbox is not None:
+            outbox_file(path).write_text(self.outbox)
+        return str(path)
+
+    def take(self, method: str, url: str, body_digest: Optional[str]) -> Optional[Interaction]:
+        """
+        Returns the next recorded interaction for a request: the same method, URL and body, else the same method
+        and URL, else the same method and path (e.g. a search whose time window moved), in recorded order.
+        """
+        keys = _match_keys(method, url, body_digest)
+        with self._lock:
+            if not self._queues:
+                self._queues = [defaultdict(deque) for _ in keys]
+                for index, interaction in enumerate(self.interactions):
+                    interaction_keys = _match_keys(interaction.method, interaction.url, interaction.body_digest)
+                    for queues, key in zip(self._queues, interaction_keys):
+                        queues[key].append(index)
+            for queues, key in zip(self._queues, keys):
+                queue = queues.get(key)
+                while queue and queue[0] in self._replayed:
+                    queue.popleft()
+                if queue:
+                    index = queue.popleft()
+                    self._replayed.add(index)
+                    return self.interactions[index]
+            self.misses += 1
+            return None
+
+    @property
+    def unused(self) -> int:
+        return len(self.interactions) - len(self._replayed)
+
+
+@contextmanager
+def recording(file: str, state_file: Optional[str] = None) -> Iterator[Cassette]:
+    """
+    Records the HTTP traffic in the context (and the state file as it is at the start) into a compressed cassette.
+    Credentials in headers and URLs are redacted. The cassette is written when the context ends, also on errors.
+    """
+    state = Path(state_file).read_text() if state_file and os.path.exists(state_file) else None
+    outbox = outbox_file(state_file).read_text() if state_file and outbox_file(state_file).exists() else None
+    cassette = Cassette(metadata={"recorded_at": datetime.datetime.utcnow().isoformat()}, state=state, outbox=outbox)
+
+    def send(adapter: HTTPAdapter, request: requests.PreparedRequest, **kwargs):
+        offset = cassette.offset()
+        start = time.perf_counter()
+        try:
+            response = _original_send(adapter, request, **kwargs)
+            content = response.content
+        except requests.RequestException as e:
+            cassette.add(_interaction(request, offset, time.perf_counter() - start,
+                                      error=(type(e).__name__, str(e))))
+            raise
+        cassette.add(_interaction(request, offset, time.perf_counter() - start, response, content))
+        return response
+
+    with _transport(send):
+        try:
+            yield cassette
+        finally:
+            cassette.save(file)
+            log.info(f"Recorded {len(cassette.interactions)} HTTP exchanges to {file}")
+
+
+@contextmanager
+def replaying(file: str, timing_scale: float = 1.0) -> Iterator[Cassette]:
+    """
+    Serves the HTTP requests in the context from a cassette instead of the network. Each response takes its
+    recorded time multiplied by timing_scale (0 for no delay). Requests that were not recorded fail with CassetteMiss.
+    """
+    cassette = Cassette.load(file)
+    log.info(f"Replaying {len(cassette.interactions)} HTTP exchanges from {file} "
+             f"recorded at {cassette.metadata.get('recorded_at')}")
+
+    def send(adapter: HTTPAdapter, request: requests.PreparedRequest, **kwargs):
+        interaction = cassette.take(request.method, _redact_url(request.url), _digest(request.body))
+        if interaction is None:
+            raise CassetteMiss(f"No recorded response for {request.method} {_redact_url(request.url)}",
+                               request=request)
+        if timing_scale > 0:
+            time.sleep(interaction.elapsed * timing_scale)
+        if interaction.error is not None:
+            raise requests.ConnectionError(f"{interaction.error[0]}: {interaction.error[1]}", request=request)
+        return _response(adapter, request, interaction)
+
+    with _transport(send):
+        try:
+            yield cassette
+        finally:
+            log.info(f"Replay done: {cassette.misses} requests not in the cassette, "
+                     f"{cassette.unused} recorded exchanges not replayed")
+
+
+@contextmanager
+def _transport(send):
+    # all sessions send through HTTPAdapter, including the ones created while connecting
+    HTTPAdapter.send = send
+    try:
+        yield
+    finally:
+        HTTPAdapter.send = _original_send
+
+
+def _interaction(request: requests.PreparedRequest, offset: float, elapsed: float,
+                 response: Optional[requests.Response] = None, content: Optional[bytes] = None,
+                 error: Optional[Tuple[str, str]] = None) -> Interaction:
+    interaction = Interaction(method=request.method, url=_redact_url(request.url),
+                              request_headers=_redact_headers(request.headers), body_digest=_digest(request.body),
+                              offset=round(offset, 6), elapsed=round(elapsed, 6), error=error)
+    if response is not None:
+        interaction.status = response.status_code
+        interaction.reason = response.reason
+        interaction.response_headers = _redact_headers(response.headers)
+        try:
+            interaction.body = (content or b"").decode("utf-8")
+        except UnicodeDecodeError:
+            interaction.body = base64.b64encode(content).decode("ascii")
+            interaction.body_base64 = True
+    return interaction
+
+
+def _response(adapter: HTTPAdapter, request: requests.PreparedRequest, interaction: Interaction) -> requests.Response:
+    response = requests.Response()
+    response.status_code = interaction.status
+    response.reason = interaction.reason
+    response.headers = CaseInsensitiveDict({k: v for k, v in interaction.response_headers.items()
+                                            if k.lower() not in WIRE_HEADERS})
+    response._content = interaction.content()
+    response._content_consumed = True
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    response.connection = adapter
+    response.elapsed = datetime.timedelta(seconds=interaction.elapsed)
+    return response
+
+
+def _redact_headers(headers) -> Dict[str, str]:
+    return {k: REDACTED if k.lower() in SECRET_HEADERS else v for k, v in (headers or {}).items()}
+
+
+def _redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    netloc = parts.netloc.rsplit("@", 1)[-1]
+    query = urlencode([(k, REDACTED if _is_secret_param(k.lower()) else v)
+                       for k, v in parse_qsl(parts.query, keep_blank_values=True)])
+    return parts._replace(netloc=netloc, query=query).geturl()
+
+
+def _is_secret_param(name: str) -> bool:
+    return name in SECRET_PARAMS or name.startswith(SECRET_PARAM_PREFIXES)
+
+
+def _digest(body) -> Optional[str]:
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not isinstance(body, bytes):
+        # streamed uploads cannot be read without consuming them
+        return None
+    return hashlib.sha256(body).hexdigest()
+
+
+def _match_keys(method: str, url: str, body_digest: Optional[str]) -> Tuple[Tuple, ...]:
+    # the host is not matched, so a cassette can be replayed with another URL for the same server
+    parts = urlsplit(url)
+    path = parts.path
+    path_and_query = f"{parts.path}?{parts.query}"
+    return (method, path_and_query, body_digest), (method, path_and_query), (method, path)
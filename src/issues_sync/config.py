@@ -15,6 +15,9 @@ class JiraConfig:
     token: Optional[str] = None
     user: Optional[str] = None
     password: Optional[str] = None
+    # GitHub login -> Jira user name or email, GitHub label -> Jira label
+    user_mapping: Optional[dict] = None
+    label_mapping: Optional[dict] = None
 
 
 @dataclass
@@ -34,6 +37,21 @@ class Config:
         self.jira = JiraConfig(**self._get_config("jira", config, [f.name for f in fields(JiraConfig)]))
         self.github = GithubConfig(**self._get_config("github", config, [f.name for f in fields(GithubConfig)]))
         self.dry_run = config.get("system", {}).get("dry_run", False)
+        self.metrics_file = config.get("system", {}).get("metrics_file")
+        self.metrics_port = config.get("system", {}).get("metrics_port")
+        self.trace_file = config.get("system", {}).get("trace_file")
+        self.trace_otlp_endpoint = config.get("system", {}).get("trace_otlp_endpoint")
+        self.lease_policy = config.get("system", {}).get("lease_policy", "exit")
+        self.lease_ttl = config.get("system", {}).get("lease_ttl", 3600)
+        self.lease_wait = config.get("system", {}).get("lease_wait", 3600)
+        self.mirror_attachments = config.get("system", {}).get("mirror_attachments", False)
+        self.attachment_workers = config.get("system", {}).get("attachment_workers", 2)
+        self.pipeline = config.get("system", {}).get("pipeline", False)
+        self.pipeline_workers = config.get("system", {}).get("pipeline_workers", {})
+        self.pipeline_queue_size = config.get("system", {}).get("pipeline_queue_size", 16)
+        self.report_file = config.get("system", {}).get("report_file")
+        self.report_history_size = config.get("system", {}).get("report_history_size", 500)
+        self.max_watermark_lag = config.get("system", {}).get("max_watermark_lag", 86400)
 
     @staticmethod
     def _load(file: str) -> dict:
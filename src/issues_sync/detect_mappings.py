@@ -1,11 +1,14 @@
 import logging
 from datetime import datetime, timedelta
+from itertools import islice
 
 import click
 
 from issues_sync.config import Config
 from issues_sync.github_connection import GithubConnection
 from issues_sync.jira_connection import JiraConnection
+from issues_sync.profiling import profile
+from issues_sync.tracing import span
 
 if not logging.root.handlers:
     # Configure logging
@@ -13,30 +16,48 @@ if not logging.root.handlers:
 
 log = logging.getLogger(__name__)
 
+LABEL_BATCH_SIZE = 200
+
 
 @click.command()
 @click.argument('output_file', type=click.File('w'), default='mappings.csv')
-def detect_mappings(output_file):
-    config = Config()
-    github = GithubConnection(config.github)
-    jira = JiraConnection(config.jira)
+@click.option('--profile', 'profile_file', type=click.Path(dir_okay=False),
+              help="Profile the run: write a cProfile dump to the file and print the time per phase "
+                   "and of the slowest issues.")
+@click.option('--profile-top', default=10, show_default=True, help="Slowest issues to print with --profile.")
+def detect_mappings(output_file, profile_file, profile_top):
+    with profile(profile_file, profile_top):
+        _detect_mappings(output_file)
+
+
+def _detect_mappings(output_file):
+    with span("config.load"):
+        config = Config()
+    with span("connect"):
+        github = GithubConnection(config.github)
+        jira = JiraConnection(config.jira)
 
     github_issues = github.get_issues(datetime.now() - timedelta(days=30 * 365))
-    log.info(f"Found {len(github_issues)} github issues.")
 
     mappings = dict()
 
-    for github_issue in github_issues:
-        issue_key = jira.find_issue_id_by_title(github_issue.title.value)
-        if issue_key is not None:
-            if github_issue.key in mappings:
-                log.warning(f"Duplicate github issue: {github_issue.key} to {issue_key}")
-                continue
-            mappings[github_issue.key] = issue_key
-            issue = jira.get_issue(issue_key)
-            output_file.write(f"{github_issue.key}, {issue_key}, {github_issue.title}, {issue.title} \n")
-        else:
-            log.info(f"Jira issue not found for github issue {github_issue.key} {github_issue.title}")
+    for batch in iter(lambda: list(islice(github_issues, LABEL_BATCH_SIZE)), []):
+        # issues created by the sync carry their identity label and are found with one search per batch
+        by_label = jira.find_issue_keys_by_labels([i.identity for i in batch if i.identity])
+        for github_issue in batch:
+            with span("detect_mapping", github_issue=github_issue.key):
+                issue_key = by_label.get(github_issue.identity)
+                if issue_key is None:
+                    issue_key = jira.find_issue_id_by_title(github_issue.title.value)
+                if issue_key is not None:
+                    if github_issue.key in mappings:
+                        log.warning(f"Duplicate github issue: {github_issue.key} to {issue_key}")
+                        continue
+                    mappings[github_issue.key] = issue_key
+                    issue = jira.get_issue(issue_key)
+                    output_file.write(f"{github_issue.key}, {issue_key}, {github_issue.title}, {issue.title} \n")
+                else:
+                    log.info(f"Jira issue not found for github issue {github_issue.key} {github_issue.title}")
 
 
 if __name__ == '__main__':
@@ -1,15 +1,58 @@
 import datetime
 import json
 import os
+from collections import OrderedDict
 from pathlib import Path
+from typing import IO, Callable, Optional
 
-from issues_sync.state import State
+from issues_sync.freshness import LagHistogram
+from issues_sync.lease import FileLease
+from issues_sync.state import State, FailedIssue, OutboxEntry
+from issues_sync.tracing import span
+
+
+DEFAULT_STATE_FILE = os.path.expanduser('~/.vdk/mapping.state.json')
+
+# rendered markup is cached in a separate file (written at most every RENDERED_MARKUP_SAVE_INTERVAL new entries)
+# so that the state file, which is written after every created issue, stays small
+MAX_RENDERED_MARKUP = 2000
+RENDERED_MARKUP_SAVE_INTERVAL = 100
+# the sync cursor moves after every issue but is written only every CURSOR_SAVE_INTERVAL issues (and with any other
+# change of the state): after a crash at most that many issues are synced again, which makes no changes in Jira
+CURSOR_SAVE_INTERVAL = 100
+
+
+def outbox_file(state_file) -> Path:
+    """
+    Returns the outbox log of a state file. Outbox entries are appended to the log instead of rewriting the state
+    file twice per Jira write, and folded into the state file whenever it is written.
+    """
+    path = Path(state_file)
+    return path.with_name(path.name.replace('.json', '') + '.outbox.jsonl')
 
 
 class InFileState(State):
 
-    def __init__(self, file: str = os.path.expanduser('~/.vdk/mapping.state.json')) -> None:
+    def __init__(self, file: str = DEFAULT_STATE_FILE) -> None:
         self._state_file = Path(file)
+        self._markup_file = self._state_file.with_name(self._state_file.name.replace('.json', '') + '.markup.json')
+        # reports of the runs on this state (see report.append_history)
+        self.history_file = str(self._state_file.with_name(self._state_file.name.replace('.json', '') + '.runs.jsonl'))
+        self._outbox_file = outbox_file(self._state_file)
+        # whether the outbox log has entries that are not in the state file yet
+        self._outbox_logged = False
+        # whether the last line of the outbox log is incomplete, e.g. because the process died while appending it
+        self._outbox_torn = False
+        self._rendered_markup = None
+        self._unsaved_markup = 0
+        self._load()
+
+    def _load(self):
+        with span("state.load"):
+            self._read_state()
+
+    def _read_state(self):
+        self._unsaved_cursor = 0
         if self._state_file.exists():
             with self._state_file.open('r') as f:
                 state_data = json.load(f)
@@ -17,11 +60,57 @@ class InFileState(State):
             self._mapping_jira_to_github = state_data.get('mapping_jira_to_github', {})
             self._mapping_status_message = state_data.get('mapping_status_message', {})
             self._last_sync_time = datetime.datetime.fromisoformat(state_data.get('last_sync_time', '2022-01-01T00:00:00'))
+            self._last_synced_keys = state_data.get('last_synced_keys', [])
+            last_jira_sync_time = state_data.get('last_jira_sync_time')
+            self._last_jira_sync_time = \
+                datetime.datetime.fromisoformat(last_jira_sync_time) if last_jira_sync_time else None
+            self._failed_issues = {
+                key: FailedIssue(key, f['error'], f['attempts'], datetime.datetime.fromisoformat(f['next_retry_time']))
+                for key, f in state_data.get('failed_issues', {}).items()
+            }
+            self._outbox = {key: _outbox_entry(key, e) for key, e in state_data.get('outbox', {}).items()}
+            self._attachments = state_data.get('attachments', {})
+            self._attachment_digests = state_data.get('attachment_digests', {})
+            self._attachment_names = state_data.get('attachment_names', {})
+            self._lag_histogram = LagHistogram.from_dict(state_data.get('lag_histogram', {}))
         else:
             self._mapping_github_to_jira = {}
             self._mapping_jira_to_github = {}
             self._mapping_status_message = {}
             self._last_sync_time = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+            self._last_synced_keys = []
+            self._last_jira_sync_time = None
+            self._failed_issues = {}
+            self._outbox = {}
+            self._attachments = {}
+            self._attachment_digests = {}
+            self._attachment_names = {}
+            self._lag_histogram = LagHistogram()
+        self._replay_outbox()
+
+    def _replay_outbox(self):
+        self._outbox_logged = False
+        self._outbox_torn = False
+        if not self._outbox_file.exists():
+            return
+        with self._outbox_file.open('r') as f:
+            for line in f:
+                self._outbox_torn = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('removed'):
+                    self._outbox.pop(record['key'], None)
+                else:
+                    self._outbox[record['key']] = _outbox_entry(record['key'], record)
+                self._outbox_logged = True
+
+    def reload(self):
+        self._load()
+
+    def lease(self, ttl: datetime.timedelta) -> FileLease:
+        return FileLease(f"{self._state_file}.lock", ttl)
 
     def get_jira_issue(self, github_issue_no):
         return self._mapping_github_to_jira.get(github_issue_no, None)
@@ -39,17 +128,170 @@ class InFileState(State):
 
     def update_last_sync_time(self, sync_time: datetime.datetime):
         self._last_sync_time = sync_time
+        self._last_synced_keys = []
+        self._save_state()
+
+    def get_last_synced_keys(self):
+        return self._last_synced_keys
+
+    def update_sync_cursor(self, sync_time: datetime.datetime, synced_keys):
+        self._last_sync_time = sync_time
+        self._last_synced_keys = list(synced_keys)
+        self._unsaved_cursor += 1
+        if self._unsaved_cursor >= CURSOR_SAVE_INTERVAL:
+            self._save_state()
+
+    def get_last_jira_sync_time(self):
+        return self._last_jira_sync_time
+
+    def update_last_jira_sync_time(self, sync_time: datetime.datetime):
+        self._last_jira_sync_time = sync_time
+        self._save_state()
+
+    def get_failed_issues(self):
+        return self._failed_issues
+
+    def update_failed_issue(self, failed_issue: FailedIssue):
+        self._failed_issues[failed_issue.github_issue_no] = failed_issue
+        self._save_state()
+
+    def remove_failed_issue(self, github_issue_no):
+        if self._failed_issues.pop(github_issue_no, None) is not None:
+            self._save_state()
+
+    def get_outbox(self):
+        return self._outbox
+
+    def add_outbox_entry(self, entry: OutboxEntry):
+        self._outbox[entry.key] = entry
+        self._append_outbox(dict(_outbox_data(entry), key=entry.key))
+
+    def remove_outbox_entry(self, key: str):
+        if self._outbox.pop(key, None) is not None:
+            self._append_outbox({'key': key, 'removed': True})
+
+    def _append_outbox(self, record: dict):
+        # the entry must be on disk before the Jira write it records is made
+        with span("state.save", file="outbox"):
+            self._outbox_file.parent.mkdir(parents=True, exist_ok=True)
+            with self._outbox_file.open('a') as f:
+                f.write(('\n' if self._outbox_torn else '') + json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self._outbox_logged = True
+        self._outbox_torn = False
+
+    def get_attachments(self, jira_issue_key: str):
+        return self._attachments.get(jira_issue_key, {})
+
+    def get_attachment_digest(self, url: str):
+        return self._attachment_digests.get(url)
+
+    def get_attachment_names(self, jira_issue_key: str):
+        return self._attachment_names.get(jira_issue_key, {})
+
+    def update_attachment(self, jira_issue_key: str, url: str, digest: str, attachment_id: str,
+                          name: Optional[str] = None):
+        self._attachments.setdefault(jira_issue_key, {})[digest] = attachment_id
+        self._attachment_digests[url] = digest
+        if name is not None:
+            self._attachment_names.setdefault(jira_issue_key, {})[url] = name
         self._save_state()
 
+    def get_lag_histogram(self):
+        return self._lag_histogram
+
+    def update_lag_histogram(self, histogram: LagHistogram):
+        self._lag_histogram = histogram
+        self._save_state()
+
+    def get_rendered_markup(self, digest: str):
+        rendered_markup = self._get_rendered_markup_cache()
+        rendered = rendered_markup.get(digest)
+        if rendered is not None:
+            rendered_markup.move_to_end(digest)
+        return rendered
+
+    def update_rendered_markup(self, digest: str, rendered: str):
+        rendered_markup = self._get_rendered_markup_cache()
+        rendered_markup[digest] = rendered
+        rendered_markup.move_to_end(digest)
+        while len(rendered_markup) > MAX_RENDERED_MARKUP:
+            rendered_markup.popitem(last=False)
+        self._unsaved_markup += 1
+        if self._unsaved_markup >= RENDERED_MARKUP_SAVE_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self._unsaved_cursor:
+            self._save_state()
+        if self._unsaved_markup:
+            with span("state.save", file="markup"):
+                self._markup_file.parent.mkdir(parents=True, exist_ok=True)
+                _replace(self._markup_file, lambda f: json.dump(self._rendered_markup, f))
+            self._unsaved_markup = 0
+
+    def _get_rendered_markup_cache(self) -> OrderedDict:
+        if self._rendered_markup is None:
+            self._rendered_markup = OrderedDict()
+            if self._markup_file.exists():
+                with self._markup_file.open('r') as f:
+                    self._rendered_markup.update(json.load(f))
+        return self._rendered_markup
+
     def _save_state(self):
+        with span("state.save"):
+            self._write_state()
+
+    def _write_state(self):
         state_data = {
             'mapping_github_to_jira': self._mapping_github_to_jira,
             'mapping_jira_to_github': self._mapping_jira_to_github,
             'last_sync_time': self._last_sync_time.isoformat(),
+            'last_synced_keys': self._last_synced_keys,
+            'last_jira_sync_time': self._last_jira_sync_time.isoformat() if self._last_jira_sync_time else None,
+            'failed_issues': {
+                key: {'error': f.error, 'attempts': f.attempts, 'next_retry_time': f.next_retry_time.isoformat()}
+                for key, f in self._failed_issues.items()
+            },
+            'outbox': {key: _outbox_data(e) for key, e in self._outbox.items()},
+            'attachments': self._attachments,
+            'attachment_digests': self._attachment_digests,
+            'attachment_names': self._attachment_names,
+            'lag_histogram': self._lag_histogram.to_dict(),
         }
-        with self._state_file.open('w') as f:
-            json.dump(state_data, f, indent=4)
+        self._state_file.parent.mkdir(parents=True, exist_ok=True)
+        _replace(self._state_file, lambda f: json.dump(state_data, f, indent=4))
+        self._unsaved_cursor = 0
+        if self._outbox_logged:
+            # the state file has the whole outbox now, so the log starts over
+            with self._outbox_file.open('w'):
+                pass
+            self._outbox_logged = False
+            self._outbox_torn = False
 
     def update_mapping_status(self, github_issue_no, jira_issue_key, status_message):
         self._mapping_status_message[(github_issue_no, jira_issue_key)] = status_message
-        self._save_state()
\ No newline at end of file
+        self._save_state()
+
+
+def _replace(path: Path, write: Callable[[IO], None]):
+    """
+    Writes a file through a temporary file next to it, so a crash while writing leaves the previous file intact.
+    """
+    temp_file = path.with_name(path.name + '.tmp')
+    with temp_file.open('w') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+
+
+def _outbox_data(entry: OutboxEntry) -> dict:
+    return {'action': entry.action, 'github_issue_no': entry.github_issue_no, 'jira_issue_key': entry.jira_issue_key,
+            'created_at': entry.created_at.isoformat()}
+
+
+def _outbox_entry(key: str, data: dict) -> OutboxEntry:
+    return OutboxEntry(key, data['action'], data['github_issue_no'], data['jira_issue_key'],
+                       datetime.datetime.fromisoformat(data['created_at']))
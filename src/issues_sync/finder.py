@@ -1,5 +1,11 @@
+from typing import Dict, List, Optional
+
+from issues_sync.issue import BaseIssue
 from issues_sync.jira_connection import JiraConnection
 from issues_sync.state import State
+from issues_sync.tracing import span
+
+_NOT_PREFETCHED = object()
 
 
 class Finder:
@@ -7,19 +13,84 @@ class Finder:
     def __init__(self, jira_connection: JiraConnection, state: State) -> None:
         self._jira_connection = jira_connection
         self._state = state
+        # identity label -> Jira issue key or None if no Jira issue has the label (see prefetch)
+        self._prefetched: Dict[str, Optional[str]] = {}
 
-    def find_jira_issue_key(self, github_issue_no, github_issue_title):
+    def prefetch(self, identities: Dict[str, str]):
         """
-        Finds a Jira issue based on a GitHub issue number and title
+        Looks up the identity labels (GitHub issue number -> label) of the unmapped issues in one search, e.g. for
+        a page of listed issues, so that find_jira_issue_key does not search their labels one by one and searches
+        by title only for the issues whose label was not found.
+        """
+        labels = [label for github_issue_no, label in identities.items()
+                  if label not in self._prefetched and not self._state.get_jira_issue(github_issue_no)]
+        if not labels:
+            return
+        with span("finder.prefetch", github_issues=len(labels)):
+            found = self._jira_connection.find_issue_keys_by_labels(labels)
+        for label in labels:
+            self._prefetched[label] = found.get(label)
+
+    def clear(self):
+        """
+        Forgets the prefetched labels, e.g. of issues the last run did not get to.
+        """
+        self._prefetched = {}
+
+    def find_jira_issue_key(self, github_issue_no, github_issue_title, identity: Optional[str] = None,
+                            save: bool = True):
         """
+        Finds a Jira issue based on a GitHub issue number, its identity label and title.
+        Issues found in Jira are saved in the state unless save is False (e.g. when the state is not used from this thread).
+        """
+        with span("finder.find_jira_issue_key", github_issue=github_issue_no):
+            return self._find_jira_issue_key(github_issue_no, github_issue_title, identity, save)
+
+    def _find_jira_issue_key(self, github_issue_no, github_issue_title, identity, save):
         jira_issue_key = self._state.get_jira_issue(github_issue_no)
         if jira_issue_key:
             return jira_issue_key
 
+        if identity:
+            # each issue is looked up once, afterwards it is mapped or created
+            jira_issue_key = self._prefetched.pop(identity, _NOT_PREFETCHED)
+            if jira_issue_key is _NOT_PREFETCHED:
+                jira_issue_key = self._jira_connection.find_issue_keys_by_labels([identity]).get(identity)
+            if jira_issue_key:
+                if save:
+                    self._state.update(github_issue_no, jira_issue_key)
+                return jira_issue_key
+
         jira_issue_key = self._jira_connection.find_issue_id_by_title(github_issue_title)
         if jira_issue_key:
-            self._state.update(github_issue_no, jira_issue_key)
+            if save:
+                self._state.update(github_issue_no, jira_issue_key)
             return jira_issue_key
 
         return None
 
+    def find_jira_issue_keys(self, github_issues: List[BaseIssue], save: bool = True) -> Dict[str, Optional[str]]:
+        """
+        Finds the Jira issues of many GitHub issues: from the state, then with one label search per batch
+        and only for the remaining issues (e.g. created before identity labels) by title.
+        Issues found in Jira are saved in the state unless save is False (e.g. for a plan).
+        :return: GitHub issue number -> Jira issue key or None
+        """
+        with span("finder.find_jira_issue_keys", github_issues=len(github_issues)):
+            result = {}
+            missing = []
+            for github_issue in github_issues:
+                result[github_issue.key] = self._state.get_jira_issue(github_issue.key)
+                if not result[github_issue.key]:
+                    missing.append(github_issue)
+
+            labels = [i.identity for i in missing if i.identity]
+            by_label = self._jira_connection.find_issue_keys_by_labels(labels) if labels else {}
+            for github_issue in missing:
+                jira_issue_key = by_label.get(github_issue.identity)
+                if not jira_issue_key:
+                    jira_issue_key = self._jira_connection.find_issue_id_by_title(github_issue.title.value)
+                if jira_issue_key and save:
+                    self._state.update(github_issue.key, jira_issue_key)
+                result[github_issue.key] = jira_issue_key
+            return result
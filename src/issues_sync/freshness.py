@@ -0,0 +1,78 @@
+import math
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+# upper bounds (seconds) of the lag buckets: 1, 5, 15 and 30 minutes, 1, 2, 6 and 12 hours, 1, 3 and 7 days
+LAG_BUCKETS = (60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 21600.0, 43200.0, 86400.0, 259200.0, 604800.0)
+
+# runs kept in the rolling histogram
+LAG_WINDOW = 100
+
+# name -> percentile of the lag reported per run and as metrics
+LAG_PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("max", 1.0))
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """
+    Returns the q-th (0 < q <= 1) percentile of the values by nearest rank, None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+@dataclass
+class LagHistogram:
+    """
+    Rolling histogram of the sync lag (seconds from the GitHub change until the Jira write succeeded): the bucket
+    counts and the maximum of each of the last `window` runs, so that the oldest run drops out as a new one is added.
+    """
+    buckets: Tuple[float, ...] = LAG_BUCKETS
+    # per run, oldest first: counts per bucket, the last count being above the last bucket
+    runs: List[List[int]] = field(default_factory=list)
+    maxima: List[float] = field(default_factory=list)
+    window: int = LAG_WINDOW
+
+    def add_run(self, lags: Sequence[float]):
+        counts = [0] * (len(self.buckets) + 1)
+        for lag in lags:
+            counts[bisect_left(self.buckets, lag)] += 1
+        self.runs = (self.runs + [counts])[-self.window:]
+        self.maxima = (self.maxima + [max(lags, default=0.0)])[-self.window:]
+
+    @property
+    def counts(self) -> List[int]:
+        return [sum(bucket) for bucket in zip(*self.runs)] if self.runs else [0] * (len(self.buckets) + 1)
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @property
+    def max(self) -> Optional[float]:
+        return max(self.maxima) if self.count else None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Returns the upper bound of the bucket of the q-th percentile (at most the maximum), None if empty.
+        """
+        total = self.count
+        if not total:
+            return None
+        rank = max(1, math.ceil(q * total))
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {"buckets": list(self.buckets), "runs": self.runs, "maxima": self.maxima}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LagHistogram":
+        return cls(buckets=tuple(data.get("buckets", LAG_BUCKETS)), runs=data.get("runs", []),
+                   maxima=data.get("maxima", []))
@@ -1,26 +1,56 @@
 import datetime
 import logging
-from typing import Optional, List
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
 
 import github.Issue
+import requests
 
 from issues_sync.config import GithubConfig
-from issues_sync.issue import BaseIssue, BaseIssueField, BaseIssueComment, BaseIssueStatus
+from issues_sync.issue import BaseIssue, BaseIssueField, BaseIssueComment, BaseIssueStatus, intern, \
+    github_label
+from issues_sync.metrics import Metrics, instrument, track
+from issues_sync.tracing import span
+from issues_sync.utils import to_utc
 
 log = logging.getLogger(__name__)
 
+PER_PAGE = 100
 
-def convert_to_base_issue(github_issue: github.Issue.Issue) -> BaseIssue:
+
+def api_url(url: Optional[str]) -> str:
+    """
+    Returns the REST API URL for the configured GitHub URL: api.github.com for github.com and <url>/api/v3 for
+    GitHub Enterprise Server.
+    """
+    if not url or urlparse(url).hostname in ("github.com", "www.github.com", "api.github.com"):
+        return "https://api.github.com"
+    url = url.rstrip("/")
+    return url if url.endswith("/api/v3") else f"{url}/api/v3"
+
+
+def convert_to_base_issue(github_issue: github.Issue.Issue, with_comments: bool = True) -> BaseIssue:
+    """
+    Converts a GitHub issue. Without comments the comment thread is not read and the issue's comments are None
+    (i.e. unchanged).
+    """
     id = str(github_issue.number)
     project = github_issue.repository.name
     title = BaseIssueField(github_issue.title, github_issue.updated_at)
     description = BaseIssueField(github_issue.body, github_issue.updated_at)
-    comments = []
-    for github_comment in github_issue.get_comments():
-        body = BaseIssueField(github_comment.body, github_comment.updated_at)
-        user = BaseIssueField(github_comment.user.login, github_comment.user.updated_at)
-        comment = BaseIssueComment(body, user, github_comment.updated_at)
-        comments.append(comment)
+    comments = None
+    if with_comments:
+        comments = []
+        # the comment count is part of the issue payload, so empty threads are not requested
+        if github_issue.comments != 0:
+            with track("get_comments"), span("github.get_comments", github_issue=id):
+                for github_comment in github_issue.get_comments():
+                    updated_at = github_comment.updated_at
+                    body = BaseIssueField(github_comment.body, updated_at)
+                    # user.updated_at is not part of the comment payload and reading it would fetch the user
+                    user = BaseIssueField(intern(github_comment.user.login), updated_at)
+                    comment = BaseIssueComment(body, user, updated_at)
+                    comments.append(comment)
     updated_at = github_issue.updated_at
     if github_issue.updated_at is None:
         updated_at = github_issue.closed_at
@@ -28,16 +58,89 @@ def convert_to_base_issue(github_issue: github.Issue.Issue) -> BaseIssue:
         updated_at = github_issue.created_at
     if github_issue.updated_at is None:
         updated_at = github_issue.milestone.updated_at
-    status = BaseIssueField(BaseIssueStatus(github_issue.state.upper()), github_issue.updated_at)
+    status = BaseIssueStatus(github_issue.state.upper())
+    # for closed issues the status was last changed when the issue was closed
+    status_updated_at = github_issue.updated_at
+    if status == BaseIssueStatus.CLOSED and github_issue.closed_at is not None:
+        status_updated_at = github_issue.closed_at
+    status = BaseIssueField(status, status_updated_at)
     html_url = github_issue.html_url
-    return BaseIssue(id, project, title, description, status, comments, updated_at, html_url)
+    # labels, assignees and milestone are part of the issue payload, so reading them makes no requests
+    labels = [intern(label.name) for label in github_issue.labels]
+    assignees = [intern(assignee.login) for assignee in github_issue.assignees]
+    milestone = github_issue.milestone.title if github_issue.milestone is not None else None
+    return BaseIssue(id, project, title, description, status, comments, updated_at, html_url,
+                     identity=github_label(project, id), labels=labels, assignees=assignees, milestone=milestone,
+                     comment_count=github_issue.comments)
+
+
+class CommentFeed:
+    """
+    Reads the repository-wide feed of comments changed since a time (least recently updated first) in one paginated
+    stream, as far as needed, and remembers which issues have changed comments.
+    """
+
+    def __init__(self, repo, since: datetime.datetime) -> None:
+        self._comments = iter(repo.get_issues_comments(sort="updated", direction="asc", since=since))
+        self._read_until = None
+        self._changed = set()
+        self._exhausted = False
+
+    def has_changes(self, issue_number: int, until: datetime.datetime) -> bool:
+        """
+        Returns whether the issue has comments changed since the feed start and at the latest `until`.
+        Calls must be in ascending `until` order, like the issues are listed.
+        """
+        with track("get_comments"), span("github.comment_feed"):
+            while not self._exhausted and (self._read_until is None or to_utc(self._read_until) <= to_utc(until)):
+                comment = next(self._comments, None)
+                if comment is None:
+                    self._exhausted = True
+                    break
+                self._read_until = comment.updated_at
+                self._changed.add(int(comment.issue_url.rsplit("/", 1)[1]))
+        return issue_number in self._changed
 
 
 class GithubConnection:
+    # method name -> logical operation name used in metrics
+    OPERATIONS = {
+        "find_issue_id_by_title": "search",
+        "get_issues": "get_issues",
+        "get_issue": "get_issue",
+        "update_issue": "update",
+        "update_issue_status": "update",
+        "create_issue": "create",
+        "download": "download",
+    }
 
-    def __init__(self, config: GithubConfig) -> None:
-        g = github.Github(config.token)
+    def __init__(self, config: GithubConfig, metrics: Optional[Metrics] = None) -> None:
+        g = github.Github(config.token, base_url=api_url(config.url), per_page=PER_PAGE)
         self._repo = g.get_repo(config.project)
+        # attachments are downloaded directly, authenticated for attachments of private repositories
+        self._download_session = requests.Session()
+        if config.token:
+            self._download_session.headers["Authorization"] = f"token {config.token}"
+        if metrics is not None:
+            instrument(self, "github", self.OPERATIONS, metrics)
+            self.configure_session(lambda session: session.hooks["response"].append(metrics.on_response))
+
+    def configure_session(self, configure: Callable[[requests.Session], None]):
+        """
+        Applies configure to every HTTP session PyGithub opens for this repository (e.g. to add response hooks).
+        """
+        requester = self._repo._requester
+        connection_class = requester._Requester__connectionClass
+
+        class ConfiguredConnection(connection_class):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                configure(self.session)
+
+        requester._Requester__connectionClass = ConfiguredConnection
+        if requester._Requester__connection is not None:
+            configure(requester._Requester__connection.session)
+        configure(self._download_session)
 
     def find_issue_id_by_title(self, issue_title) -> Optional[str]:
         issues = self._repo.get_issues(state="all")
@@ -46,44 +149,115 @@ class GithubConnection:
                 return str(issue.number)
         return None
 
-    def get_issues(self, since_time: datetime.datetime) -> List[BaseIssue]:
-        github_issues = self._repo.get_issues(since=since_time, state="all")
-        result = []
-        for github_issue in github_issues:
-            if github_issue.pull_request is not None:
-                continue
-            # issue = Issue(title=github_issue.title,
-            #               body=github_issue.body,
-            #               comments=self._get_comments(github_issue),
-            #               updated_at=github_issue.updated_at)
-            result.append(convert_to_base_issue(github_issue))
-        log.info(f"Found {len(result)} github issues to sync")
-        return result
+    def get_issues(self, since_time: datetime.datetime,
+                   is_mapped: Optional[Callable[[str], bool]] = None,
+                   on_page: Optional[Callable[[Dict[str, str]], None]] = None) -> Iterator[BaseIssue]:
+        """
+        Yields the issues updated since the given time, least recently updated first, one page at a time.
+
+        Pages are requested by moving `since` to the last seen update time (instead of by page number)
+        so that issues updated while we page through the list cannot shift an unseen issue to a page already read.
+        Only when a whole page has the same update time we page by number within that time.
+
+        With is_mapped the comment threads are read only for issues that are not mapped yet or have changed comments
+        according to the repository-wide comment feed. The other issues have comments None (unchanged).
+
+        on_page is called with the identity labels (issue number -> label) of each page before its issues are yielded.
+        """
+        comment_feed = CommentFeed(self._repo, since_time) if is_mapped is not None else None
+        since = since_time
+        page = 0
+        # numbers of the issues already yielded that were last updated at cursor_time
+        cursor_time = None
+        seen = set()
+        count = 0
+        while True:
+            github_issues = self._repo.get_issues(since=since, state="all", sort="updated", direction="asc")
+            with span("github.list_issues", page=page):
+                github_page = github_issues.get_page(page)
+            if on_page is not None:
+                on_page({str(i.number): github_label(i.repository.name, str(i.number))
+                         for i in github_page if i.pull_request is None})
+            for github_issue in github_page:
+                if github_issue.updated_at == cursor_time and github_issue.number in seen:
+                    continue
+                if github_issue.updated_at != cursor_time:
+                    cursor_time = github_issue.updated_at
+                    seen = set()
+                seen.add(github_issue.number)
+                if github_issue.pull_request is not None:
+                    continue
+                count += 1
+                with span("github.convert_issue", github_issue=github_issue.number):
+                    with_comments = comment_feed is None or not is_mapped(str(github_issue.number)) \
+                                    or comment_feed.has_changes(github_issue.number, github_issue.updated_at)
+                    issue = convert_to_base_issue(github_issue, with_comments)
+                yield issue
+            if len(github_page) < PER_PAGE:
+                break
+            if since == cursor_time:
+                page += 1
+            else:
+                since = cursor_time
+                page = 0
+        log.info(f"Found {count} github issues to sync")
 
     def get_issue(self, issue_number) -> BaseIssue:
-        return convert_to_base_issue(self._repo.get_issue(int(issue_number)))
+        with span("github.get_issue", github_issue=issue_number):
+            return convert_to_base_issue(self._repo.get_issue(int(issue_number)))
 
     def update_issue(self, issue: BaseIssue):
-        github_issue = self._repo.get_issue(int(issue.key))
-        if issue.status.value == BaseIssueStatus.OPEN and github_issue.state == "closed":
-            github_issue.edit(state="open")
-        if issue.status.value == BaseIssueStatus.CLOSED and github_issue.state == "open":
-            github_issue.edit(state="closed")
-        if issue.title.value != github_issue.title:
-            github_issue.edit(title=issue.title.value)
-        if issue.description.value != github_issue.body:
-            github_issue.edit(body=issue.description.value)
-
-        for index, comment in enumerate(github_issue.get_comments()):
-            if comment.body != issue.comments[index].body.value:
-                comment.edit(body=issue.comments[index].body.value)
-        if github_issue.get_comments().totalCount < len(issue.comments):
-            for comment in issue.comments[github_issue.get_comments().totalCount:]:
-                github_issue.create_comment(comment.body.value)
+        with span("github.update_issue", github_issue=issue.key):
+            github_issue = self._repo.get_issue(int(issue.key))
+            if issue.status.value == BaseIssueStatus.OPEN and github_issue.state == "closed":
+                github_issue.edit(state="open")
+            if issue.status.value == BaseIssueStatus.CLOSED and github_issue.state == "open":
+                github_issue.edit(state="closed")
+            if issue.title.value != github_issue.title:
+                github_issue.edit(title=issue.title.value)
+            if issue.description.value != github_issue.body:
+                github_issue.edit(body=issue.description.value)
+
+            if issue.comments is None:
+                return
+            for index, comment in enumerate(github_issue.get_comments()):
+                if comment.body != issue.comments[index].body.value:
+                    comment.edit(body=issue.comments[index].body.value)
+            if github_issue.get_comments().totalCount < len(issue.comments):
+                for comment in issue.comments[github_issue.get_comments().totalCount:]:
+                    github_issue.create_comment(comment.body.value)
+
+    def update_issue_status(self, issue_number, status: BaseIssueStatus) -> bool:
+        """
+        Changes only the state of a GitHub issue (open/closed) if it differs.
+        :return: True if the issue was changed
+        """
+        with span("github.update_issue_status", github_issue=issue_number):
+            github_issue = self._repo.get_issue(int(issue_number))
+            state = "closed" if status == BaseIssueStatus.CLOSED else "open"
+            if github_issue.state == state:
+                return False
+            github_issue.edit(state=state)
+            return True
+
+    def download(self, url: str, chunk_size: int = 64 * 1024) -> Tuple[Optional[str], Iterator[bytes]]:
+        """
+        Downloads a file (e.g. an attachment of an issue) as a stream.
+        :return: the content type and an iterator over the chunks of the content
+        """
+        response = self._download_session.get(url, stream=True, timeout=60)
+        response.raise_for_status()
+
+        def chunks():
+            with response:
+                yield from response.iter_content(chunk_size)
+
+        return response.headers.get("Content-Type"), chunks()
 
     def create_issue(self, issue: BaseIssue) -> str:
-        github_issue = self._repo.create_issue(title=issue.title.value,
-                                               body=issue.description.value)
-        for comment in issue.comments:
-            github_issue.create_comment(comment.body.value)
-        return str(github_issue.number)
\ No newline at end of file
+        with span("github.create_issue"):
+            github_issue = self._repo.create_issue(title=issue.title.value,
+                                                   body=issue.description.value)
+            for comment in issue.comments:
+                github_issue.create_comment(comment.body.value)
+            return str(github_issue.number)
\ No newline at end of file
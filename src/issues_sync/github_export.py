@@ -0,0 +1,218 @@
+"""
+Reads GitHub issues and comments from export files instead of the API, e.g. to seed Jira for a large repository
+without spending the rate limit on listing every issue since the beginning.
+
+Supported are the REST API objects of issues and comments as JSON arrays, as concatenated arrays (like
+`gh api --paginate repos/OWNER/REPO/issues?state=all` writes them) or as JSON lines, also gzip compressed (.gz),
+and the issue and issue comment files of a GitHub migration archive. The files are streamed with constant memory:
+one issue (with its comments) at a time, the comments are joined through a temporary SQLite index on disk.
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from typing import Iterator, List, Optional, Sequence
+from urllib.parse import unquote, urlparse
+
+from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueField, BaseIssueStatus, intern, github_label
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+# characters between the objects of JSON lines, of a JSON array and of concatenated arrays
+_SEPARATORS = " \t\r\n,[]"
+
+# comments written to the index per transaction
+_COMMENT_BATCH_SIZE = 10_000
+
+
+def iter_json_objects(file: str, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Yields the objects of a JSON array, of concatenated JSON arrays or of JSON lines one at a time, reading the file
+    in chunks so that only the current object is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    opener = gzip.open if file.endswith(".gz") else open
+    with opener(file, "rt", encoding="utf-8") as f:
+        buffer = ""
+        position = 0
+        eof = False
+        while True:
+            while position < len(buffer) and buffer[position] in _SEPARATORS:
+                position += 1
+            if position == len(buffer):
+                buffer, position = f.read(chunk_size), 0
+                if not buffer:
+                    return
+                continue
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"Invalid JSON in {file}: {e}") from e
+                # the object continues in the next chunk; reading at least as much as buffered keeps large objects linear
+                chunk = f.read(max(chunk_size, len(buffer) - position))
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            if not isinstance(value, dict):
+                raise ValueError(f"Expected JSON objects in {file}, found {type(value).__name__}")
+            yield value
+
+
+class CommentIndex:
+    """
+    The comments of an export by issue number, in a temporary SQLite database, so that exports with millions of
+    comments are joined to their issues without holding them in memory.
+    """
+
+    def __init__(self) -> None:
+        self._directory = tempfile.TemporaryDirectory(prefix="issues-sync-export-")
+        self._db = sqlite3.connect(os.path.join(self._directory.name, "comments.db"))
+        self._db.execute("CREATE TABLE comments (issue INTEGER, created_at TEXT, updated_at TEXT, login TEXT, body TEXT)")
+        self.count = 0
+
+    def load(self, file: str):
+        batch = []
+        for comment in iter_json_objects(file):
+            issue = _issue_number(comment.get("issue_url") or comment.get("issue"))
+            if issue is None:
+                log.warning(f"Skipping comment {comment.get('url') or comment.get('id')} without issue in {file}")
+                continue
+            batch.append((issue, comment.get("created_at"), comment.get("updated_at") or comment.get("created_at"),
+                          _login(comment.get("user")), comment.get("body")))
+            if len(batch) >= _COMMENT_BATCH_SIZE:
+                self._insert(batch)
+                batch = []
+        self._insert(batch)
+
+    def _insert(self, batch):
+        with self._db:
+            self._db.executemany("INSERT INTO comments VALUES (?, ?, ?, ?, ?)", batch)
+        self.count += len(batch)
+
+    def index(self):
+        # created after loading, which is faster than maintaining it while inserting
+        with self._db:
+            self._db.execute("CREATE INDEX comments_issue ON comments (issue, created_at)")
+
+    def comments(self, issue_number: int) -> List[BaseIssueComment]:
+        rows = self._db.execute("SELECT updated_at, login, body FROM comments WHERE issue = ? "
+                                "ORDER BY created_at, rowid", (issue_number,))
+        return [_comment(body, login, updated_at) for updated_at, login, body in rows]
+
+    def close(self):
+        self._db.close()
+        self._directory.cleanup()
+
+
+class GithubExport:
+    """
+    Issues of a GitHub export. The comments are read from the comment files, or from the issue objects if they
+    embed them; without either the issues have comments None (i.e. unchanged), like when they are listed from the API.
+    """
+
+    def __init__(self, issue_files: Sequence[str], comment_files: Sequence[str] = (), project: Optional[str] = None,
+                 exported_at: Optional[datetime.datetime] = None) -> None:
+        self.issue_files = list(issue_files)
+        self.comment_files = list(comment_files)
+        # repository name for the identity labels if the issues do not name their repository
+        self.project = project
+        # the time of the export, after which changes are read from the API
+        self.exported_at = exported_at
+
+    def issues(self) -> Iterator[BaseIssue]:
+        index = None
+        try:
+            if self.comment_files:
+                index = CommentIndex()
+                for file in self.comment_files:
+                    log.info(f"Indexing comments of {file}")
+                    index.load(file)
+                index.index()
+                log.info(f"Indexed {index.count} comments")
+            count = 0
+            for file in self.issue_files:
+                log.info(f"Reading issues of {file}")
+                for data in iter_json_objects(file):
+                    if "pull_request" in data or data.get("type") == "pull_request":
+                        continue
+                    count += 1
+                    yield self._convert(data, index)
+            log.info(f"Read {count} issues from the export")
+        finally:
+            if index is not None:
+                index.close()
+
+    def _convert(self, data: dict, index: Optional[CommentIndex]) -> BaseIssue:
+        """
+        Converts an exported issue like github_connection.convert_to_base_issue converts one read from the API.
+        """
+        number = data.get("number") or _issue_number(data.get("url") or data.get("html_url"))
+        if number is None:
+            raise ValueError(f"Exported issue without number: {data.get('title')}")
+        id = str(number)
+        project = _repository_name(data) or self.project
+        created_at = _parse_time(data.get("created_at"))
+        closed_at = _parse_time(data.get("closed_at"))
+        updated_at = _parse_time(data.get("updated_at")) or closed_at or created_at
+        comments = None
+        if isinstance(data.get("comments"), list):
+            comments = [_comment(c.get("body"), _login(c.get("user")), c.get("updated_at") or c.get("created_at"))
+                        for c in data["comments"]]
+        elif index is not None:
+            comments = index.comments(number)
+        status = BaseIssueStatus((data.get("state") or ("closed" if closed_at else "open")).upper())
+        status_updated_at = closed_at if status == BaseIssueStatus.CLOSED and closed_at is not None else updated_at
+        milestone = data.get("milestone")
+        html_url = data.get("html_url") or data.get("url")
+        return BaseIssue(id, project, BaseIssueField(data.get("title"), updated_at),
+                         BaseIssueField(data.get("body"), updated_at), BaseIssueField(status, status_updated_at),
+                         comments, updated_at, html_url, identity=github_label(project, id),
+                         labels=[intern(_name(label)) for label in data.get("labels") or []],
+                         assignees=[intern(_login(assignee)) for assignee in data.get("assignees") or []],
+                         milestone=milestone.get("title") if isinstance(milestone, dict) else None)
+
+
+def _comment(body: Optional[str], login: Optional[str], updated_at: Optional[str]) -> BaseIssueComment:
+    updated_at = _parse_time(updated_at)
+    return BaseIssueComment(BaseIssueField(body, updated_at), BaseIssueField(intern(login), updated_at), updated_at)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _issue_number(url: Optional[str]) -> Optional[int]:
+    # .../issues/42 in the API and in migration archives
+    if not url:
+        return None
+    last = url.rstrip("/").rsplit("/", 1)[-1]
+    return int(last) if last.isdigit() else None
+
+
+def _repository_name(data: dict) -> Optional[str]:
+    repository = data.get("repository")
+    if isinstance(repository, dict):
+        return repository.get("name")
+    url = repository if isinstance(repository, str) else data.get("repository_url")
+    return urlparse(url).path.rstrip("/").rsplit("/", 1)[-1] if url else None
+
+
+def _login(user) -> Optional[str]:
+    # an object in API exports, the profile URL in migration archives
+    if isinstance(user, dict):
+        return user.get("login")
+    return urlparse(user).path.rstrip("/").rsplit("/", 1)[-1] if user else None
+
+
+def _name(label) -> str:
+    if isinstance(label, dict):
+        return label.get("name")
+    return unquote(urlparse(label).path.rsplit("/", 1)[-1])
@@ -1,4 +1,6 @@
 import datetime
+import re
+import sys
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import List, TypeVar, Generic, Optional
@@ -12,10 +14,16 @@ class BaseIssueStatus(Enum):
 T = TypeVar("T")
 
 
-@dataclass
+# Fields and comments use __slots__ (and no per-instance __dict__) as an issue can have thousands of comments.
+@dataclass(init=False)
 class BaseIssueField(Generic[T]):
+    __slots__ = ("value", "updated_at")
     value: T
-    updated_at: Optional[datetime.datetime] = None
+    updated_at: Optional[datetime.datetime]
+
+    def __init__(self, value: T, updated_at: Optional[datetime.datetime] = None):
+        self.value = value
+        self.updated_at = updated_at
 
     def __str__(self):
         return str(self.value)
@@ -24,16 +32,20 @@ class BaseIssueField(Generic[T]):
         return str(self.value)
 
 
-@dataclass
+@dataclass(init=False)
 class BaseIssueComment:
+    __slots__ = ("body", "user", "updated_at", "id")
     body: BaseIssueField[str]
     user: BaseIssueField[str]
-    updated_at: Optional[datetime.datetime] = None
+    updated_at: Optional[datetime.datetime]
+    # id of a comment read from Jira, so it can be edited or deleted without reading it again
+    id: Optional[str]
 
-    def __init__(self, body=None, user=None, updated_at=None):
+    def __init__(self, body=None, user=None, updated_at=None, id=None):
         self.body = body if isinstance(body, BaseIssueField) else BaseIssueField(body)
-        self.user = user if isinstance(user, BaseIssueField) else BaseIssueField(user)
+        self.user = user if isinstance(user, BaseIssueField) else BaseIssueField(intern(user))
         self.updated_at = updated_at
+        self.id = id
 
 
 @dataclass
@@ -43,7 +55,35 @@ class BaseIssue:
     title: BaseIssueField[str]
     description: BaseIssueField[str]
     status: BaseIssueField[BaseIssueStatus] = BaseIssueStatus.OPEN
-    comments: List[BaseIssueComment] = field(default_factory=list)
-    # labels: BaseIssueField[List[str]]
+    # None if the comments were not read because they did not change
+    comments: Optional[List[BaseIssueComment]] = field(default_factory=list)
     updated_at: Optional[datetime.datetime] = None
     html_url: Optional[str] = ""
+    # stable identity of the GitHub issue, stored as a label on the Jira issue (see github_label)
+    identity: Optional[str] = None
+    # label names, assignee logins and milestone title; None (for labels and assignees) if they were not read.
+    # For an issue read from Jira the assignee is the account id (or user name) and the fix versions are in versions.
+    labels: Optional[List[str]] = None
+    assignees: Optional[List[str]] = None
+    milestone: Optional[str] = None
+    versions: Optional[List[str]] = None
+    # number of comments according to the GitHub issue payload, also when the comments were not read
+    comment_count: Optional[int] = None
+
+
+def intern(value):
+    """
+    Interns strings repeated across many comments (e.g. user names) so all of them share one object.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+GITHUB_LABEL_PREFIX = "gh-"
+
+
+def github_label(project: str, issue_no: str) -> str:
+    """
+    Returns the Jira label that identifies a GitHub issue, e.g. gh-my-repo-42.
+    Jira labels cannot contain spaces, so characters other than letters, digits, "_", "." and "-" are replaced.
+    """
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", f"{GITHUB_LABEL_PREFIX}{project}-{issue_no}")
@@ -1,25 +1,172 @@
+import datetime
+import json
 import logging
-from typing import Optional
+import math
+import re
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, TypeVar
 
+import requests
 from jira import JIRA, JIRAError, Issue
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception
 
 from issues_sync.config import JiraConfig
-from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueField, BaseIssueStatus
+from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueField, BaseIssueStatus, intern, \
+    GITHUB_LABEL_PREFIX
+from issues_sync.markup import link_attachments
+from issues_sync.metrics import Metrics, instrument, record_retry, track
+from issues_sync.tracing import span
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 def jira_retry(func):
     return retry(stop=stop_after_attempt(3),
                  wait=wait_fixed(5000),
                  retry=retry_if_exception(lambda e: isinstance(e, JIRAError) and e.status_code >= 500),
+                 before_sleep=record_retry,
                  reraise=False)(func)
 
 
+def retry_unless_written(write: Callable[[], T], written: Callable[[], Optional[T]]) -> T:
+    """
+    Retries a write that is not idempotent (a POST) like jira_retry. Jira may have made a write whose response was
+    lost (e.g. a 502 of a proxy), so before a retry `written` looks it up and its result is returned if it was made.
+    """
+    # the first attempt is made without the retry machinery, which costs more than a write to a local server
+    try:
+        return write()
+    except JIRAError as e:
+        if e.status_code is None or e.status_code < 500:
+            raise
+        return _retry_write(write, written, [e])
+
+
+@jira_retry
+def _retry_write(write: Callable[[], T], written: Callable[[], Optional[T]], failed: List[JIRAError]) -> T:
+    if failed:
+        # the first attempt, which failed already, so that the retries wait and are counted like any other
+        raise failed.pop()
+    result = written()
+    if result is not None:
+        return result
+    return write()
+
+
+def same_text(current: Optional[str], desired: Optional[str]) -> bool:
+    """
+    Compares texts the way Jira stores them: without leading and trailing whitespace and with None as empty.
+    """
+    return (current or "").strip() == (desired or "").strip()
+
+
+class FieldMapping:
+    """
+    Maps GitHub labels, users and milestones to Jira labels, users and versions. Users and versions are looked up
+    in Jira once and cached (including the ones not found), so a sync makes at most one lookup per user.
+    """
+
+    def __init__(self, jira: JIRA, project: str, user_mapping: Optional[Dict[str, str]] = None,
+                 label_mapping: Optional[Dict[str, str]] = None) -> None:
+        self._jira = jira
+        self._project = project
+        self._user_mapping = user_mapping or {}
+        self._label_mapping = label_mapping or {}
+        self._users: Dict[str, Optional[dict]] = {}
+        self._versions: Optional[Dict[str, dict]] = None
+        # whether a user search was rejected (e.g. without the Browse users permission), which is logged once
+        self._user_search_rejected = False
+
+    def label(self, github_label: str) -> str:
+        """
+        Returns the Jira label for a GitHub label. Jira labels cannot contain spaces, so they are replaced with "-".
+        """
+        label = self._label_mapping.get(github_label)
+        if label is None:
+            label = re.sub(r"\s+", "-", github_label.strip())
+            self._label_mapping[github_label] = label
+        return label
+
+    def user(self, github_login: str) -> Optional[dict]:
+        """
+        Returns the assignee field value of the Jira user for a GitHub login or None if there is no unique user.
+        The user is searched by the configured name or email or else by the login.
+        If Jira rejects the search (a 4xx), the issue is synced without the assignee.
+        """
+        if github_login not in self._users:
+            try:
+                user = self._find_user(self._user_mapping.get(github_login, github_login))
+            except JIRAError as e:
+                # errors of 5xx responses are retried and raised as RetryError
+                if not self._user_search_rejected:
+                    log.warning(f"Jira rejected the user search, issues are synced without assignees: {e}")
+                    self._user_search_rejected = True
+                user = None
+            self._users[github_login] = user
+        return self._users[github_login]
+
+    @jira_retry
+    def _find_user(self, query: str) -> Optional[dict]:
+        with span("jira.search_users"):
+            if self._jira._is_cloud:
+                users = self._jira.search_users(query=query, maxResults=2)
+            else:
+                users = self._jira.search_users(user=query, maxResults=2)
+        if len(users) != 1:
+            log.info(f"No unique Jira user found for {query}")
+            return None
+        account_id = getattr(users[0], "accountId", None)
+        return {"accountId": account_id} if account_id else {"name": users[0].name}
+
+    def version(self, milestone: str) -> Optional[dict]:
+        """
+        Returns the fix version field value of the project version named like a milestone or None if there is none.
+        Versions are not created by the sync.
+        """
+        if self._versions is None:
+            self._versions = {version.name: {"name": version.name} for version in self._project_versions()}
+        return self._versions.get(milestone)
+
+    @jira_retry
+    def _project_versions(self):
+        with span("jira.project_versions"):
+            return self._jira.project_versions(self._project)
+
+
+def same_user(current: Optional[str], desired: dict) -> bool:
+    """
+    Compares the assignee of a Jira issue (account id or user name, see user_id) to an assignee field value.
+    """
+    if current is None:
+        return False
+    return current == desired.get("accountId", desired.get("name"))
+
+
+def user_id(user) -> Optional[str]:
+    """
+    Returns the account id (Jira Cloud) or the user name (Jira Server) of a Jira user.
+    """
+    if user is None:
+        return None
+    return getattr(user, "accountId", None) or getattr(user, "name", None)
+
+
 class JiraConnection:
+    # method name -> logical operation name used in metrics
+    OPERATIONS = {
+        "find_issue_id_by_title": "search",
+        "find_issue_keys_by_labels": "search",
+        "get_issue": "get_issue",
+        "get_issues": "search",
+        "get_changed_issues": "search",
+        "create_issue": "create",
+        "update_issue": "update",
+        "link_attachments": "update",
+        "add_attachment": "attach",
+    }
 
-    def __init__(self, config: JiraConfig) -> None:
+    def __init__(self, config: JiraConfig, metrics: Optional[Metrics] = None) -> None:
         # Connect to Jira
         if config.user and config.password:
             log.info(f"Connecting to Jira with user {config.user}")
@@ -35,6 +182,18 @@ class JiraConnection:
 
         self._project = config.project
         self._done_statuses = ("done", "closed", "resolved", "fixed")
+        self._metrics = metrics or Metrics()
+        self._mapping = FieldMapping(self._jira, self._project, config.user_mapping, config.label_mapping)
+
+        if metrics is not None:
+            instrument(self, "jira", self.OPERATIONS, metrics)
+            self.configure_session(lambda session: session.hooks["response"].append(metrics.on_response))
+
+    def configure_session(self, configure: Callable[[requests.Session], None]):
+        """
+        Applies configure to the HTTP session used for Jira (e.g. to add response hooks).
+        """
+        configure(self._jira._session)
 
     def _convert_to_base_issue(self, jira_issue: Issue) -> BaseIssue:
         id = str(jira_issue.key)
@@ -43,9 +202,10 @@ class JiraConnection:
         description = BaseIssueField(jira_issue.fields.description, jira_issue.fields.updated)
         comments = []
         for jira_comment in jira_issue.fields.comment.comments:
-            body = BaseIssueField(jira_comment.body, jira_comment.updated)
-            user = BaseIssueField(jira_comment.author.displayName, jira_comment.updated)
-            comment = BaseIssueComment(body, user, jira_comment.updated)
+            updated_at = jira_comment.updated
+            body = BaseIssueField(jira_comment.body, updated_at)
+            user = BaseIssueField(intern(jira_comment.author.displayName), updated_at)
+            comment = BaseIssueComment(body, user, updated_at, jira_comment.id)
             comments.append(comment)
         updated_at = jira_issue.fields.updated
 
@@ -55,92 +215,283 @@ class JiraConnection:
         else:
             status = BaseIssueField(BaseIssueStatus.OPEN, jira_issue.fields.updated)
         html_url = f"{self._jira._options['server']}/browse/{jira_issue.key}"
-        return BaseIssue(id, project, title, description, status, comments, updated_at, html_url)
+        labels = list(jira_issue.fields.labels)
+        identity = next((label for label in labels if label.startswith(GITHUB_LABEL_PREFIX)), None)
+        assignee = user_id(jira_issue.fields.assignee)
+        versions = [version.name for version in jira_issue.fields.fixVersions or []]
+        return BaseIssue(id, project, title, description, status, comments, updated_at, html_url, identity,
+                         labels=labels, assignees=[assignee] if assignee else [], versions=versions)
 
     @jira_retry
     def find_issue_id_by_title(self, issue_title: str) -> Optional[str]:
         """
         Finds a Jira issue based on a issue title
         """
-        issue_title = issue_title.replace("'", "\\'")
-        issue_title = issue_title.replace('"', '\\\\"')
+        with span("jira.search", query="title"):
+            issue_title = issue_title.replace("'", "\\'")
+            issue_title = issue_title.replace('"', '\\\\"')
 
-        jql_query = f"""project = "{self._project}" AND summary ~ '"{issue_title}"' """
+            jql_query = f"""project = "{self._project}" AND summary ~ '"{issue_title}"' """
 
-        log.info(f"Searching for issue with query {jql_query}")
-        issues = self._jira.search_issues(jql_query)
+            log.info(f"Searching for issue with query {jql_query}")
+            issues = self._jira.search_issues(jql_query)
 
-        if issues:
-            return issues[0].key
+            if issues:
+                return issues[0].key
 
-        return None
+            return None
 
     @jira_retry
-    def get_issue(self, issue_key: str) -> BaseIssue:
-        issue = self._jira.issue(issue_key)
-        return self._convert_to_base_issue(issue)
+    def find_issue_keys_by_labels(self, labels: List[str], batch_size: int = 200) -> Dict[str, str]:
+        """
+        Finds the Jira issues stamped with the given identity labels with one exact search per batch of labels.
+        :return: label -> Jira issue key for the labels that were found
+        """
+        with span("jira.search", query="labels", labels=len(labels)):
+            wanted = set(labels)
+            result = {}
+            for start in range(0, len(labels), batch_size):
+                quoted = ", ".join(f'"{label}"' for label in labels[start:start + batch_size])
+                jql_query = f'project = "{self._project}" AND labels in ({quoted})'
+                # maxResults=False reads all pages of the result
+                issues = self._jira.search_issues(jql_query, maxResults=False, validate_query=False, fields="labels")
+                for issue in issues:
+                    for label in issue.fields.labels:
+                        if label in wanted:
+                            result[label] = issue.key
+            return result
 
     @jira_retry
-    def create_issue(self, issue: BaseIssue) -> str:
-        log.info(f"Creating issue {issue}")
+    def get_issue(self, issue_key: str) -> BaseIssue:
+        with span("jira.get_issue", jira_issue=issue_key):
+            issue = self._jira.issue(issue_key)
+            return self._convert_to_base_issue(issue)
 
-        fields = {
-            "project": self._project,
-            "summary": issue.title.value,
-            "description": issue.description.value,
-            "issuetype": {"name": "Story"},
-        }
+    @jira_retry
+    def get_issues(self, issue_keys: List[str], batch_size: int = 50) -> List[BaseIssue]:
+        """
+        Reads many issues with one search request per batch of keys. Keys that do not exist are skipped.
+        """
+        with span("jira.get_issues", issues=len(issue_keys)):
+            result = []
+            for start in range(0, len(issue_keys), batch_size):
+                keys = issue_keys[start:start + batch_size]
+                jql_query = f"key in ({', '.join(keys)})"
+                issues = self._jira.search_issues(jql_query, maxResults=len(keys), validate_query=False,
+                                                  fields="project,summary,description,status,comment,updated,labels,"
+                                                         "assignee,fixVersions")
+                result.extend(self._convert_to_base_issue(issue) for issue in issues)
+            return result
 
-        issue = self._jira.create_issue(fields=fields)
-        return issue.key
+    def get_changed_issues(self, since: datetime.datetime, fields: str = "summary,status,updated,labels",
+                           page_size: int = 100) -> Iterator[BaseIssue]:
+        """
+        Yields the issues of the project updated since the given time (in UTC) with only the given fields read.
+        Comments are not read (None). An issue may be yielded twice if it is updated while the pages are read.
+        """
+        # JQL dates are in the user's time zone, a relative time in minutes is not
+        minutes = math.ceil((datetime.datetime.utcnow() - since).total_seconds() / 60) + 1
+        # newest first, so that issues updated while paging move to the front and no issue is skipped
+        jql_query = f'project = "{self._project}" AND updated >= -{minutes}m ORDER BY updated DESC'
+        start = 0
+        while True:
+            with span("jira.search", query="changed", start=start):
+                page = self._search_page(jql_query, start, page_size, fields)
+            for jira_issue in page:
+                yield self._convert_changed_issue(jira_issue)
+            if len(page) < page_size:
+                break
+            start += page_size
 
     @jira_retry
-    def update_issue(self, issue: BaseIssue) -> None:
-        log.info(f"Updating issue {issue.key} with {issue}")
-
-        jira_issue = self._jira.issue(issue.key)
-        fields = {
-            "summary": issue.title.value,
-            "description": issue.description.value,
-        }
-        jira_issue.update(fields=fields, jira=self._jira)
-
-        self._update_comments(jira_issue, issue)
-
-        status = None
-        if issue.status.value == BaseIssueStatus.CLOSED and jira_issue.fields.status.name.lower() not in self._done_statuses:
-            status = "Done"
-        elif issue.status.value == BaseIssueStatus.OPEN and jira_issue.fields.status.name.lower() in self._done_statuses:
-            status = "new"
-        if status:
-            self._jira.transition_issue(jira_issue.key, status)
-
-    def _update_comments(self, jira_issue: Issue, issue: BaseIssue) -> None:
-        # Get all existing comments from Jira
-        jira_comments = jira_issue.fields.comment.comments
-        base_comments = issue.comments
-
-        jira_index = 0
-        base_index = 0
-        while jira_index < len(jira_comments) and base_index < len(base_comments):
-            jira_comment = jira_comments[jira_index]
-            base_comment = base_comments[base_index]
+    def _search_page(self, jql_query: str, start: int, page_size: int, fields: str):
+        return self._jira.search_issues(jql_query, startAt=start, maxResults=page_size, validate_query=False,
+                                        fields=fields)
+
+    def _convert_changed_issue(self, jira_issue: Issue) -> BaseIssue:
+        updated_at = jira_issue.fields.updated
+        if jira_issue.fields.status.name.lower() in self._done_statuses:
+            status = BaseIssueField(BaseIssueStatus.CLOSED, updated_at)
+        else:
+            status = BaseIssueField(BaseIssueStatus.OPEN, updated_at)
+        identity = next((label for label in jira_issue.fields.labels if label.startswith(GITHUB_LABEL_PREFIX)), None)
+        return BaseIssue(str(jira_issue.key), self._project, BaseIssueField(jira_issue.fields.summary, updated_at),
+                         BaseIssueField(None), status, None, updated_at, identity=identity)
+
+    def create_issue(self, issue: BaseIssue) -> str:
+        with span("jira.create_issue"):
+            log.info(f"Creating issue {issue}")
 
             fields = {
-                "body": base_comment.body.value
+                "project": self._project,
+                "summary": issue.title.value,
+                "description": issue.description.value,
+                "issuetype": {"name": "Story"},
             }
-            jira_comment.update(jira=self._jira, body=base_comment.body.value)
+            fields.update(self._mapped_fields(issue, labels=[], assignee=None, versions=[]))
+
+            issue_key = self._create_issue(fields, issue.identity)
+            # comments and status cannot be set on create. If they fail, the issue is updated on the retry.
+            for index, comment in enumerate(issue.comments or []):
+                with track("add_comment"):
+                    self._add_comment(issue_key, comment.body.value, index)
+            if issue.status.value == BaseIssueStatus.CLOSED:
+                with track("transition"):
+                    self._transition_issue(issue_key, "Done")
+            return issue_key
+
+    def _create_issue(self, fields: dict, identity: Optional[str]) -> str:
+        def created() -> Optional[str]:
+            return self.find_issue_keys_by_labels([identity]).get(identity) if identity else None
+
+        return retry_unless_written(lambda: self._jira.create_issue(fields=fields).key, created)
+
+    def _add_comment(self, issue_key: str, body: str, index: int):
+        # the comment at index is added by an attempt whose response was lost
+        def added() -> Optional[bool]:
+            return True if len(self._jira.comments(issue_key)) > index else None
+
+        retry_unless_written(lambda: self._jira.add_comment(issue_key, body), added)
+
+    @jira_retry
+    def _transition_issue(self, issue_key: str, status: str):
+        self._jira.transition_issue(issue_key, status)
+
+    @jira_retry
+    def add_attachment(self, issue_key: str, file: BinaryIO, filename: str) -> str:
+        """
+        Attaches a file to an issue. The file is streamed from its current position.
+        :return: the id of the attachment
+        """
+        with span("jira.add_attachment", jira_issue=issue_key):
+            log.info(f"Attaching {filename} to issue {issue_key}")
+            return str(self._jira.add_attachment(issue=issue_key, attachment=file, filename=filename).id)
+
+    def link_attachments(self, issue_key: str, names: Dict[str, str]) -> None:
+        """
+        Points the images and links of the description and the comments at the attachments mirrored to the issue
+        (GitHub URL -> attachment file name), see markup.link_attachments.
+        """
+        with span("jira.link_attachments", jira_issue=issue_key):
+            issue = self.get_issue(issue_key)
+            description = link_attachments(issue.description.value, names)
+            if description != issue.description.value:
+                self._edit(f"issue/{issue_key}", {"fields": {"description": description}})
+            for comment in issue.comments:
+                body = link_attachments(comment.body.value, names)
+                if body != comment.body.value:
+                    self._edit(f"issue/{issue_key}/comment/{comment.id}", {"body": body})
+
+    def update_issue(self, issue: BaseIssue, current: Optional[BaseIssue] = None) -> None:
+        """
+        Writes the changes from current to issue. current is the issue as read from Jira (e.g. by get_issue before
+        it was transformed); without it the issue is read first.
+        Each write is retried on its own: a retry of the whole update would diff against a current that misses the
+        writes made before the failure.
+        """
+        with span("jira.update_issue", jira_issue=issue.key):
+            log.info(f"Updating issue {issue.key} with {issue}")
+
+            if current is None:
+                current = self.get_issue(issue.key)
+            # only changed fields are written: every write is reindexed, notified and added to the history
+            fields = {}
+            if not same_text(current.title.value, issue.title.value):
+                fields["summary"] = issue.title.value
+            if not same_text(current.description.value, issue.description.value):
+                fields["description"] = issue.description.value
+            # issues found by title (or created before identity labels) get their label on the next update
+            fields.update(self.mapped_fields(current, issue))
+            if fields:
+                self._edit(f"issue/{issue.key}", {"fields": fields})
+            else:
+                self._metrics.inc("skipped_writes", system="jira", write="fields")
+
+            if issue.comments is not None:
+                self._update_comments(issue.key, current.comments, issue)
+
+            status = None
+            if issue.status.value == BaseIssueStatus.CLOSED and current.status.value != BaseIssueStatus.CLOSED:
+                status = "Done"
+            elif issue.status.value == BaseIssueStatus.OPEN and current.status.value == BaseIssueStatus.CLOSED:
+                status = "new"
+            if status:
+                with track("transition"):
+                    self._transition_issue(issue.key, status)
+            else:
+                self._metrics.inc("skipped_writes", system="jira", write="transition")
+
+    @jira_retry
+    def _edit(self, path: str, data: dict):
+        # unlike Resource.update this does not read the resource back after the write
+        self._jira._session.put(self._jira._get_url(path), data=json.dumps(data))
+
+    @jira_retry
+    def _delete(self, path: str):
+        try:
+            self._jira._session.delete(self._jira._get_url(path))
+        except JIRAError as e:
+            # deleted by an attempt whose response was lost
+            if e.status_code != 404:
+                raise
+
+    def mapped_fields(self, current: BaseIssue, issue: BaseIssue) -> dict:
+        """
+        Returns the label, assignee and fix version fields update_issue writes to get from current to issue.
+        """
+        return self._mapped_fields(issue, labels=list(current.labels or []),
+                                   assignee=current.assignees[0] if current.assignees else None,
+                                   versions=list(current.versions or []))
+
+    def _mapped_fields(self, issue: BaseIssue, labels: List[str], assignee, versions: List[str]) -> dict:
+        """
+        Returns the label, assignee and fix version fields that differ from the current ones, so they are written
+        with the same edit as the other fields. Labels and versions are added but never removed, as they can
+        be set in Jira too. The assignee follows the first GitHub assignee that is a Jira user.
+        """
+        fields = {}
+        wanted = ([issue.identity] if issue.identity else []) + [self._mapping.label(l) for l in issue.labels or []]
+        missing = [label for label in dict.fromkeys(wanted) if label not in labels]
+        if missing:
+            fields["labels"] = labels + missing
+        for login in issue.assignees or []:
+            user = self._mapping.user(login)
+            if user is not None:
+                if not same_user(assignee, user):
+                    fields["assignee"] = user
+                break
+        if issue.milestone:
+            version = self._mapping.version(issue.milestone)
+            if version is not None and version["name"] not in versions:
+                fields["fixVersions"] = [{"name": name} for name in versions] + [version]
+        return fields
+
+    def _update_comments(self, issue_key: str, jira_comments: List[BaseIssueComment], issue: BaseIssue) -> None:
+        with span("jira.update_comments", jira_issue=issue_key, comments=len(issue.comments)):
+            base_comments = issue.comments
+
+            jira_index = 0
+            base_index = 0
+            while jira_index < len(jira_comments) and base_index < len(base_comments):
+                jira_comment = jira_comments[jira_index]
+                base_comment = base_comments[base_index]
+
+                if same_text(jira_comment.body.value, base_comment.body.value):
+                    self._metrics.inc("skipped_writes", system="jira", write="comment")
+                else:
+                    self._edit(f"issue/{issue_key}/comment/{jira_comment.id}", {"body": base_comment.body.value})
 
-            jira_index += 1
-            base_index += 1
+                jira_index += 1
+                base_index += 1
 
-        if base_index < len(base_comments):
-            # Add new comments
-            for base_comment in base_comments[base_index:]:
-                self._jira.add_comment(jira_issue.key, base_comment.body.value)
+            if base_index < len(base_comments):
+                # Add new comments, after the Jira comments (the leftover ones are deleted afterwards)
+                for index, base_comment in enumerate(base_comments[base_index:], len(jira_comments)):
+                    with track("add_comment"):
+                        self._add_comment(issue_key, base_comment.body.value, index)
 
-        # delete leftover comments
-        if jira_index < len(jira_comments):
-            for jira_comment in jira_comments[jira_index:]:
-                jira_comment.delete()
+            # delete leftover comments
+            if jira_index < len(jira_comments):
+                for jira_comment in jira_comments[jira_index:]:
+                    self._delete(f"issue/{issue_key}/comment/{jira_comment.id}")
 
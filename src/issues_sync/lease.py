@@ -0,0 +1,157 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+# what a sync does when another sync holds the lease
+EXIT = "exit"
+WAIT = "wait"
+
+
+class Lease:
+    """
+    Grants one sync at a time exclusive use of a state. The base lease is always granted (e.g. for in-memory state).
+    """
+
+    def acquire(self) -> bool:
+        """
+        Acquires the lease if it is free or stale.
+        :return: True if the lease is held now
+        """
+        return True
+
+    def renew(self):
+        """
+        Extends the lease while a long sync is running.
+        """
+
+    def release(self):
+        """
+        Releases the lease if it is held.
+        """
+
+
+class FileLease(Lease):
+    """
+    A lease stored in a lock file next to a file state. The file records the owner and the expiry time.
+
+    A lease is stale (and taken over) when it expired, i.e. it was not renewed within the TTL,
+    or when its owner process on this host no longer exists.
+    """
+
+    def __init__(self, file: str, ttl: datetime.timedelta = datetime.timedelta(hours=1)) -> None:
+        self._file = Path(file)
+        self._ttl = ttl
+        self._owner = {"id": uuid.uuid4().hex, "host": socket.gethostname(), "pid": os.getpid()}
+        self._renewed = None
+
+    def acquire(self) -> bool:
+        if self._create():
+            return True
+        current = self._read()
+        if not self._is_stale(current):
+            log.info(f"Lease {self._file} is held by {current}")
+            return False
+        log.warning(f"Taking over the stale lease {self._file} of {current}")
+        # only one of several runs can move the stale lock file away, the others fail to create it afterwards
+        stale = self._file.with_name(f"{self._file.name}.{self._owner['id']}.stale")
+        try:
+            os.replace(self._file, stale)
+        except FileNotFoundError:
+            return self._create()
+        moved = json.loads(stale.read_text() or "{}") if current.get("id") else {}
+        if moved.get("id") != current.get("id"):
+            # another run took the lease over in the meantime, so its fresh lock file is put back
+            os.replace(stale, self._file)
+            return False
+        stale.unlink()
+        return self._create()
+
+    def renew(self):
+        # renewing rewrites the lock file, so it is done at most every tenth of the TTL
+        if self._renewed is None or time.monotonic() - self._renewed < self._ttl.total_seconds() / 10:
+            return
+        if self._read().get("id") != self._owner["id"]:
+            log.warning(f"Lease {self._file} was taken over by another sync")
+            return
+        tmp = self._file.with_name(f"{self._file.name}.{self._owner['id']}.tmp")
+        tmp.write_text(json.dumps(self._content()))
+        os.replace(tmp, self._file)
+        self._renewed = time.monotonic()
+
+    def release(self):
+        if self._renewed is not None and self._read().get("id") == self._owner["id"]:
+            self._file.unlink()
+        self._renewed = None
+
+    def _create(self) -> bool:
+        self._file.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(self._file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._content(), f)
+        self._renewed = time.monotonic()
+        return True
+
+    def _content(self) -> dict:
+        expires_at = datetime.datetime.utcnow() + self._ttl
+        return dict(self._owner, expires_at=expires_at.isoformat())
+
+    def _read(self) -> dict:
+        try:
+            return json.loads(self._file.read_text())
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            # a lock file that is being written or was left half written
+            return {"expires_at": None}
+
+    def _is_stale(self, current: dict) -> bool:
+        if not current:
+            return True
+        expires_at = current.get("expires_at")
+        if expires_at is None:
+            try:
+                return time.time() - self._file.stat().st_mtime > self._ttl.total_seconds()
+            except FileNotFoundError:
+                return True
+        if datetime.datetime.fromisoformat(expires_at) < datetime.datetime.utcnow():
+            return True
+        return current.get("host") == self._owner["host"] and not _is_running(current.get("pid"))
+
+
+def _is_running(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def acquire(lease: Lease, policy: str = EXIT, wait: datetime.timedelta = datetime.timedelta(hours=1),
+            poll_interval: float = 10) -> bool:
+    """
+    Acquires the lease according to the policy: exit (give up at once) or wait until it is free.
+    :return: True if the lease is held now
+    """
+    if policy not in (EXIT, WAIT):
+        raise ValueError(f"Unknown lease policy {policy}. Use {EXIT} or {WAIT}.")
+    deadline = time.monotonic() + wait.total_seconds()
+    while not lease.acquire():
+        if policy == EXIT or time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_interval)
+    return True
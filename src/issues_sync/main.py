@@ -1,10 +1,28 @@
 import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
 
+import click
+
+from issues_sync import tracing
+from issues_sync.attachments import AttachmentMirror
+from issues_sync.cassette import recording, replaying
 from issues_sync.config import Config
+from issues_sync.file_state import InFileState, DEFAULT_STATE_FILE
 from issues_sync.github_connection import GithubConnection
+from issues_sync.github_export import GithubExport
 from issues_sync.jira_connection import JiraConnection
+from issues_sync.lease import EXIT, WAIT
+from issues_sync.markup import MarkupConverter
+from issues_sync.metrics import Metrics
+from issues_sync.plan import SyncPlan
+from issues_sync.profiling import profile
+from issues_sync.report import COMPARED, append_history, compare as compare_reports, load_history
+from issues_sync.scheduler import IssueScheduler, DEFAULT_BACKFILL_LIMIT
 from issues_sync.sync_engine import SyncEngine
 from issues_sync.sync_strategy import GithubToJiraSyncStrategy
+from issues_sync.utils import to_utc
 
 if not logging.root.handlers:
     # Configure logging
@@ -13,14 +31,178 @@ if not logging.root.handlers:
 log = logging.getLogger(__name__)
 
 
-def main():
-    config = Config()
-    github = GithubConnection(config.github)
-    jira = JiraConnection(config.jira)
-    update_strategy = GithubToJiraSyncStrategy(jira, github)
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(ctx):
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(sync)
+
+
+@main.command()
+@click.option('--plan', 'plan_file', type=click.Path(dir_okay=False),
+              help="Compute the sync plan and write it to the file without making any changes.")
+@click.option('--apply', 'apply_file', type=click.Path(exists=True, dir_okay=False),
+              help="Apply a plan created with --plan.")
+@click.option('--workers', default=8, show_default=True, help="Parallel operations when applying a plan.")
+@click.option('--max-duration', type=int,
+              help="Stop the sync cleanly after this many seconds. The next sync resumes where it stopped.")
+@click.option('--max-issues', type=int,
+              help="Stop the sync cleanly after this many issues. The next sync resumes where it stopped.")
+@click.option('--backfill-limit', type=int,
+              help="When the sync is behind, sync at most this many older issues after the fresh ones. "
+                   f"Defaults to {DEFAULT_BACKFILL_LIMIT}.")
+@click.option('--on-locked', type=click.Choice([EXIT, WAIT]),
+              help="What to do when another sync is running: exit at once or wait for it and sync the remaining changes. "
+                   "Defaults to lease_policy of the config.")
+@click.option('--profile', 'profile_file', type=click.Path(dir_okay=False),
+              help="Profile the run: write a cProfile dump to the file and print the time per phase "
+                   "and of the slowest issues.")
+@click.option('--profile-top', default=10, show_default=True, help="Slowest issues to print with --profile.")
+@click.option('--record', 'record_file', type=click.Path(dir_okay=False),
+              help="Record the GitHub and Jira HTTP traffic and the state of the run into a cassette file.")
+@click.option('--replay', 'replay_file', type=click.Path(exists=True, dir_okay=False),
+              help="Replay a run recorded with --record without network access, on a copy of its state.")
+@click.option('--replay-speed', default=1.0, show_default=True,
+              help="Factor for the recorded response times when replaying (0 = no delays).")
+def sync(plan_file, apply_file, workers, max_duration, max_issues, backfill_limit, on_locked, profile_file,
+         profile_top, record_file, replay_file, replay_speed):
+    if plan_file and apply_file:
+        raise click.UsageError("--plan and --apply cannot be used together.")
+    if record_file and replay_file:
+        raise click.UsageError("--record and --replay cannot be used together.")
+
+    with profile(profile_file, profile_top), _http_traffic(record_file, replay_file, replay_speed) as state_file:
+        _sync(plan_file, apply_file, workers, max_duration, max_issues, backfill_limit, on_locked, state_file,
+              replay=replay_file is not None)
+
+
+@main.command('import')
+@click.argument('issue_files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--comments', 'comment_files', multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help="Export of the issue comments (can be repeated). Without it the Jira comments are not changed, "
+                   "unless the issues embed their comments.")
+@click.option('--exported-at', type=click.DateTime(formats=["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"]),
+              help="When the export was made (UTC). The next sync reads the changes since then from GitHub. "
+                   "Defaults to the latest update in the export.")
+@click.option('--profile', 'profile_file', type=click.Path(dir_okay=False),
+              help="Profile the run: write a cProfile dump to the file and print the time per phase "
+                   "and of the slowest issues.")
+@click.option('--profile-top', default=10, show_default=True, help="Slowest issues to print with --profile.")
+def import_issues(issue_files, comment_files, exported_at, profile_file, profile_top):
+    """
+    Syncs the issues of GitHub export files (JSON or JSON lines, optionally gzipped) to Jira without listing them
+    from the GitHub API, e.g. to seed Jira for a large repository. Afterwards `sync` continues from the export.
+    """
+    export = GithubExport(issue_files, comment_files, exported_at=to_utc(exported_at) if exported_at else None)
+    with profile(profile_file, profile_top):
+        _sync(None, None, None, None, None, None, None, DEFAULT_STATE_FILE, export=export)
+
+
+@contextmanager
+def _http_traffic(record_file, replay_file, replay_speed):
+    """
+    Records or replays the HTTP traffic of the run if requested and returns the state file to use.
+    """
+    if record_file:
+        with recording(record_file, DEFAULT_STATE_FILE):
+            yield DEFAULT_STATE_FILE
+    elif replay_file:
+        with replaying(replay_file, replay_speed) as cassette, tempfile.TemporaryDirectory() as directory:
+            yield cassette.restore_state(directory)
+    else:
+        yield DEFAULT_STATE_FILE
+
+
+def _sync(plan_file, apply_file, workers, max_duration, max_issues, backfill_limit, on_locked, state_file,
+          replay=False, export=None):
+    with tracing.span("config.load"):
+        config = Config()
+    if config.trace_otlp_endpoint:
+        tracing.add_exporter(tracing.OtlpHttpExporter(config.trace_otlp_endpoint))
+    elif config.trace_file:
+        tracing.add_exporter(tracing.JsonFileExporter(config.trace_file))
+    metrics = Metrics()
+    if config.metrics_port:
+        metrics.serve(int(config.metrics_port))
+    with tracing.span("connect"):
+        github = GithubConnection(config.github, metrics)
+        jira = JiraConnection(config.jira, metrics)
+    state = InFileState(state_file)
+    update_strategy = GithubToJiraSyncStrategy(jira, github, MarkupConverter(state))
+    attachments = None
+    if config.mirror_attachments:
+        attachments = AttachmentMirror(github, jira, state, workers=int(config.attachment_workers))
+
+    sync_engine = SyncEngine(github, jira, update_strategy, state, dry_run=config.dry_run, metrics=metrics,
+                             scheduler=IssueScheduler(backfill_limit=backfill_limit if backfill_limit is not None
+                                                      else DEFAULT_BACKFILL_LIMIT),
+                             lease_policy=on_locked or config.lease_policy,
+                             lease_ttl=timedelta(seconds=int(config.lease_ttl)),
+                             lease_wait=timedelta(seconds=int(config.lease_wait)),
+                             attachments=attachments,
+                             pipeline=config.pipeline_workers if config.pipeline else None,
+                             pipeline_queue_size=int(config.pipeline_queue_size),
+                             max_watermark_lag=timedelta(seconds=int(config.max_watermark_lag)))
+    try:
+        if plan_file:
+            sync_engine.plan().save(plan_file)
+            log.info(f"Sync plan written to {plan_file}")
+        elif apply_file:
+            sync_engine.apply(SyncPlan.load(apply_file), workers=workers)
+        elif export is not None:
+            # issues that do not name their repository get the identity labels of the configured one
+            export.project = export.project or config.github.project.rsplit("/", 1)[-1]
+            sync_engine.import_issues(export.issues(), export.exported_at)
+        else:
+            sync_engine.sync(max_duration=timedelta(seconds=max_duration) if max_duration else None,
+                             max_issues=max_issues)
+    finally:
+        if attachments is not None:
+            attachments.close()
+        if config.metrics_file:
+            metrics.write_textfile(config.metrics_file)
+        if sync_engine.report is not None:
+            # a replay does not overwrite the report of the real runs, its history is in the replayed state directory
+            if config.report_file and not replay:
+                sync_engine.report.save(config.report_file)
+            append_history(state.history_file, sync_engine.report, int(config.report_history_size))
+        tracing.shutdown()
+
+
+@main.group()
+def report():
+    """
+    Reports of the sync runs.
+    """
+
 
-    sync_engine = SyncEngine(github, jira, update_strategy, dry_run=config.dry_run)
-    sync_engine.sync()
+@report.command()
+@click.option('--history', 'history_file', type=click.Path(dir_okay=False),
+              help="History of run reports. Defaults to the history next to the state file.")
+@click.option('--threshold', default=0.5, show_default=True,
+              help="Increase over the median of the previous runs that is a regression (0.5 = 50%).")
+@click.option('--window', default=10, show_default=True, help="Previous runs a run is compared with.")
+@click.option('--runs', default=20, show_default=True, help="Most recent runs to show.")
+def compare(history_file, threshold, window, runs):
+    """
+    Flags runs whose time per issue or API calls per issue regressed. Exits with 1 if the last run regressed.
+    """
+    comparisons = compare_reports(load_history(history_file or InFileState().history_file), threshold, window)
+    if not comparisons:
+        click.echo("No runs in the history.")
+        return
+    click.echo(f"{'started':<20} {'result':<8} {'issues':>7} {'s/issue':>8} {'calls/issue':>12} "
+               f"{'requests/issue':>15}  regressions")
+    for comparison in comparisons[-runs:]:
+        r = comparison.report
+        values = [getattr(r, metric) for metric in COMPARED]
+        formatted = [f"{v:.3f}" if v is not None else "-" for v in values]
+        regressions = ", ".join(f"{metric} {value:.3f} vs {median:.3f}"
+                                for metric, (value, median) in comparison.regressions.items())
+        click.echo(f"{r.started_at.isoformat(timespec='seconds'):<20} {r.result:<8} {r.issue_count:>7} "
+                   f"{formatted[0]:>8} {formatted[1]:>12} {formatted[2]:>15}  {regressions}")
+    if comparisons[-1].regressed:
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,168 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from issues_sync.state import State
+
+_FENCE = re.compile(r"^\s*(```+|~~~+)\s*([\w+#.-]*)\s*$")
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)(?:\s+#+)?\s*$")
+_RULE = re.compile(r"^\s*([-*_])(?:\s*\1){2,}\s*$")
+_QUOTE = re.compile(r"^\s*>\s?(.*)$")
+_LIST_ITEM = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+(.*)$")
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)*\|?\s*$")
+
+_CODE_SPAN = re.compile(r"(`+)(.+?)\1")
+_IMAGE = re.compile(r"!\[([^\]]*)\]\(\s*(\S+?)(?:\s+\"[^\"]*\")?\s*\)")
+_LINK = re.compile(r"\[([^\]]+)\]\(\s*(\S+?)(?:\s+\"[^\"]*\")?\s*\)")
+_AUTOLINK = re.compile(r"<((?:https?|mailto):[^>\s]+)>")
+_STRONG = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+_EMPHASIS = re.compile(r"(?<![*\w])\*(?=[^\s*])([^*\n]+?)(?<=[^\s*])\*(?![*\w])")
+_STRIKE = re.compile(r"~~(?=\S)(.+?)(?<=\S)~~")
+# bold is converted via a placeholder so that the emphasis rule does not convert it again
+_BOLD_MARK = "\x00"
+
+# images and links of Jira markup, e.g. !https://host/image.png! and [trace.log|https://host/trace.log]
+_JIRA_IMAGE = re.compile(r"!([^\s!|]+)((?:\|[^!\n]*)?)!")
+_JIRA_LINK = re.compile(r"\[([^\]|\n]*)\|([^\]\s]+)\]")
+
+
+def markdown_to_jira(markdown: str) -> str:
+    """
+    Converts GitHub flavored Markdown to Jira wiki markup: code blocks, headings, lists, quotes, tables,
+    rules, links, images and inline styles. Text in code blocks and code spans is kept as it is.
+    """
+    lines = markdown.replace("\r\n", "\n").split("\n")
+    out = []
+    fence = None
+    for index, line in enumerate(lines):
+        if fence is not None:
+            match = _FENCE.match(line)
+            if match and match.group(1).startswith(fence) and not match.group(2):
+                out.append("{code}")
+                fence = None
+            else:
+                out.append(line)
+            continue
+        match = _FENCE.match(line)
+        if match:
+            fence = match.group(1)
+            out.append(f"{{code:{match.group(2)}}}" if match.group(2) else "{code}")
+            continue
+        out.append(_convert_line(line, lines[index + 1] if index + 1 < len(lines) else ""))
+    if fence is not None:
+        out.append("{code}")
+    return "\n".join(line for line in out if line is not None)
+
+
+def _convert_line(line: str, next_line: str) -> Optional[str]:
+    stripped = line.strip()
+    if stripped.startswith("|"):
+        if _is_table_separator(stripped):
+            return None
+        cells = [_convert_inline(cell.strip()) for cell in stripped.strip("|").split("|")]
+        if _is_table_separator(next_line):
+            return "||" + "||".join(cells) + "||"
+        return "|" + "|".join(cells) + "|"
+    match = _HEADING.match(line)
+    if match:
+        return f"h{len(match.group(1))}. {_convert_inline(match.group(2))}"
+    if _RULE.match(line):
+        return "----"
+    match = _QUOTE.match(line)
+    if match:
+        return f"bq. {_convert_inline(match.group(1))}"
+    match = _LIST_ITEM.match(line)
+    if match:
+        level = len(match.group(1).expandtabs(4)) // 2 + 1
+        marker = "#" if match.group(2)[0].isdigit() else "*"
+        return f"{marker * level} {_convert_inline(match.group(3))}"
+    return _convert_inline(line)
+
+
+def _is_table_separator(line: str) -> bool:
+    return "|" in line and "-" in line and _TABLE_SEPARATOR.match(line.strip()) is not None
+
+
+def _convert_inline(text: str) -> str:
+    if not any(c in text for c in "`*_~[]<!"):
+        return text
+    parts = []
+    start = 0
+    for match in _CODE_SPAN.finditer(text):
+        parts.append(_convert_styles(text[start:match.start()]))
+        parts.append("{{" + match.group(2).strip() + "}}")
+        start = match.end()
+    parts.append(_convert_styles(text[start:]))
+    return "".join(parts)
+
+
+def _convert_styles(text: str) -> str:
+    text = _IMAGE.sub(r"!\2!", text)
+    text = _LINK.sub(r"[\1|\2]", text)
+    text = _AUTOLINK.sub(r"[\1]", text)
+    text = _STRONG.sub(_BOLD_MARK + r"\2" + _BOLD_MARK, text)
+    text = _EMPHASIS.sub(r"_\1_", text)
+    text = _STRIKE.sub(r"-\1-", text)
+    return text.replace(_BOLD_MARK, "*")
+
+
+def link_attachments(markup: str, names: Dict[str, str]) -> str:
+    """
+    Points the images and links of Jira markup whose URL was mirrored as an attachment (URL -> file name) at the
+    attachment of the issue instead, e.g. at a copy of an image only logged in GitHub users can see.
+    """
+    if not names or not markup:
+        return markup
+    markup = _JIRA_IMAGE.sub(lambda m: f"!{names[m.group(1)]}{m.group(2)}!" if m.group(1) in names else m.group(0),
+                             markup)
+    return _JIRA_LINK.sub(lambda m: f"[{m.group(1)}|^{names[m.group(2)]}]" if m.group(2) in names else m.group(0),
+                          markup)
+
+
+class MarkupConverter:
+    """
+    Converts Markdown to Jira markup with a cache by content hash: in memory (LRU) and, if given, in the state,
+    so that unchanged descriptions and comments are not converted again, not even in the next run.
+    The converter can be used from several threads; the state is only used while holding the lock.
+    """
+
+    def __init__(self, state: Optional[State] = None, cache_size: int = 4096) -> None:
+        self._state = state
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def convert(self, markdown: Optional[str]) -> Optional[str]:
+        if not markdown:
+            return markdown
+        digest = hashlib.sha1(markdown.encode("utf-8")).hexdigest()
+        with self._lock:
+            rendered = self._cache.get(digest)
+            if rendered is not None:
+                self._cache.move_to_end(digest)
+                return rendered
+            if self._state is not None:
+                rendered = self._state.get_rendered_markup(digest)
+        converted = rendered is None
+        if converted:
+            rendered = markdown_to_jira(markdown)
+        with self._lock:
+            if converted and self._state is not None:
+                self._state.update_rendered_markup(digest, rendered)
+            self._cache[digest] = rendered
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return rendered
+
+    def link(self, jira_issue_key: Optional[str], markup: Optional[str]) -> Optional[str]:
+        """
+        Points converted markup at the attachments mirrored to the Jira issue, see link_attachments.
+        """
+        if jira_issue_key is None or self._state is None or not markup:
+            return markup
+        with self._lock:
+            names = self._state.get_attachment_names(jira_issue_key)
+        # only looked up, so the names can be recorded meanwhile by the attachment mirror
+        return link_attachments(markup, names)
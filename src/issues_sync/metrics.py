@@ -0,0 +1,309 @@
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from issues_sync.utils import apply_decorator
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+@dataclass
+class _Operation:
+    metrics: "Metrics"
+    system: str
+    name: str
+
+    def labels(self) -> Dict[str, str]:
+        return dict(system=self.system, operation=self.name)
+
+
+# The API operation currently in progress. HTTP responses and retries are attributed to it.
+_current_operation: contextvars.ContextVar[Optional[_Operation]] = contextvars.ContextVar("operation", default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        Returns (upper bound, cumulative count) pairs, the last one being +Inf.
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """
+    Collects counters, gauges and histograms of a sync run and exports them in OpenMetrics text format.
+    """
+
+    def __init__(self, namespace: str = "issues_sync") -> None:
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelSet, float]] = defaultdict(dict)
+        self._gauges: Dict[str, Dict[LabelSet, float]] = defaultdict(dict)
+        self._histograms: Dict[str, Dict[LabelSet, Histogram]] = defaultdict(dict)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _label_set(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[name][_label_set(labels)] = value
+
+    def observe(self, name: str, value: float, buckets: Iterable[float] = DEFAULT_BUCKETS, **labels):
+        key = _label_set(labels)
+        with self._lock:
+            series = self._histograms[name]
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def get(self, name: str, **labels) -> float:
+        """
+        Returns the current value of a counter or gauge. Labels that are not given are summed over.
+        """
+        with self._lock:
+            series = self._counters.get(name) or self._gauges.get(name) or {}
+            return sum(value for key, value in series.items() if set(labels.items()) <= set(key))
+
+    def get_histogram(self, name: str, **labels) -> Optional[Histogram]:
+        with self._lock:
+            return self._histograms.get(name, {}).get(_label_set(labels))
+
+    def series(self, name: str) -> List[Tuple[Dict[str, str], float]]:
+        """
+        Returns the labels and values of all series of a counter or gauge.
+        """
+        with self._lock:
+            series = self._counters.get(name) or self._gauges.get(name) or {}
+            return [(dict(key), value) for key, value in sorted(series.items())]
+
+    def histograms(self, name: str) -> List[Tuple[Dict[str, str], Histogram]]:
+        with self._lock:
+            return [(dict(key), histogram) for key, histogram in sorted(self._histograms.get(name, {}).items())]
+
+    @contextmanager
+    def operation(self, system: str, name: str):
+        """
+        Accounts one call of a logical API operation (calls, errors and latency).
+        HTTP responses and retries that happen inside are attributed to it.
+        """
+        operation = _Operation(self, system, name)
+        token = _current_operation.set(operation)
+        self.inc("api_calls", **operation.labels())
+        start = time.perf_counter()
+        try:
+            yield operation
+        except Exception:
+            self.inc("api_errors", **operation.labels())
+            raise
+        finally:
+            self.observe("api_duration_seconds", time.perf_counter() - start, **operation.labels())
+            _current_operation.reset(token)
+
+    def timed(self, system: str, name: str) -> Callable:
+        """
+        Returns a decorator accounting each call of the decorated function as the given operation.
+        For generator functions only the time spent inside the generator is measured.
+        """
+
+        def decorator(func):
+            if inspect.isgeneratorfunction(func):
+                @functools.wraps(func)
+                def generator_wrapper(*args, **kwargs):
+                    yield from self._timed_iteration(system, name, func(*args, **kwargs))
+
+                return generator_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.operation(system, name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _timed_iteration(self, system: str, name: str, iterator):
+        operation = _Operation(self, system, name)
+        self.inc("api_calls", **operation.labels())
+        elapsed = 0.0
+        try:
+            while True:
+                token = _current_operation.set(operation)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                except Exception:
+                    self.inc("api_errors", **operation.labels())
+                    raise
+                finally:
+                    elapsed += time.perf_counter() - start
+                    _current_operation.reset(token)
+                yield item
+        finally:
+            self.observe("api_duration_seconds", elapsed, **operation.labels())
+
+    def on_response(self, response, *args, **kwargs):
+        """
+        A `requests` response hook counting HTTP requests and response bytes per operation.
+        """
+        operation = _current_operation.get()
+        if operation is not None and operation.metrics is self:
+            labels = operation.labels()
+        else:
+            labels = dict(system="unknown", operation="unknown")
+        self.inc("http_requests", **labels)
+        if kwargs.get("stream"):
+            # hooks run before the body is read, so a streamed body (e.g. an attachment download) is counted by its
+            # Content-Length instead of being read into memory here
+            size = int(response.headers.get("Content-Length") or 0)
+        else:
+            size = len(response.content or b"")
+        self.inc("http_response_bytes", size, **labels)
+        return response
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                family = f"{self._namespace}_{name}"
+                lines.append(f"# TYPE {family} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{family}_total{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._gauges.items()):
+                family = f"{self._namespace}_{name}"
+                lines.append(f"# TYPE {family} gauge")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{family}{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._histograms.items()):
+                family = f"{self._namespace}_{name}"
+                lines.append(f"# TYPE {family} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative_counts():
+                        le = "+Inf" if bound == float("inf") else _format_value(bound)
+                        lines.append(f"{family}_bucket{_format_labels(key + (('le', le),))} {count}")
+                    lines.append(f"{family}_sum{_format_labels(key)} {_format_value(histogram.sum)}")
+                    lines.append(f"{family}_count{_format_labels(key)} {histogram.count}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, file: str):
+        """
+        Writes the metrics atomically so that a textfile collector never reads a partial file.
+        """
+        tmp_file = f"{file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_file, file)
+        log.info(f"Metrics written to {file}")
+
+    def serve(self, port: int, address: str = "") -> ThreadingHTTPServer:
+        """
+        Starts serving the metrics on http://<address>:<port>/metrics in a background thread.
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format, *args)
+
+        server = ThreadingHTTPServer((address, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        log.info(f"Serving metrics on port {server.server_address[1]}")
+        return server
+
+
+@contextmanager
+def track(name: str):
+    """
+    Accounts a nested operation (e.g. fetching comments while listing issues) on the metrics
+    of the operation currently in progress. Does nothing if no instrumented operation is running.
+    """
+    current = _current_operation.get()
+    if current is None:
+        yield
+        return
+    with current.metrics.operation(current.system, name):
+        yield
+
+
+def record_retry(retry_state: Any = None):
+    """
+    Counts a retry of the operation currently in progress. Usable as tenacity `before_sleep` callback.
+    """
+    current = _current_operation.get()
+    if current is not None:
+        current.metrics.inc("api_retries", **current.labels())
+
+
+def instrument(obj: Any, system: str, operations: Dict[str, str], metrics: Metrics):
+    """
+    Wraps the given methods of obj (method name -> operation name) so that their calls are accounted.
+    """
+    for method_name, operation in operations.items():
+        apply_decorator(obj, getattr(obj, method_name), metrics.timed(system, operation))
+
+
+def _label_set(labels: Dict[str, Any]) -> LabelSet:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelSet) -> str:
+    if not key:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in key)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,204 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, Optional
+
+from issues_sync.metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+# how long blocked puts and gets wait before they check whether the pipeline was closed
+POLL_INTERVAL = 0.05
+
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    """
+    A step of a pipeline: func is applied to each item by `workers` threads that read from a queue of `queue_size`.
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = 16
+    # statistics of the run
+    processed: int = 0
+    busy_seconds: float = 0.0
+    max_depth: int = 0
+
+
+@dataclass
+class Completed:
+    """
+    An item that went through the pipeline: the value of the last stage or the error of the stage that failed.
+    """
+    item: Any
+    value: Any = None
+    error: Optional[Exception] = None
+    stage: Optional[str] = None
+
+
+class Pipeline:
+    """
+    Runs items through stages connected by bounded queues, so that e.g. reading, computing and writing of different
+    items overlap. When a stage is slower than the ones before, their queues fill up and put() blocks (backpressure),
+    so the number of items in flight is bounded by the queue sizes and workers.
+
+    Items that fail in a stage skip the remaining stages. Completed items are returned to the thread that puts items
+    (in order of completion), so that this thread can keep state that is not thread safe.
+
+        with Pipeline(stages, metrics) as pipeline:
+            for item in items:
+                for completed in pipeline.put(item):
+                    ...
+            for completed in pipeline.drain():
+                ...
+    """
+
+    def __init__(self, stages: List[Stage], metrics: Optional[Metrics] = None) -> None:
+        self._stages = stages
+        self._metrics = metrics or Metrics()
+        self._queues = [queue.Queue(stage.queue_size) for stage in stages]
+        self._done = queue.Queue(stages[-1].queue_size)
+        self._stopped = [0] * len(stages)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._threads = [threading.Thread(target=self._work, args=(index,), name=f"pipeline-{stage.name}-{n}",
+                                          daemon=True)
+                         for index, stage in enumerate(stages) for n in range(stage.workers)]
+
+    def __enter__(self) -> "Pipeline":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        # on an error in the caller the workers stop without finishing the items in flight
+        self._closed.set()
+        for thread in self._threads:
+            thread.join()
+
+    def put(self, item) -> Iterator[Completed]:
+        """
+        Adds an item. While the first queue is full, the items completed meanwhile are returned.
+        """
+        yield from self._offer(Completed(item, item))
+        yield from self._completed()
+
+    def wait(self) -> Iterator[Completed]:
+        """
+        Returns the items completed meanwhile, waiting a moment for one if there is none, e.g. while the caller
+        holds off adding items.
+        """
+        try:
+            yield self._done.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            return
+        yield from self._completed()
+
+    def drain(self) -> Iterator[Completed]:
+        """
+        Returns the remaining items once all of them went through the pipeline. No items can be added afterwards.
+        """
+        for _ in range(self._stages[0].workers):
+            yield from self._offer(_STOP)
+        while True:
+            completed = self._done.get()
+            if completed is _STOP:
+                return
+            yield completed
+
+    @property
+    def capacity(self) -> int:
+        """
+        The number of items the pipeline holds at most: in the queues, at the workers and completed but not taken.
+        """
+        return sum(stage.queue_size + stage.workers for stage in self._stages) + self._stages[-1].queue_size
+
+    def stats(self) -> str:
+        """
+        Describes per stage the items processed, the time the workers were busy and the longest queue,
+        e.g. to find the bottleneck: the stage before the longest queue.
+        """
+        return ", ".join(f"{s.name}: {s.processed} items, {s.busy_seconds:.1f}s busy with {s.workers} workers, "
+                         f"queue up to {s.max_depth}/{s.queue_size}" for s in self._stages)
+
+    def _offer(self, entry) -> Iterator[Completed]:
+        # the completed items are taken while waiting, otherwise a full pipeline could not move on
+        while True:
+            try:
+                self._queues[0].put(entry, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                yield from self._completed()
+        self._record_depth(0)
+
+    def _completed(self) -> Iterator[Completed]:
+        while True:
+            try:
+                completed = self._done.get_nowait()
+            except queue.Empty:
+                return
+            yield completed
+
+    def _work(self, index: int):
+        stage = self._stages[index]
+        inbox = self._queues[index]
+        while not self._closed.is_set():
+            try:
+                entry = inbox.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if entry is _STOP:
+                self._stop(index)
+                return
+            self._record_depth(index)
+            if entry.error is None:
+                start = time.perf_counter()
+                try:
+                    entry.value = stage.func(entry.value)
+                except Exception as e:
+                    log.debug(f"Stage {stage.name} failed for {entry.item}: {e}")
+                    entry.error = e
+                    entry.stage = stage.name
+                duration = time.perf_counter() - start
+                with self._lock:
+                    stage.processed += 1
+                    stage.busy_seconds += duration
+                self._metrics.inc("pipeline_items", stage=stage.name)
+                self._metrics.observe("pipeline_stage_seconds", duration, stage=stage.name)
+            self._put(index + 1, entry)
+
+    def _stop(self, index: int):
+        # the last worker of a stage to stop passes the end on, once for every worker of the next stage
+        with self._lock:
+            self._stopped[index] += 1
+            last = self._stopped[index] == self._stages[index].workers
+        if last:
+            for _ in range(self._stages[index + 1].workers if index + 1 < len(self._stages) else 1):
+                self._put(index + 1, _STOP)
+
+    def _put(self, index: int, entry):
+        """
+        Puts an entry into the queue of the stage with the index (the queue of completed items after the last stage).
+        """
+        target = self._queues[index] if index < len(self._stages) else self._done
+        while not self._closed.is_set():
+            try:
+                target.put(entry, timeout=POLL_INTERVAL)
+            except queue.Full:
+                continue
+            if index < len(self._stages):
+                self._record_depth(index)
+            return
+
+    def _record_depth(self, index: int):
+        stage = self._stages[index]
+        depth = self._queues[index].qsize()
+        self._metrics.set("pipeline_queue_depth", depth, stage=stage.name)
+        if depth > stage.max_depth:
+            with self._lock:
+                stage.max_depth = max(stage.max_depth, depth)
@@ -0,0 +1,165 @@
+import datetime
+import json
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueField, BaseIssueStatus
+from issues_sync.jira_connection import same_text
+
+CREATE = "create"
+UPDATE = "update"
+NOOP = "noop"
+
+
+@dataclass
+class PlannedOperation:
+    action: str
+    github_issue: str
+    jira_issue: Optional[str]
+    # field name -> {"from": current value, "to": desired value}
+    changes: Dict[str, Any] = field(default_factory=dict)
+    # desired state of the Jira issue
+    issue: Optional[Dict[str, Any]] = None
+    # desired state of the GitHub issue if it needs to be written back
+    github_update: Optional[Dict[str, Any]] = None
+    api_calls: int = 0
+
+
+@dataclass
+class SyncPlan:
+    since: datetime.datetime
+    until: Optional[datetime.datetime]
+    operations: List[PlannedOperation] = field(default_factory=list)
+    created_at: datetime.datetime = field(default_factory=datetime.datetime.utcnow)
+
+    @property
+    def api_calls(self) -> int:
+        return sum(op.api_calls for op in self.operations)
+
+    def count(self, action: str) -> int:
+        return sum(1 for op in self.operations if op.action == action)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": 1,
+            "created_at": self.created_at.isoformat(),
+            "since": self.since.isoformat(),
+            "until": self.until.isoformat() if self.until else None,
+            "api_calls": self.api_calls,
+            "operations": [asdict(op) for op in self.operations],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SyncPlan":
+        return cls(since=datetime.datetime.fromisoformat(data["since"]),
+                   until=datetime.datetime.fromisoformat(data["until"]) if data.get("until") else None,
+                   operations=[PlannedOperation(**op) for op in data["operations"]],
+                   created_at=datetime.datetime.fromisoformat(data["created_at"]))
+
+    def save(self, file: str):
+        with open(file, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, file: str) -> "SyncPlan":
+        with open(file, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+def issue_to_dict(issue: BaseIssue) -> Dict[str, Any]:
+    return {
+        "key": issue.key,
+        "project": issue.project,
+        "title": issue.title.value,
+        "description": issue.description.value,
+        "status": issue.status.value.value,
+        "comments": [{"body": c.body.value, "user": c.user.value} for c in issue.comments]
+        if issue.comments is not None else None,
+        "html_url": issue.html_url,
+        "identity": issue.identity,
+        "labels": issue.labels,
+        "assignees": issue.assignees,
+        "milestone": issue.milestone,
+    }
+
+
+def issue_from_dict(data: Dict[str, Any]) -> BaseIssue:
+    return BaseIssue(key=data["key"],
+                     project=data["project"],
+                     title=BaseIssueField(data["title"]),
+                     description=BaseIssueField(data["description"]),
+                     status=BaseIssueField(BaseIssueStatus(data["status"])),
+                     comments=[BaseIssueComment(c["body"], c["user"]) for c in data["comments"]]
+                     if data["comments"] is not None else None,
+                     html_url=data.get("html_url"),
+                     identity=data.get("identity"),
+                     labels=data.get("labels"),
+                     assignees=data.get("assignees"),
+                     milestone=data.get("milestone"))
+
+
+def diff_issues(current: BaseIssue, desired: BaseIssue, mapped_fields: Optional[Dict[str, Any]] = None) \
+        -> Dict[str, Any]:
+    """
+    Returns the field level differences between the current and the desired state of an issue.
+    mapped_fields are the label, assignee and fix version fields to write (see JiraConnection.mapped_fields).
+    """
+    changes = {}
+    mapped_fields = mapped_fields or {}
+    for name, current_value, desired_value in (
+            ("summary", current.title.value, desired.title.value),
+            ("description", current.description.value, desired.description.value)):
+        if not same_text(current_value, desired_value):
+            changes[name] = {"from": current_value, "to": desired_value}
+    if current.status.value != desired.status.value:
+        changes["status"] = {"from": current.status.value.value, "to": desired.status.value.value}
+    for name, current_value in (("labels", current.labels or []),
+                                ("assignee", current.assignees[0] if current.assignees else None),
+                                ("fixVersions", [{"name": name} for name in current.versions or []])):
+        if name in mapped_fields:
+            changes[name] = {"from": current_value, "to": mapped_fields[name]}
+
+    if desired.comments is None:
+        return changes
+    current_bodies = [c.body.value for c in current.comments]
+    desired_bodies = [c.body.value for c in desired.comments]
+    common = min(len(current_bodies), len(desired_bodies))
+    updated = sum(1 for i in range(common) if not same_text(current_bodies[i], desired_bodies[i]))
+    added = max(0, len(desired_bodies) - len(current_bodies))
+    removed = max(0, len(current_bodies) - len(desired_bodies))
+    if updated or added or removed:
+        changes["comments"] = {"updated": updated, "added": added, "removed": removed}
+    return changes
+
+
+def estimate_create_calls(desired: BaseIssue) -> int:
+    """
+    Estimates the Jira API calls JiraConnection.create_issue makes: create, one call per comment and a transition
+    if the issue is closed.
+    """
+    calls = 1 + len(desired.comments or [])
+    if desired.status.value == BaseIssueStatus.CLOSED:
+        calls += 1
+    return calls
+
+
+def estimate_update_calls(current: BaseIssue, desired: BaseIssue,
+                          mapped_fields: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Estimates the Jira API calls JiraConnection.update_issue makes to get from current to desired:
+    read, fields update if a field changed, one call per changed, added or removed comment and a transition.
+    """
+    calls = 1
+    if not same_text(current.title.value, desired.title.value) \
+            or not same_text(current.description.value, desired.description.value) \
+            or mapped_fields \
+            or (mapped_fields is None and desired.identity and desired.identity != current.identity):
+        calls += 1
+    if current.status.value != desired.status.value:
+        calls += 1
+    if desired.comments is not None:
+        common = min(len(current.comments), len(desired.comments))
+        calls += sum(1 for i in range(common)
+                     if not same_text(current.comments[i].body.value, desired.comments[i].body.value))
+        calls += abs(len(desired.comments) - len(current.comments))
+    return calls
@@ -0,0 +1,197 @@
+import cProfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import click
+
+from issues_sync import tracing
+from issues_sync.tracing import Span, SpanExporter
+
+OTHER = "other"
+
+# phase -> names of the spans measuring it. Spans of other names count to the phase of the span they are nested in.
+PHASES = {
+    "config load": ["config.load"],
+    "connection setup": ["connect"],
+    "state load": ["state.load"],
+    "GitHub listing": ["github.list_issues", "github.get_comments", "github.comment_feed", "github.get_issue"],
+    "conversion": ["github.convert_issue", "strategy.transform"],
+    "Finder": ["finder.find_jira_issue_key", "finder.find_jira_issue_keys"],
+    "Jira read": ["jira.get_issue", "jira.get_issues", "jira.search", "jira.search_users", "jira.project_versions"],
+    "Jira write": ["jira.create_issue", "jira.update_issue", "jira.update_comments", "jira.add_attachment"],
+    "GitHub write": ["github.update_issue", "github.update_issue_status", "github.create_issue"],
+    "state save": ["state.save"],
+}
+
+
+@dataclass
+class PhaseTiming:
+    phase: str
+    calls: int = 0
+    # time in the spans of the phase, including the spans of other phases nested in them
+    total_seconds: float = 0.0
+    # time in the phase only, so that the self times of all phases add up to the time of the run
+    self_seconds: float = 0.0
+
+
+@dataclass
+class IssueTiming:
+    github_issue: str
+    seconds: float = 0.0
+    # phase -> self time
+    phases: Dict[str, float] = field(default_factory=dict)
+
+
+class PhaseProfiler(SpanExporter):
+    """
+    Collects the spans of a run and breaks its time down by phase (see PHASES) and by GitHub issue.
+    """
+
+    def __init__(self, phases: Optional[Dict[str, List[str]]] = None) -> None:
+        phases = PHASES if phases is None else phases
+        self._phases = list(phases) + [OTHER]
+        self._phase_of_name = {name: phase for phase, names in phases.items() for name in names}
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    def phase_timings(self) -> List[PhaseTiming]:
+        """
+        Returns the timings of the phases that occurred, in the order of PHASES.
+        """
+        timings = {phase: PhaseTiming(phase) for phase in self._phases}
+        for span, phase, _, self_seconds in self._analyse():
+            timings[phase].self_seconds += self_seconds
+        for span in self._outermost_spans():
+            timing = timings[self._phase_of_name[span.name]]
+            timing.calls += 1
+            timing.total_seconds += span.duration
+        return [t for t in timings.values() if t.calls or t.self_seconds]
+
+    def issue_timings(self) -> List[IssueTiming]:
+        """
+        Returns the time spent on each GitHub issue with its breakdown by phase, slowest first.
+        """
+        timings: Dict[str, IssueTiming] = {}
+        analysed = list(self._analyse())
+        issue_of_span = {span.span_id: issue for span, _, issue, _ in analysed}
+        for span, phase, issue, self_seconds in analysed:
+            if issue is None:
+                continue
+            timing = timings.setdefault(issue, IssueTiming(issue))
+            timing.phases[phase] = timing.phases.get(phase, 0.0) + self_seconds
+            if _issue_of(span) is not None and issue_of_span.get(span.parent_id) != issue:
+                # the outermost span of the issue (e.g. sync_issue, or transform_issue and write_issue in a pipeline)
+                timing.seconds += span.duration
+        return sorted(timings.values(), key=lambda t: t.seconds, reverse=True)
+
+    def report(self, run_seconds: float, top: int = 10) -> str:
+        """
+        Formats the phase table and the `top` slowest issues.
+        """
+        phases = self.phase_timings()
+        busy = sum(t.self_seconds for t in phases) or 1.0
+        lines = [f"{'phase':<18} {'calls':>7} {'total s':>9} {'self s':>9} {'self %':>7}"]
+        for t in phases:
+            lines.append(f"{t.phase:<18} {t.calls:>7} {t.total_seconds:>9.3f} {t.self_seconds:>9.3f} "
+                         f"{100 * t.self_seconds / busy:>6.1f}%")
+        lines.append(f"{'run':<18} {'':>7} {run_seconds:>9.3f}")
+        issues = self.issue_timings()[:top]
+        if issues:
+            lines.append("")
+            lines.append(f"{len(issues)} slowest issues:")
+            for t in issues:
+                breakdown = ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in
+                                      sorted(t.phases.items(), key=lambda p: p[1], reverse=True) if seconds >= 0.0005)
+                lines.append(f"{t.github_issue:>8} {t.seconds:>8.3f}s  {breakdown}")
+        return "\n".join(lines)
+
+    def _by_id(self) -> Dict[str, Span]:
+        with self._lock:
+            return {s.span_id: s for s in self._spans}
+
+    def _analyse(self) -> Iterator[Tuple[Span, str, Optional[str], float]]:
+        """
+        Yields each span with its phase, its GitHub issue (of the span or the spans it is nested in)
+        and its self time (its duration without the spans nested in it).
+        """
+        spans = self._by_id()
+        nested_seconds = defaultdict(float)
+        for span in spans.values():
+            if span.parent_id in spans:
+                nested_seconds[span.parent_id] += span.duration
+        phases: Dict[str, str] = {}
+        issues: Dict[str, Optional[str]] = {}
+
+        def resolve(span: Span):
+            # walks up to the first span whose phase and issue are known; spans are nested only a few levels deep
+            chain = []
+            current = span
+            while current is not None and current.span_id not in phases:
+                chain.append(current)
+                current = spans.get(current.parent_id)
+            phase = phases[current.span_id] if current is not None else OTHER
+            issue = issues[current.span_id] if current is not None else None
+            for s in reversed(chain):
+                phase = self._phase_of_name.get(s.name, phase)
+                issue = _issue_of(s) or issue
+                phases[s.span_id] = phase
+                issues[s.span_id] = issue
+
+        for span in spans.values():
+            resolve(span)
+            yield span, phases[span.span_id], issues[span.span_id], \
+                max(0.0, span.duration - nested_seconds[span.span_id])
+
+    def _outermost_spans(self) -> Iterator[Span]:
+        """
+        Yields the spans of a phase that are not nested in a span of the same phase (e.g. recursive calls).
+        """
+        spans = self._by_id()
+        for span in spans.values():
+            phase = self._phase_of_name.get(span.name)
+            if phase is None:
+                continue
+            parent = spans.get(span.parent_id)
+            while parent is not None and self._phase_of_name.get(parent.name) != phase:
+                parent = spans.get(parent.parent_id)
+            if parent is None:
+                yield span
+
+
+def _issue_of(span: Span) -> Optional[str]:
+    issue = span.attributes.get("github_issue")
+    return str(issue) if issue is not None else None
+
+
+@contextmanager
+def profile(file: Optional[str], top: int = 10):
+    """
+    Profiles the code run in the context when file is given: writes a cProfile dump to the file (for pstats, snakeviz
+    or flameprof) and prints the time per phase and the `top` slowest issues.
+    Only the calling thread is in the dump, the phase table includes the spans of all threads.
+    """
+    if not file:
+        yield None
+        return
+    profiler = PhaseProfiler()
+    tracing.add_exporter(profiler)
+    started = time.perf_counter()
+    cprofile = cProfile.Profile()
+    cprofile.enable()
+    try:
+        yield profiler
+    finally:
+        cprofile.disable()
+        run_seconds = time.perf_counter() - started
+        tracing.shutdown()
+        cprofile.dump_stats(file)
+        click.echo(profiler.report(run_seconds, top), err=True)
+        click.echo(f"Profile written to {file} (python -m pstats {file})", err=True)
@@ -0,0 +1,213 @@
+import datetime
+import json
+import logging
+import os
+import statistics
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from issues_sync.metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# runs kept in the history
+HISTORY_SIZE = 500
+
+# API metrics of an operation in the report -> metric name
+API_METRICS = {
+    "calls": "api_calls",
+    "errors": "api_errors",
+    "retries": "api_retries",
+    "http_requests": "http_requests",
+    "response_bytes": "http_response_bytes",
+}
+
+
+@dataclass
+class SlowIssue:
+    github_issue: str
+    seconds: float
+
+
+@dataclass
+class RunReport:
+    """
+    The result of one sync run: counts, durations, API usage, the watermark (last sync time) before and after,
+    the sync lag and the slowest issues.
+    """
+    started_at: datetime.datetime
+    finished_at: datetime.datetime
+    result: str = OK
+    error: Optional[str] = None
+    watermark_before: Optional[datetime.datetime] = None
+    watermark_after: Optional[datetime.datetime] = None
+    # seconds the watermark (the time up to which all GitHub changes are synced) is behind the end of the run
+    watermark_lag_seconds: Optional[float] = None
+    # p50, p95 and max of the seconds from the GitHub change until the Jira write succeeded, of the synced issues
+    lag_seconds: Dict[str, float] = field(default_factory=dict)
+    # result (created, updated, skipped, failed) -> issues
+    issues: Dict[str, int] = field(default_factory=dict)
+    # seconds spent on the issues, from the start until the result is saved
+    issue_seconds: float = 0.0
+    # "<system>.<operation>" -> calls, errors, retries, http_requests, response_bytes and seconds
+    api: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    slowest_issues: List[SlowIssue] = field(default_factory=list)
+
+    @property
+    def duration_seconds(self) -> float:
+        return (self.finished_at - self.started_at).total_seconds()
+
+    @property
+    def issue_count(self) -> int:
+        return sum(self.issues.values())
+
+    @property
+    def seconds_per_issue(self) -> Optional[float]:
+        return self.issue_seconds / self.issue_count if self.issue_count else None
+
+    @property
+    def api_calls(self) -> int:
+        return int(sum(operation.get("calls", 0) for operation in self.api.values()))
+
+    @property
+    def http_requests(self) -> int:
+        return int(sum(operation.get("http_requests", 0) for operation in self.api.values()))
+
+    @property
+    def api_calls_per_issue(self) -> Optional[float]:
+        return self.api_calls / self.issue_count if self.issue_count else None
+
+    @property
+    def http_requests_per_issue(self) -> Optional[float]:
+        return self.http_requests / self.issue_count if self.issue_count else None
+
+    @classmethod
+    def from_metrics(cls, metrics: Metrics, started_at: datetime.datetime, finished_at: datetime.datetime,
+                     **kwargs) -> "RunReport":
+        issues = {labels["result"]: int(value) for labels, value in metrics.series("issues") if "result" in labels}
+        issue_histogram = metrics.get_histogram("issue_sync_seconds")
+        api: Dict[str, Dict[str, float]] = {}
+        for name, metric in API_METRICS.items():
+            for labels, value in metrics.series(metric):
+                api.setdefault(_operation(labels), {})[name] = value
+        for labels, histogram in metrics.histograms("api_duration_seconds"):
+            api.setdefault(_operation(labels), {})["seconds"] = round(histogram.sum, 6)
+        return cls(started_at=started_at, finished_at=finished_at, issues=issues,
+                   issue_seconds=round(issue_histogram.sum, 6) if issue_histogram else 0.0, api=api, **kwargs)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        for key in ("started_at", "finished_at", "watermark_before", "watermark_after"):
+            data[key] = data[key].isoformat() if data[key] else None
+        # derived values for readers of the file, ignored when loading
+        data["duration_seconds"] = round(self.duration_seconds, 3)
+        data["seconds_per_issue"] = self.seconds_per_issue
+        data["api_calls_per_issue"] = self.api_calls_per_issue
+        data["http_requests_per_issue"] = self.http_requests_per_issue
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunReport":
+        return cls(started_at=datetime.datetime.fromisoformat(data["started_at"]),
+                   finished_at=datetime.datetime.fromisoformat(data["finished_at"]),
+                   result=data.get("result", OK),
+                   error=data.get("error"),
+                   watermark_before=_parse_time(data.get("watermark_before")),
+                   watermark_after=_parse_time(data.get("watermark_after")),
+                   watermark_lag_seconds=data.get("watermark_lag_seconds"),
+                   lag_seconds=data.get("lag_seconds", {}),
+                   issues=data.get("issues", {}),
+                   issue_seconds=data.get("issue_seconds", 0.0),
+                   api=data.get("api", {}),
+                   slowest_issues=[SlowIssue(**s) for s in data.get("slowest_issues", [])])
+
+    def save(self, file: str):
+        """
+        Writes the report atomically as JSON.
+        """
+        _write_atomically(Path(file), json.dumps(self.to_dict(), indent=2) + "\n")
+        log.info(f"Run report written to {file}")
+
+
+def append_history(file: str, report: RunReport, size: int = HISTORY_SIZE):
+    """
+    Appends the report to the history (JSON lines), keeping the last `size` runs.
+    """
+    path = Path(file)
+    lines = path.read_text().splitlines() if path.exists() else []
+    lines.append(json.dumps(report.to_dict()))
+    _write_atomically(path, "\n".join(lines[-size:]) + "\n")
+
+
+def load_history(file: str) -> List[RunReport]:
+    path = Path(file)
+    if not path.exists():
+        return []
+    reports = []
+    for number, line in enumerate(path.read_text().splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            reports.append(RunReport.from_dict(json.loads(line)))
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f"Skipping line {number} of {file}: {e}")
+    return reports
+
+
+@dataclass
+class Comparison:
+    report: RunReport
+    # metric -> (value, median of the previous runs) for the metrics that regressed
+    regressions: Dict[str, Tuple[float, float]] = field(default_factory=dict)
+
+    @property
+    def regressed(self) -> bool:
+        return bool(self.regressions)
+
+
+# metrics compared between runs (lower is better)
+COMPARED = ("seconds_per_issue", "api_calls_per_issue", "http_requests_per_issue")
+
+
+def compare(reports: List[RunReport], threshold: float = 0.5, window: int = 10) -> List[Comparison]:
+    """
+    Compares each run with the median of the `window` runs before it. A metric regressed when it exceeds the median
+    by more than `threshold` (0.5 = 50%). Only runs that synced issues are compared, failed runs are not baselines.
+    """
+    comparisons = []
+    baseline: List[RunReport] = []
+    for report in reports:
+        comparison = Comparison(report)
+        if report.issue_count:
+            for metric in COMPARED:
+                value = getattr(report, metric)
+                previous = [getattr(r, metric) for r in baseline[-window:]]
+                if value is None or not previous:
+                    continue
+                median = statistics.median(previous)
+                if value > median * (1 + threshold):
+                    comparison.regressions[metric] = (value, median)
+            if report.result == OK:
+                baseline.append(report)
+        comparisons.append(comparison)
+    return comparisons
+
+
+def _operation(labels: Dict[str, str]) -> str:
+    return f"{labels.get('system', 'unknown')}.{labels.get('operation', 'unknown')}"
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime.datetime]:
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def _write_atomically(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_file.write_text(content)
+    os.replace(tmp_file, path)
@@ -0,0 +1,55 @@
+import datetime
+from enum import IntEnum
+from typing import List, Optional, Sequence
+
+from issues_sync.issue import BaseIssue, BaseIssueStatus
+from issues_sync.state import State
+from issues_sync.utils import to_utc
+
+# older issues synced per run while the sync is behind, so that a run ends in time to pick up the fresh changes again
+DEFAULT_BACKFILL_LIMIT = 1000
+
+
+class Priority(IntEnum):
+    NEW = 0
+    # the issue was closed; GitHub issues do not tell when they were reopened, so a reopen is an edit
+    CLOSE = 1
+    EDIT = 2
+
+
+class IssueScheduler:
+    """
+    Decides the order in which issues are synced when the sync is behind (e.g. during a backfill).
+
+    Issues changed within the fresh window are synced first, ordered by priority class:
+    by default new (not yet mapped) issues, then closed issues, then other edits.
+    Older issues are synced afterwards in update order, at most backfill_limit of them per run.
+    """
+
+    def __init__(self,
+                 fresh_window: datetime.timedelta = datetime.timedelta(days=1),
+                 backfill_limit: Optional[int] = DEFAULT_BACKFILL_LIMIT,
+                 order: Sequence[Priority] = (Priority.NEW, Priority.CLOSE, Priority.EDIT)) -> None:
+        self.fresh_window = fresh_window
+        self.backfill_limit = backfill_limit
+        self._rank = {priority: rank for rank, priority in enumerate(order)}
+
+    def fresh_since(self, now: datetime.datetime) -> datetime.datetime:
+        return now - self.fresh_window
+
+    def is_backfill(self, last_sync_time: datetime.datetime, now: datetime.datetime) -> bool:
+        return to_utc(last_sync_time) < to_utc(self.fresh_since(now))
+
+    def priority(self, issue: BaseIssue, state: State, since: datetime.datetime) -> Priority:
+        if state.get_jira_issue(issue.key) is None:
+            return Priority.NEW
+        status = issue.status
+        if status.value == BaseIssueStatus.CLOSED and status.updated_at and to_utc(status.updated_at) >= to_utc(since):
+            return Priority.CLOSE
+        return Priority.EDIT
+
+    def order(self, issues: List[BaseIssue], state: State, since: datetime.datetime) -> List[BaseIssue]:
+        """
+        Orders the issues by priority class and within a class by update time (stable).
+        """
+        return sorted(issues, key=lambda issue: self._rank.get(self.priority(issue, state, since), len(self._rank)))
@@ -1,6 +1,33 @@
 
 from abc import abstractmethod
 import datetime
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from issues_sync.freshness import LagHistogram
+from issues_sync.lease import Lease
+
+
+@dataclass
+class FailedIssue:
+    """A GitHub issue that failed to sync and is retried later (dead letter)."""
+    github_issue_no: str
+    error: str
+    attempts: int
+    next_retry_time: datetime.datetime
+
+
+@dataclass
+class OutboxEntry:
+    """
+    A Jira mutation that was started but not confirmed yet (write-ahead log).
+    The key is the idempotency key of the mutation, e.g. the identity label of the issue to create.
+    """
+    key: str
+    action: str
+    github_issue_no: str
+    jira_issue_key: Optional[str]
+    created_at: datetime.datetime
 
 
 class State:
@@ -35,6 +62,128 @@ class State:
         Updates the last sync time (in UTC)
         """
 
+    def get_last_synced_keys(self) -> List[str]:
+        """
+        Returns the GitHub issue numbers already synced that were updated exactly at the last sync time.
+        Together with the last sync time they are the cursor from which an interrupted sync resumes.
+        """
+        return []
+
+    def update_sync_cursor(self, sync_time: datetime.datetime, synced_keys: List[str]):
+        """
+        Updates the last sync time (in UTC) and the issues synced at exactly that time
+        """
+        self.update_last_sync_time(sync_time)
+
+    def get_last_jira_sync_time(self) -> Optional[datetime.datetime]:
+        """
+        Returns the last time (in UTC) the changes made in Jira were read, None if they were never read
+        """
+        return None
+
+    def update_last_jira_sync_time(self, sync_time: datetime.datetime):
+        """
+        Updates the last time (in UTC) the changes made in Jira were read
+        """
+
+    @abstractmethod
+    def get_failed_issues(self) -> Dict[str, FailedIssue]:
+        """
+        Returns the issues that failed to sync by GitHub issue number
+        """
+
+    @abstractmethod
+    def update_failed_issue(self, failed_issue: FailedIssue):
+        """
+        Adds or updates an issue that failed to sync
+        """
+
+    @abstractmethod
+    def remove_failed_issue(self, github_issue_no):
+        """
+        Removes an issue that was synced successfully after it failed
+        """
+
+    @abstractmethod
+    def get_outbox(self) -> Dict[str, OutboxEntry]:
+        """
+        Returns the pending mutations by idempotency key
+        """
+
+    @abstractmethod
+    def add_outbox_entry(self, entry: OutboxEntry):
+        """
+        Records a mutation before it is made
+        """
+
+    @abstractmethod
+    def remove_outbox_entry(self, key: str):
+        """
+        Removes a mutation after it was made (or reconciled)
+        """
+
+    def get_rendered_markup(self, digest: str) -> Optional[str]:
+        """
+        Returns the Jira markup rendered before for the Markdown with the given content hash
+        """
+        return None
+
+    def update_rendered_markup(self, digest: str, rendered: str):
+        """
+        Caches the Jira markup rendered for the Markdown with the given content hash
+        """
+
+    def get_attachments(self, jira_issue_key: str) -> Dict[str, str]:
+        """
+        Returns the attachments mirrored to a Jira issue: content hash -> attachment id
+        """
+        return {}
+
+    def get_attachment_digest(self, url: str) -> Optional[str]:
+        """
+        Returns the content hash of an attachment mirrored before
+        """
+        return None
+
+    def get_attachment_names(self, jira_issue_key: str) -> Dict[str, str]:
+        """
+        Returns the file names of the attachments mirrored to a Jira issue: GitHub URL -> attachment file name
+        """
+        return {}
+
+    def update_attachment(self, jira_issue_key: str, url: str, digest: str, attachment_id: str,
+                          name: Optional[str] = None):
+        """
+        Records an attachment mirrored to a Jira issue
+        """
+
+    def get_lag_histogram(self) -> LagHistogram:
+        """
+        Returns the rolling histogram of the sync lag of the last runs
+        """
+        return LagHistogram()
+
+    def update_lag_histogram(self, histogram: LagHistogram):
+        """
+        Stores the rolling histogram of the sync lag
+        """
+
+    def flush(self):
+        """
+        Writes changes that are saved lazily (e.g. caches) at the end of a sync
+        """
+
+    def lease(self, ttl: datetime.timedelta) -> Lease:
+        """
+        Returns the lease that grants one sync at a time exclusive use of this state
+        """
+        return Lease()
+
+    def reload(self):
+        """
+        Reads the state again, e.g. after another sync changed it
+        """
+
     def update_mapping_status(self, github_issue_no, jira_issue_key, status_message):
         """
         Updates the state based on a GitHub issue number and Jira issue key
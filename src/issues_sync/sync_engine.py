@@ -1,16 +1,65 @@
+import copy
+import heapq
 import logging
-from datetime import datetime
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import islice
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+from issues_sync.attachments import AttachmentMirror
 from issues_sync.file_state import InFileState
 from issues_sync.finder import Finder
+from issues_sync.freshness import LAG_BUCKETS, LAG_PERCENTILES, percentile
 from issues_sync.github_connection import GithubConnection
-from issues_sync.issue import BaseIssue
+from issues_sync.issue import BaseIssue, BaseIssueStatus, GITHUB_LABEL_PREFIX
 from issues_sync.jira_connection import JiraConnection
-from issues_sync.state import State
+from issues_sync.lease import Lease, EXIT, acquire as acquire_lease
+from issues_sync.metrics import Metrics
+from issues_sync.pipeline import Pipeline, Stage, Completed
+from issues_sync.plan import SyncPlan, PlannedOperation, CREATE, UPDATE, NOOP, diff_issues, estimate_create_calls, \
+    estimate_update_calls, issue_from_dict, issue_to_dict
+from issues_sync.report import RunReport, SlowIssue, OK, FAILED, SKIPPED
+from issues_sync.scheduler import IssueScheduler
+from issues_sync.state import State, FailedIssue, OutboxEntry
 from issues_sync.sync_strategy import SyncStrategy, GithubToJiraSyncStrategy
+from issues_sync.tracing import span, set_attribute
+from issues_sync.utils import to_utc
 
 log = logging.getLogger(__name__)
 
+# Issues that failed to sync are retried with exponential backoff: 15 minutes, 30 minutes, ... up to a day.
+RETRY_BASE_DELAY = timedelta(minutes=15)
+RETRY_MAX_DELAY = timedelta(days=1)
+
+# workers of the pipeline stages (see SyncEngine pipeline): Jira searches, Jira reads and transform, Jira writes
+PIPELINE_WORKERS = {"find": 4, "transform": 4, "write": 4}
+
+# slowest issues in the run report
+SLOWEST_ISSUES = 10
+
+# imported issues whose identity labels are looked up in Jira with one search, like a page of listed issues
+IMPORT_BATCH_SIZE = 100
+
+
+@dataclass
+class _IssueWork:
+    """
+    An issue on its way through the sync pipeline.
+    """
+    github_issue: BaseIssue
+    outbox_key: Optional[str] = None
+    jira_issue_key: Optional[str] = None
+    # the Jira issue as read and as it is written
+    current: Optional[BaseIssue] = None
+    jira_issue: Optional[BaseIssue] = None
+    write_back: bool = False
+    created: bool = False
+    started: float = field(default_factory=time.perf_counter)
+
 
 class SyncEngine:
 
@@ -18,35 +67,552 @@ class SyncEngine:
                  jira: JiraConnection,
                  sync_strategy: SyncStrategy,
                  state: State = InFileState(),
-                 dry_run: bool = False) -> None:
+                 dry_run: bool = False,
+                 metrics: Optional[Metrics] = None,
+                 scheduler: Optional[IssueScheduler] = None,
+                 lease_policy: str = EXIT,
+                 lease_ttl: timedelta = timedelta(hours=1),
+                 lease_wait: timedelta = timedelta(hours=1),
+                 attachments: Optional[AttachmentMirror] = None,
+                 pipeline: Optional[Dict[str, int]] = None,
+                 pipeline_queue_size: int = 16,
+                 max_watermark_lag: Optional[timedelta] = None) -> None:
         self._github = github
         self._jira = jira
         self._state = state
         self._finder = Finder(self._jira, self._state)
         self._sync_strategy = sync_strategy
         self._dry_run = dry_run
+        self._metrics = metrics or Metrics()
+        self._scheduler = scheduler or IssueScheduler()
+        self._lease_policy = lease_policy
+        self._lease_ttl = lease_ttl
+        self._lease_wait = lease_wait
+        self._lease = Lease()
+        self._attachments = attachments
+        # stage -> workers; without a pipeline the issues are synced one after the other
+        self._pipeline = dict(PIPELINE_WORKERS, **pipeline) if pipeline is not None else None
+        self._pipeline_queue_size = pipeline_queue_size
+        # (seconds, github issue) of the slowest issues of the run, a min-heap
+        self._slowest: List[Tuple[float, str]] = []
+        # seconds from the GitHub change until the Jira write succeeded, per issue of the run
+        self._lags: List[float] = []
+        # GitHub issues synced as closed in the run, which issues closed in Jira need not close (see _record_closed)
+        self._closed_on_github: Set[str] = set()
+        # a warning is logged if the watermark is further behind the wall clock
+        self._max_watermark_lag = max_watermark_lag
+        # the time up to which all GitHub changes were synced in the run (see _record_freshness)
+        self._caught_up_at: Optional[datetime] = None
+        # imported changes can be years old and are not counted in the lag
+        self._importing = False
+        self._watermark_lag: Optional[float] = None
+        # the report of the last sync
+        self.report: Optional[RunReport] = None
+
+    def sync(self, max_duration: Optional[timedelta] = None, max_issues: Optional[int] = None):
+        """
+        Syncs the issues changed since the last sync.
+        If max_duration or max_issues is reached the sync stops after the current issue
+        and the next sync resumes from there. Afterwards `report` describes the run.
+        """
+        self._run(lambda: self._sync(max_duration, max_issues))
+
+    def import_issues(self, issues: Iterable[BaseIssue], exported_at: Optional[datetime] = None):
+        """
+        Syncs issues read from an export (see github_export) instead of listed from GitHub, e.g. to seed Jira for
+        a large repository without spending the GitHub rate limit. Afterwards the last sync time is the time of the
+        export (by default the latest update in it), so the next sync reads the changes since then from the API.
+        Afterwards `report` describes the run.
+        """
+        self._run(lambda: self._import(issues, exported_at))
 
-    def sync(self):
+    def _run(self, run: Callable[[], None]):
+        started_at = datetime.utcnow()
+        self._slowest = []
+        self._lags = []
+        self._closed_on_github = set()
+        self._caught_up_at = None
+        self._watermark_lag = None
+        self._finder.clear()
+        result = OK
+        error = None
+        watermark_before = None
+        try:
+            with span("sync"), self._leased() as leased:
+                if leased:
+                    watermark_before = self._state.get_last_sync_time()
+                    run()
+                else:
+                    result = SKIPPED
+        except Exception as e:
+            result = FAILED
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.report = RunReport.from_metrics(
+                self._metrics, started_at, datetime.utcnow(), result=result, error=error,
+                watermark_before=watermark_before,
+                watermark_after=self._state.get_last_sync_time() if watermark_before else None,
+                watermark_lag_seconds=self._watermark_lag,
+                lag_seconds={name: round(percentile(self._lags, q), 3) for name, q in LAG_PERCENTILES if self._lags},
+                slowest_issues=[SlowIssue(key, round(seconds, 3)) for seconds, key in sorted(self._slowest, reverse=True)])
+
+    @contextmanager
+    def _leased(self):
+        """
+        Holds the lease of the state so that overlapping syncs (e.g. from cron) do not duplicate work.
+        If another sync holds it, the lease policy decides whether to give up or to wait for it.
+        """
+        lease = self._state.lease(self._lease_ttl)
+        if not acquire_lease(lease, self._lease_policy, self._lease_wait):
+            log.warning("Another sync is running on the same state. This sync is skipped.")
+            self._metrics.inc("skipped_syncs")
+            yield False
+            return
+        self._lease = lease
+        try:
+            # while waiting for the lease another sync changed the state, only the remaining changes are synced
+            self._state.reload()
+            yield True
+        finally:
+            self._state.flush()
+            self._lease = Lease()
+            lease.release()
+
+    def _sync(self, max_duration: Optional[timedelta], max_issues: Optional[int]):
         log.info("Start sync ...")
+        deadline = time.monotonic() + max_duration.total_seconds() if max_duration else None
+        count = 0
+
+        def budget_exhausted():
+            return (max_issues is not None and count >= max_issues) or (deadline and time.monotonic() >= deadline)
 
+        # The cursor is the last sync time and the issues synced at exactly that time.
+        # Issues are streamed least recently updated first, so the cursor can move after each issue.
         sync_time = self._state.get_last_sync_time()
-        log.info(f"Last sync time: {sync_time}")
-        github_issues = self._github.get_issues(sync_time)
-        log.info(f"Found {len(github_issues)} github issues to sync")
-        github_issues.sort(key=lambda x: x.updated_at if x.updated_at is not None else datetime.min)
+        synced_keys = set(self._state.get_last_synced_keys())
+        log.info(f"Last sync time: {sync_time}, issues already synced at that time: {len(synced_keys)}")
+
+        self._recover_outbox()
+        self._retry_failed_issues()
+
+        # When the sync is behind, fresh changes go first so that they do not wait for the backfill.
+        now = datetime.utcnow()
+        backfill = self._scheduler.is_backfill(sync_time, now)
+        fresh_synced = {}
+        if backfill:
+            fresh_since = self._scheduler.fresh_since(now)
+            fresh_issues = list(self._github.get_issues(fresh_since, is_mapped=self._is_mapped,
+                                                        on_page=self._finder.prefetch))
+            fresh_issues = self._scheduler.order(fresh_issues, self._state, fresh_since)
+            log.info(f"Sync is behind, syncing {len(fresh_issues)} issues changed since {fresh_since} first")
+
+            def fresh():
+                nonlocal count
+                for github_issue in fresh_issues:
+                    if budget_exhausted():
+                        return
+                    count += 1
+                    yield github_issue, True
+
+            def fresh_synced_issue(github_issue: BaseIssue):
+                fresh_synced[github_issue.key] = github_issue.updated_at
+
+            self._sync_issues(fresh(), fresh_synced_issue)
+
+        def changed():
+            nonlocal count
+            backfill_count = 0
+            listed_at = datetime.utcnow()
+            for github_issue in self._github.get_issues(sync_time, is_mapped=self._is_mapped,
+                                                        on_page=self._finder.prefetch):
+                if github_issue.updated_at == sync_time and github_issue.key in synced_keys:
+                    continue
+                already_synced = github_issue.key in fresh_synced \
+                    and fresh_synced[github_issue.key] == github_issue.updated_at
+                if not already_synced:
+                    backfill_limit = self._scheduler.backfill_limit if backfill else None
+                    if budget_exhausted() or (backfill_limit is not None and backfill_count >= backfill_limit):
+                        log.info(f"Sync budget reached after {count} issues. The next sync resumes from {sync_time}.")
+                        return
+                    count += 1
+                    backfill_count += 1
+                yield github_issue, not already_synced
+            self._caught_up_at = listed_at
+
+        def move_cursor(github_issue: BaseIssue):
+            nonlocal sync_time, synced_keys
+            # failed issues are in the dead letter table, so the cursor can move past them
+            if github_issue.updated_at is not None:
+                if github_issue.updated_at != sync_time:
+                    sync_time = github_issue.updated_at
+                    synced_keys = set()
+                synced_keys.add(github_issue.key)
+                self._state.update_sync_cursor(sync_time, sorted(synced_keys))
+
+        self._sync_issues(changed(), move_cursor)
+        log.info(f"Synced {count} github issues")
+        if self._attachments is not None:
+            self._attachments.collect(wait=True)
+        self._sync_jira_changes()
+        self._metrics.set("failed_issues", len(self._state.get_failed_issues()))
+        self._record_freshness()
+
+    def _import(self, issues: Iterable[BaseIssue], exported_at: Optional[datetime]):
+        log.info("Start import ...")
+        self._recover_outbox()
+        count = 0
+        latest = None
+
+        def imported():
+            nonlocal count, latest
+            remaining = iter(issues)
+            while True:
+                batch = list(islice(remaining, IMPORT_BATCH_SIZE))
+                if not batch:
+                    return
+                self._finder.prefetch({i.key: i.identity for i in batch if i.identity})
+                for github_issue in batch:
+                    count += 1
+                    if github_issue.updated_at is not None and (latest is None or github_issue.updated_at > latest):
+                        latest = github_issue.updated_at
+                    yield github_issue, True
+
+        self._importing = True
+        try:
+            self._sync_issues(imported(), lambda github_issue: None)
+        finally:
+            self._importing = False
+        if self._attachments is not None:
+            self._attachments.collect(wait=True)
+        sync_time = exported_at or latest
+        if sync_time is not None:
+            # issues that failed are in the dead letter table, so the API sync can start after the export
+            self._state.update_last_sync_time(sync_time)
+        log.info(f"Imported {count} github issues. The next sync reads the changes since {sync_time} from GitHub.")
+        self._metrics.set("failed_issues", len(self._state.get_failed_issues()))
+
+    def _sync_issues(self, issues: Iterable[Tuple[BaseIssue, bool]], synced: Callable[[BaseIssue], None]):
+        """
+        Syncs the issues that need it and calls synced for each issue in the given order once it (and all issues
+        before it) are done, so that the cursor never moves past an issue that is still in flight.
+        """
+        if self._pipeline is None:
+            for github_issue, needs_sync in issues:
+                if needs_sync:
+                    self._sync_isolated(github_issue)
+                synced(github_issue)
+            return
+        self._sync_pipelined(issues, synced)
+
+    def _sync_pipelined(self, issues: Iterable[Tuple[BaseIssue, bool]], synced: Callable[[BaseIssue], None]):
+        """
+        Syncs the issues in a pipeline of stages that run concurrently: find the Jira issue, read and transform it
+        and write it. Listing the GitHub issues and committing the results to the state is done by this thread,
+        which is the only one that changes the state.
+        Issues are committed in any order but released in listing order, so the issues after a slow one are held:
+        the listing waits while as many issues as the pipeline holds are, and while the same issue (listed again as
+        it changed meanwhile) is still in the pipeline, so that it is not found missing and created twice.
+        """
+        stages = [Stage("find", self._find_stage, self._pipeline["find"], self._pipeline_queue_size),
+                  Stage("transform", self._transform_stage, self._pipeline["transform"], self._pipeline_queue_size),
+                  Stage("write", self._write_stage, self._pipeline["write"], self._pipeline_queue_size)]
+        # sequence number -> [issue, done] in listing order
+        in_flight = OrderedDict()
+        # GitHub issues in the pipeline
+        in_pipeline: Set[str] = set()
+
+        def done(sequence: int):
+            in_flight[sequence][1] = True
+            while in_flight and next(iter(in_flight.values()))[1]:
+                github_issue, _ = in_flight.popitem(last=False)[1]
+                synced(github_issue)
+
+        def commit(completed: Completed):
+            sequence, work = completed.item
+            self._commit(work, completed.error)
+            in_pipeline.discard(work.github_issue.key)
+            done(sequence)
+
+        with span("sync_pipeline"), Pipeline(stages, self._metrics) as pipeline:
+            for sequence, (github_issue, needs_sync) in enumerate(issues):
+                while len(in_flight) >= pipeline.capacity or (needs_sync and github_issue.key in in_pipeline):
+                    for completed in pipeline.wait():
+                        commit(completed)
+                in_flight[sequence] = [github_issue, False]
+                if not needs_sync:
+                    done(sequence)
+                    continue
+                self._lease.renew()
+                in_pipeline.add(github_issue.key)
+                work = _IssueWork(github_issue)
+                if not self._dry_run:
+                    work.outbox_key = self._write_ahead_sync(github_issue)
+                for completed in pipeline.put((sequence, work)):
+                    commit(completed)
+            for completed in pipeline.drain():
+                commit(completed)
+        log.info(f"Pipeline {pipeline.stats()}")
+
+    def _write_ahead_sync(self, github_issue: BaseIssue) -> str:
+        # whether the issue is created or updated is known in the pipeline only, so the state decides the action
+        jira_issue_key = self._state.get_jira_issue(github_issue.key)
+        if jira_issue_key is not None:
+            return self._write_ahead(f"update-{jira_issue_key}", UPDATE, github_issue.key, jira_issue_key)
+        return self._write_ahead(github_issue.identity or f"create-{github_issue.key}", CREATE, github_issue.key)
+
+    def _find_stage(self, item: Tuple[int, _IssueWork]) -> Tuple[int, _IssueWork]:
+        _, work = item
+        github_issue = work.github_issue
+        work.jira_issue_key = self._finder.find_jira_issue_key(github_issue.key, github_issue.title.value,
+                                                               github_issue.identity, save=False)
+        return item
+
+    def _transform_stage(self, item: Tuple[int, _IssueWork]) -> Tuple[int, _IssueWork]:
+        _, work = item
+        with span("transform_issue", github_issue=work.github_issue.key, jira_issue=work.jira_issue_key):
+            if work.jira_issue_key is None:
+                work.jira_issue = self._sync_strategy.build_jira_issue(work.github_issue)
+            else:
+                work.current = self._jira.get_issue(work.jira_issue_key)
+                self._read_deleted_comments(work.github_issue, work.current)
+                # transform replaces the fields of the issue, so a shallow copy keeps the one read unchanged
+                work.jira_issue = copy.copy(work.current)
+                work.write_back = self._sync_strategy.transform(work.jira_issue, work.github_issue)
+        return item
+
+    def _write_stage(self, item: Tuple[int, _IssueWork]) -> Tuple[int, _IssueWork]:
+        _, work = item
+        github_issue = work.github_issue
+        if self._dry_run:
+            log.info(f"DRY RUN: {'Update' if work.jira_issue_key else 'Create'} jira issue "
+                     f"{work.jira_issue_key or ''} for github issue {github_issue.key}")
+            return item
+        with span("write_issue", github_issue=github_issue.key, jira_issue=work.jira_issue_key):
+            if work.jira_issue_key is None:
+                work.jira_issue_key = self._jira.create_issue(work.jira_issue)
+                work.created = True
+            else:
+                self._jira.update_issue(work.jira_issue, work.current)
+                if work.write_back:
+                    self._github.update_issue(github_issue)
+        return item
 
-        for github_issue in github_issues:
+    def _commit(self, work: _IssueWork, error: Optional[Exception]):
+        github_issue = work.github_issue
+        self._record_issue_time(github_issue.key, time.perf_counter() - work.started)
+        if error is not None:
+            # the outbox entry stays, so the mutation is reconciled by the next run
+            self._record_failure(github_issue.key, error)
+            return
+        if work.jira_issue_key is not None and self._state.get_jira_issue(github_issue.key) != work.jira_issue_key:
+            self._state.update(github_issue.key, work.jira_issue_key)
+        if self._dry_run:
+            self._metrics.inc("issues", result="skipped")
+        else:
+            self._state.remove_outbox_entry(work.outbox_key)
+            self._metrics.inc("issues", result="created" if work.created else "updated")
+            self._record_lag(github_issue)
+            self._record_closed(github_issue)
+            self._mirror_attachments(work.jira_issue_key, github_issue)
+        if github_issue.key in self._state.get_failed_issues():
+            self._state.remove_failed_issue(github_issue.key)
+
+    def _sync_jira_changes(self):
+        """
+        Closes the GitHub issues whose Jira issue was closed. Only the Jira issues changed since the last run are read.
+        """
+        since = self._state.get_last_jira_sync_time()
+        started = datetime.utcnow()
+        if since is None:
+            # on the first run the status was aligned by syncing the GitHub issues, so changes are read from now on
+            self._state.update_last_jira_sync_time(started)
+            return
+        closed = 0
+        with span("sync_jira_changes"):
+            try:
+                for jira_issue in self._jira.get_changed_issues(since):
+                    github_issue_no = self._state.get_github_issue(jira_issue.key)
+                    if github_issue_no is None or jira_issue.status.value != BaseIssueStatus.CLOSED:
+                        continue
+                    if github_issue_no in self._closed_on_github:
+                        self._metrics.inc("skipped_writes", system="github", write="status")
+                        continue
+                    if self._dry_run:
+                        log.info(f"DRY RUN: Close github issue {github_issue_no} as jira issue {jira_issue.key} is closed")
+                        continue
+                    try:
+                        if self._github.update_issue_status(github_issue_no, BaseIssueStatus.CLOSED):
+                            closed += 1
+                    except Exception as e:
+                        # the retry syncs the GitHub issue, which closes it as well
+                        self._record_failure(github_issue_no, e)
+            except Exception as e:
+                log.error(f"Failed to read the issues changed in Jira since {since}: {e}")
+                return
+        log.info(f"Closed {closed} github issues closed in Jira")
+        self._metrics.inc("github_issues_closed", closed)
+        self._state.update_last_jira_sync_time(started)
+
+    def _read_deleted_comments(self, github_issue: BaseIssue, jira_issue: BaseIssue):
+        """
+        Reads the comments of a GitHub issue listed without them if its comment count differs from the Jira issue's:
+        the comment feed has no deleted comments, so they are only noticed by the count.
+        """
+        if github_issue.comments is None and github_issue.comment_count is not None \
+                and jira_issue.comments is not None and github_issue.comment_count != len(jira_issue.comments):
+            log.info(f"Comments of github issue {github_issue.key} were deleted, reading them")
+            github_issue.comments = self._github.get_issue(github_issue.key).comments
+
+    def _is_mapped(self, github_issue_no: str) -> bool:
+        # the Jira issue of an issue that failed to sync may lack comments, so its comments are read in full
+        return self._state.get_jira_issue(github_issue_no) is not None \
+            and github_issue_no not in self._state.get_failed_issues()
+
+    def _sync_isolated(self, github_issue: BaseIssue) -> bool:
+        """
+        Syncs an issue. A failure is recorded in the dead letter table instead of stopping the sync.
+        """
+        self._lease.renew()
+        started = time.perf_counter()
+        try:
+            self._sync_issue(github_issue)
+        except Exception as e:
+            self._record_failure(github_issue.key, e)
+            return False
+        finally:
+            self._record_issue_time(github_issue.key, time.perf_counter() - started)
+        if github_issue.key in self._state.get_failed_issues():
+            self._state.remove_failed_issue(github_issue.key)
+        return True
+
+    def _record_issue_time(self, github_issue_no: str, seconds: float):
+        self._metrics.observe("issue_sync_seconds", seconds)
+        if len(self._slowest) < SLOWEST_ISSUES:
+            heapq.heappush(self._slowest, (seconds, github_issue_no))
+        else:
+            heapq.heappushpop(self._slowest, (seconds, github_issue_no))
+
+    def _record_lag(self, github_issue: BaseIssue):
+        """
+        Records how long the GitHub change took to reach Jira. Called once the Jira write succeeded.
+        """
+        if github_issue.updated_at is None or self._importing:
+            return
+        lag = max(0.0, (to_utc(datetime.utcnow()) - to_utc(github_issue.updated_at)).total_seconds())
+        self._lags.append(lag)
+        self._metrics.observe("sync_lag_seconds", lag, buckets=LAG_BUCKETS)
+
+    def _record_closed(self, github_issue: BaseIssue):
+        """
+        Remembers the GitHub issues synced as closed in this run (the strategy closes them if their Jira issue is),
+        so that closing their Jira issue does not read them again. Called once the sync of the issue succeeded.
+        """
+        if github_issue.status.value == BaseIssueStatus.CLOSED:
+            self._closed_on_github.add(github_issue.key)
+
+    def _record_freshness(self):
+        """
+        Adds the lags of the run to the rolling histogram in the state, exposes the percentiles of the run and of the
+        last runs as metrics and warns if the watermark is too far behind the wall clock. The watermark is the time
+        up to which all GitHub changes are synced: the start of the listing if the run got through all changes,
+        else the last sync time.
+        """
+        histogram = self._state.get_lag_histogram()
+        if self._lags:
+            histogram.add_run(self._lags)
+            self._state.update_lag_histogram(histogram)
+        for name, q in LAG_PERCENTILES:
+            run_lag = percentile(self._lags, q)
+            if run_lag is not None:
+                self._metrics.set(f"sync_lag_{name}_seconds", run_lag, window="run")
+            rolling_lag = histogram.percentile(q)
+            if rolling_lag is not None:
+                self._metrics.set(f"sync_lag_{name}_seconds", rolling_lag, window="rolling")
+
+        watermark = self._caught_up_at or self._state.get_last_sync_time()
+        self._watermark_lag = round((to_utc(datetime.utcnow()) - to_utc(watermark)).total_seconds(), 3)
+        self._metrics.set("watermark_lag_seconds", self._watermark_lag)
+        if self._max_watermark_lag is not None and self._watermark_lag > self._max_watermark_lag.total_seconds():
+            log.warning(f"The sync is behind: changes since {watermark} are not synced yet, "
+                        f"{timedelta(seconds=int(self._watermark_lag))} ago (more than {self._max_watermark_lag})")
+
+    def _record_failure(self, github_issue_no: str, error: Exception):
+        self._metrics.inc("issues", result="failed")
+        previous = self._state.get_failed_issues().get(github_issue_no)
+        attempts = previous.attempts + 1 if previous else 1
+        next_retry_time = datetime.utcnow() + min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        log.error(f"Failed to sync github issue {github_issue_no} (attempt {attempts}): {error}. "
+                  f"Next retry after {next_retry_time}")
+        self._state.update_failed_issue(
+            FailedIssue(github_issue_no, f"{type(error).__name__}: {error}", attempts, next_retry_time))
+
+    def _retry_failed_issues(self):
+        now = datetime.utcnow()
+        due = [f for f in self._state.get_failed_issues().values() if f.next_retry_time <= now]
+        if due:
+            log.info(f"Retrying {len(due)} issues that failed to sync before")
+        for failed_issue in due:
+            try:
+                github_issue = self._github.get_issue(failed_issue.github_issue_no)
+            except Exception as e:
+                self._record_failure(failed_issue.github_issue_no, e)
+                continue
+            self._sync_isolated(github_issue)
+
+    def _write_ahead(self, key: str, action: str, github_issue_no: str, jira_issue_key: Optional[str] = None) -> str:
+        """
+        Records a Jira mutation in the outbox before it is made. The entry is removed once the result is saved.
+        """
+        self._state.add_outbox_entry(OutboxEntry(key, action, github_issue_no, jira_issue_key, datetime.utcnow()))
+        return key
+
+    def _recover_outbox(self):
+        """
+        Reconciles the mutations a previous run started but did not confirm (e.g. because the process died):
+        pending creates are looked up by their identity label (the idempotency key) in one search and mapped,
+        pending updates and the creates that were made are synced again, as comments and status are written after
+        the create. Issues that failed to sync are synced again only once their retry is due, like the other ones in
+        the dead letter table, and their entries are kept until then.
+        """
+        outbox = list(self._state.get_outbox().values())
+        if not outbox:
+            return
+        log.info(f"Recovering {len(outbox)} unconfirmed Jira mutations")
+        creates = [e for e in outbox if e.action == CREATE]
+        labels = [e.key for e in creates if e.key.startswith(GITHUB_LABEL_PREFIX)]
+        created = self._jira.find_issue_keys_by_labels(labels) if labels else {}
+        unconfirmed = [e for e in outbox if e.action == UPDATE]
+        for entry in creates:
+            jira_issue_key = created.get(entry.key)
+            if jira_issue_key and self._state.get_jira_issue(entry.github_issue_no) is None:
+                log.info(f"Found jira issue {jira_issue_key} created for github issue {entry.github_issue_no}")
+                self._state.update(entry.github_issue_no, jira_issue_key)
+                unconfirmed.append(entry)
+            else:
+                self._state.remove_outbox_entry(entry.key)
+        now = datetime.utcnow()
+        failed_issues = self._state.get_failed_issues()
+        for entry in unconfirmed:
+            failed_issue = failed_issues.get(entry.github_issue_no)
+            if failed_issue is not None and failed_issue.next_retry_time > now:
+                continue
+            self._state.remove_outbox_entry(entry.key)
             try:
-                self._sync_issue(github_issue)
-                if github_issue.updated_at is not None:
-                    self._state.update_last_sync_time(github_issue.updated_at)
+                github_issue = self._github.get_issue(entry.github_issue_no)
             except Exception as e:
-                log.error(f"Failed to sync github issue {github_issue.key}: {e}")
-                raise e
+                self._record_failure(entry.github_issue_no, e)
+                continue
+            self._sync_isolated(github_issue)
 
     def _sync_issue(self, github_issue: BaseIssue):
+        with span("sync_issue", github_issue=github_issue.key):
+            self._sync_issue_with_jira(github_issue)
+
+    def _sync_issue_with_jira(self, github_issue: BaseIssue):
         log.info(f"Sync issue {github_issue.key}")
-        issue_key = self._finder.find_jira_issue_key(github_issue.key, github_issue.title.value)
+        issue_key = self._finder.find_jira_issue_key(github_issue.key, github_issue.title.value, github_issue.identity)
+        set_attribute("jira_issue", issue_key)
         if issue_key is not None:
             log.info(f"Found jira issue {issue_key} for github issue {github_issue.key}")
             self._update_jira_issue(issue_key, github_issue)
@@ -57,19 +623,166 @@ class SyncEngine:
     def _create_jira_issue(self, github_issue: BaseIssue):
         if self._dry_run:
             log.info(f"DRY RUN: Create jira issue for github issue {github_issue.key}")
+            self._metrics.inc("issues", result="skipped")
             return
         try:
+            outbox_key = self._write_ahead(github_issue.identity or f"create-{github_issue.key}", CREATE,
+                                           github_issue.key)
             issue_key = self._sync_strategy.create_jira_issue(github_issue)
             self._state.update(github_issue.key, issue_key)
+            self._state.remove_outbox_entry(outbox_key)
+            self._metrics.inc("issues", result="created")
+            self._record_lag(github_issue)
+            self._record_closed(github_issue)
+            self._mirror_attachments(issue_key, github_issue)
         except Exception as e:
             log.error(f"Failed to create Jira issue for github issue {github_issue.key}: {e}")
+            raise
 
     def _update_jira_issue(self, issue_key: str, github_issue: BaseIssue):
         if self._dry_run:
             log.info(f"DRY RUN: Update jira issue {issue_key} with github issue {github_issue.key}")
+            self._metrics.inc("issues", result="skipped")
             return
         try:
+            outbox_key = self._write_ahead(f"update-{issue_key}", UPDATE, github_issue.key, issue_key)
             jira_issue = self._jira.get_issue(issue_key)
+            self._read_deleted_comments(github_issue, jira_issue)
             self._sync_strategy.update(jira_issue, github_issue)
+            self._state.remove_outbox_entry(outbox_key)
+            self._metrics.inc("issues", result="updated")
+            self._record_lag(github_issue)
+            self._record_closed(github_issue)
+            self._mirror_attachments(issue_key, github_issue)
         except Exception as e:
             log.error(f"Failed to update Jira issue {issue_key} with github issue {github_issue.key}: {e}")
+            raise
+
+    def _mirror_attachments(self, issue_key: str, github_issue: BaseIssue):
+        if self._attachments is not None:
+            self._attachments.submit(issue_key, github_issue)
+
+    def plan(self) -> SyncPlan:
+        """
+        Reads all changed issues and computes the operations a sync would do without making any changes.
+        """
+        with span("plan"):
+            since = self._state.get_last_sync_time()
+            github_issues = list(self._github.get_issues(since))
+
+            # the issues found in Jira are mapped when the plan is applied
+            mapping = self._finder.find_jira_issue_keys(github_issues, save=False)
+            jira_issues = {i.key: i for i in self._jira.get_issues([k for k in mapping.values() if k])}
+
+            operations = [self._plan_issue(i, jira_issues.get(mapping[i.key])) for i in github_issues]
+            until = max((i.updated_at for i in github_issues if i.updated_at is not None), default=None)
+            plan = SyncPlan(since=since, until=until, operations=operations)
+            log.info(f"Planned {plan.count(CREATE)} creates, {plan.count(UPDATE)} updates "
+                     f"and {plan.count(NOOP)} unchanged issues with about {plan.api_calls} API calls")
+            return plan
+
+    def _plan_issue(self, github_issue: BaseIssue, jira_issue: Optional[BaseIssue]) -> PlannedOperation:
+        if jira_issue is None:
+            desired = self._sync_strategy.build_jira_issue(github_issue)
+            return PlannedOperation(CREATE, github_issue.key, None,
+                                    changes={"summary": {"from": None, "to": desired.title.value}},
+                                    issue=issue_to_dict(desired), api_calls=estimate_create_calls(desired))
+
+        desired = copy.deepcopy(jira_issue)
+        write_back = self._sync_strategy.transform(desired, github_issue)
+        mapped_fields = self._jira.mapped_fields(jira_issue, desired)
+        changes = diff_issues(jira_issue, desired, mapped_fields)
+        if not changes and not write_back:
+            return PlannedOperation(NOOP, github_issue.key, jira_issue.key)
+        api_calls = estimate_update_calls(jira_issue, desired, mapped_fields)
+        github_update = None
+        if write_back:
+            github_update = issue_to_dict(github_issue)
+            changes["github_status"] = {"from": None, "to": github_issue.status.value.value}
+            api_calls += 3  # GitHub issue read, state edit and comments read
+        return PlannedOperation(UPDATE, github_issue.key, jira_issue.key, changes=changes,
+                                issue=issue_to_dict(desired), github_update=github_update, api_calls=api_calls)
+
+    def apply(self, plan: SyncPlan, workers: int = 8, batch_size: int = 50):
+        """
+        Runs exactly the operations of the plan, batch by batch with up to `workers` in parallel.
+        The plan must start at the last sync time, i.e. no sync or apply ran since it was made, and creates of issues
+        that exist in Jira by now (e.g. from an earlier apply of the plan that failed) are skipped.
+        The last sync time moves to the end of the plan only if all operations succeeded.
+        """
+        with self._leased() as leased:
+            if leased:
+                self._apply(plan, workers, batch_size)
+
+    def _apply(self, plan: SyncPlan, workers: int, batch_size: int):
+        last_sync_time = self._state.get_last_sync_time()
+        if to_utc(plan.since) != to_utc(last_sync_time):
+            raise ValueError(f"The plan covers the changes since {plan.since} but the last sync time is "
+                             f"{last_sync_time}: the issues were synced since the plan was made. Create a new plan.")
+        existing = self._find_created(plan)
+        operations = [op for op in plan.operations if op.action != NOOP and op.github_issue not in existing]
+        log.info(f"Applying {len(operations)} operations with {workers} workers")
+        failed = 0
+        with span("apply"), ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(operations), batch_size):
+                self._lease.renew()
+                batch = operations[start:start + batch_size]
+                outbox_keys = {id(op): self._write_ahead(self._outbox_key(op), op.action, op.github_issue, op.jira_issue)
+                               for op in batch}
+                futures = {executor.submit(self._apply_operation, op): op for op in batch}
+                for future in as_completed(futures):
+                    op = futures[future]
+                    try:
+                        jira_issue_key = future.result()
+                    except Exception as e:
+                        log.error(f"Failed to {op.action} Jira issue for github issue {op.github_issue}: {e}")
+                        self._metrics.inc("issues", result="failed")
+                        failed += 1
+                        continue
+                    # the plan does not map the issues it found in Jira
+                    if self._state.get_jira_issue(op.github_issue) != jira_issue_key:
+                        self._state.update(op.github_issue, jira_issue_key)
+                    self._metrics.inc("issues", result="created" if op.action == CREATE else "updated")
+                    self._state.remove_outbox_entry(outbox_keys[id(op)])
+        for op in plan.operations:
+            if op.action == NOOP and self._state.get_jira_issue(op.github_issue) != op.jira_issue:
+                self._state.update(op.github_issue, op.jira_issue)
+        self._metrics.inc("issues", plan.count(NOOP) + len(existing), result="skipped")
+        if failed:
+            log.warning(f"{failed} operations failed. Last sync time is not updated.")
+        elif plan.until is not None and to_utc(plan.until) > to_utc(last_sync_time):
+            self._state.update_last_sync_time(plan.until)
+
+    def _find_created(self, plan: SyncPlan) -> Dict[str, str]:
+        """
+        Returns the planned creates whose Jira issue exists already, mapped in the state or found by the identity
+        label in one search, as GitHub issue number -> Jira issue key. The ones found in Jira are mapped.
+        """
+        creates = [op for op in plan.operations if op.action == CREATE]
+        existing = {op.github_issue: self._state.get_jira_issue(op.github_issue) for op in creates
+                    if self._state.get_jira_issue(op.github_issue) is not None}
+        by_label = {op.issue["identity"]: op.github_issue for op in creates
+                    if op.github_issue not in existing and op.issue.get("identity")}
+        if by_label:
+            for label, jira_issue_key in self._jira.find_issue_keys_by_labels(list(by_label)).items():
+                self._state.update(by_label[label], jira_issue_key)
+                existing[by_label[label]] = jira_issue_key
+        for github_issue_no, jira_issue_key in existing.items():
+            log.info(f"Skipping the planned create of github issue {github_issue_no}: "
+                     f"it exists as jira issue {jira_issue_key}")
+        return existing
+
+    @staticmethod
+    def _outbox_key(op: PlannedOperation) -> str:
+        if op.action == CREATE:
+            return op.issue.get("identity") or f"create-{op.github_issue}"
+        return f"update-{op.jira_issue}"
+
+    def _apply_operation(self, op: PlannedOperation) -> str:
+        with span("apply_operation", github_issue=op.github_issue, jira_issue=op.jira_issue):
+            if op.action == CREATE:
+                return self._jira.create_issue(issue_from_dict(op.issue))
+            self._jira.update_issue(issue_from_dict(op.issue))
+            if op.github_update:
+                self._github.update_issue(issue_from_dict(op.github_update))
+            return op.jira_issue
@@ -1,10 +1,12 @@
 import abc
 import copy
-from typing import List
+from typing import List, Optional
 
 from issues_sync.github_connection import GithubConnection
-from issues_sync.issue import BaseIssue, BaseIssueStatus, BaseIssueComment
+from issues_sync.issue import BaseIssue, BaseIssueStatus, BaseIssueComment, BaseIssueField
 from issues_sync.jira_connection import JiraConnection
+from issues_sync.markup import MarkupConverter
+from issues_sync.tracing import span
 
 
 class SyncStrategy(abc.ABC):
@@ -23,56 +25,97 @@ class SyncStrategy(abc.ABC):
         :return: Jira issue key that was created
         """
 
+    @abc.abstractmethod
+    def transform(self, jira_issue: BaseIssue, github_issue: BaseIssue) -> bool:
+        """
+        Changes jira and github issue in memory to their desired state without writing them.
+        :return: True if the github issue needs to be written back
+        """
+
+    @abc.abstractmethod
+    def build_jira_issue(self, github_issue: BaseIssue) -> BaseIssue:
+        """
+        Builds (without creating) the Jira issue for a GitHub issue that is not synced yet.
+        """
+
 
 class GithubToJiraSyncStrategy(SyncStrategy):
     """Sync strategy for one direction sync."""
 
-    def __init__(self, jira_connection: JiraConnection, github_connection: GithubConnection) -> None:
+    def __init__(self, jira_connection: JiraConnection, github_connection: GithubConnection,
+                 converter: Optional[MarkupConverter] = None) -> None:
         self._jira_connection = jira_connection
         self._github_connection = github_connection
+        self._converter = converter or MarkupConverter()
 
     def update(self, jira_issue: BaseIssue, github_issue: BaseIssue) -> None:
-        setattr(github_issue, "change_detected", False);
-        self._update_issue_fields(jira_issue, github_issue)
-        self._update_comments(jira_issue, github_issue)
-        self._jira_connection.update_issue(jira_issue)
-        if getattr(github_issue, "change_detected"):
+        # transform replaces the fields instead of changing them, so a shallow copy keeps the issue as read from Jira
+        current = copy.copy(jira_issue)
+        change_detected = self.transform(jira_issue, github_issue)
+        self._jira_connection.update_issue(jira_issue, current)
+        if change_detected:
             self._github_connection.update_issue(github_issue)
 
+    def transform(self, jira_issue: BaseIssue, github_issue: BaseIssue) -> bool:
+        setattr(github_issue, "change_detected", False);
+        with span("strategy.transform", github_issue=github_issue.key, jira_issue=jira_issue.key):
+            self._update_issue_fields(jira_issue, github_issue)
+            self._update_comments(jira_issue, github_issue)
+        return getattr(github_issue, "change_detected")
+
     def _update_issue_fields(self, jira_issue: BaseIssue, github_issue: BaseIssue):
-        jira_issue.description.value = f"""
+        jira_issue.description = BaseIssueField(f"""
 Issue created by automatic sync. 
 Original URL: {github_issue.html_url}
 
 Do not edit this issue manually as the sync is one direction. 
 Only status and labels can be changed.
 --------------------------------------------------------- ---
-{github_issue.description.value}"""
+{self._converter.link(jira_issue.key, self._converter.convert(github_issue.description.value))}""",
+                                            jira_issue.description.updated_at)
         jira_issue.title = github_issue.title
+        jira_issue.identity = github_issue.identity
+        jira_issue.labels = github_issue.labels
+        jira_issue.assignees = github_issue.assignees
+        jira_issue.milestone = github_issue.milestone
 
         if github_issue.status.value != jira_issue.status.value:
             # when conflict we always pick latest in the cycle
             # since currently we have 2 phases (open and closed) , closed is always the latest.
             if github_issue.status.value != BaseIssueStatus.CLOSED:
                 setattr(github_issue, "change_detected", True)
-            jira_issue.status.value = BaseIssueStatus.CLOSED
+            jira_issue.status = BaseIssueField(BaseIssueStatus.CLOSED, jira_issue.status.updated_at)
             github_issue.status.value = BaseIssueStatus.CLOSED
 
-    @staticmethod
-    def _update_comments(jira_issue: BaseIssue, github_issue: BaseIssue):
+    def _update_comments(self, jira_issue: BaseIssue, github_issue: BaseIssue):
         github_comments = github_issue.comments
+        if github_comments is None:
+            # comments did not change, so the Jira comments are left as they are
+            jira_issue.comments = None
+            return
         new_comments: List[BaseIssueComment] = []
         for github_comment in github_comments:
             body = f"""
 {github_comment.user.value} wrote on GitHub:
-{github_comment.body.value}
+{self._converter.link(jira_issue.key, self._converter.convert(github_comment.body.value))}
             """
             new_comments.append(BaseIssueComment(body, github_comment.user, github_comment.updated_at))
         jira_issue.comments = new_comments
 
     def create_jira_issue(self, github_issue: BaseIssue) -> str:
-        jira_issue = copy.deepcopy(github_issue)
-        jira_issue.key = None
-        self._update_issue_fields(jira_issue, github_issue)
-        self._update_comments(jira_issue, github_issue)
-        return self._jira_connection.create_issue(jira_issue)
+        return self._jira_connection.create_issue(self.build_jira_issue(github_issue))
+
+    def build_jira_issue(self, github_issue: BaseIssue) -> BaseIssue:
+        with span("strategy.transform", github_issue=github_issue.key):
+            # only new objects for the fields that are changed, the rest is shared with the GitHub issue
+            jira_issue = BaseIssue(key=None,
+                                   project=github_issue.project,
+                                   title=github_issue.title,
+                                   description=BaseIssueField(None, github_issue.description.updated_at),
+                                   status=BaseIssueField(github_issue.status.value, github_issue.status.updated_at),
+                                   updated_at=github_issue.updated_at,
+                                   html_url=github_issue.html_url,
+                                   identity=github_issue.identity)
+            self._update_issue_fields(jira_issue, github_issue)
+            self._update_comments(jira_issue, github_issue)
+        return jira_issue
@@ -0,0 +1,240 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+_NOOP = nullcontext()
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        """
+        Duration in seconds
+        """
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(name=self.name, trace_id=self.trace_id, span_id=self.span_id, parent_id=self.parent_id,
+                    attributes=self.attributes, start_ns=self.start_ns, end_ns=self.end_ns, error=self.error)
+
+
+class SpanExporter:
+    """Base class for span exporters."""
+
+    def export(self, span: Span):
+        """
+        Called when a span ends.
+        """
+
+    def shutdown(self):
+        """
+        Flushes pending spans and releases resources.
+        """
+
+
+class JsonFileExporter(SpanExporter):
+    """Writes finished spans as JSON lines to a file."""
+
+    def __init__(self, file: str) -> None:
+        self._file = open(file, "a")
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+class OtlpHttpExporter(SpanExporter):
+    """Sends spans in batches to an OpenTelemetry collector using OTLP/HTTP with JSON encoding."""
+
+    def __init__(self, endpoint: str = "http://localhost:4318/v1/traces",
+                 service_name: str = "github-jira-sync",
+                 batch_size: int = 512) -> None:
+        self._endpoint = endpoint
+        self._service_name = service_name
+        self._batch_size = batch_size
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            if len(self._spans) < self._batch_size:
+                return
+            batch, self._spans = self._spans, []
+        self._send(batch)
+
+    def shutdown(self):
+        with self._lock:
+            batch, self._spans = self._spans, []
+        if batch:
+            self._send(batch)
+
+    def _send(self, spans: List[Span]):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self._service_name})},
+                "scopeSpans": [{"scope": {"name": "issues_sync"}, "spans": [_otlp_span(s) for s in spans]}],
+            }]
+        }
+        request = urllib.request.Request(self._endpoint, data=json.dumps(body).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=10):
+                pass
+        except OSError as e:
+            log.warning(f"Failed to export {len(spans)} spans to {self._endpoint}: {e}")
+
+
+class MultiExporter(SpanExporter):
+    """Passes spans on to several exporters."""
+
+    def __init__(self, exporters: List[SpanExporter]) -> None:
+        self._exporters = list(exporters)
+
+    def export(self, span: Span):
+        for exporter in self._exporters:
+            exporter.export(span)
+
+    def shutdown(self):
+        for exporter in self._exporters:
+            exporter.shutdown()
+
+
+class Tracer:
+
+    def __init__(self, exporter: SpanExporter) -> None:
+        self._exporter = exporter
+
+    def add_exporter(self, exporter: SpanExporter):
+        self._exporter = MultiExporter([self._exporter, exporter])
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            self._exporter.export(span)
+
+    def shutdown(self):
+        self._exporter.shutdown()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def configure(exporter: SpanExporter) -> Tracer:
+    """
+    Enables tracing. Until called all spans are no-ops.
+    """
+    global _tracer
+    _tracer = Tracer(exporter)
+    return _tracer
+
+
+def add_exporter(exporter: SpanExporter) -> Tracer:
+    """
+    Enables tracing with an exporter in addition to the one already configured (if any).
+    """
+    if _tracer is None:
+        return configure(exporter)
+    _tracer.add_exporter(exporter)
+    return _tracer
+
+
+def shutdown():
+    """
+    Flushes the exporter and disables tracing.
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.shutdown()
+        _tracer = None
+
+
+def span(name: str, **attributes):
+    """
+    Returns a context manager recording a span nested in the current one.
+    When tracing is not configured a shared no-op context manager is returned.
+    """
+    if _tracer is None:
+        return _NOOP
+    return _tracer.span(name, **attributes)
+
+
+def set_attribute(key: str, value: Any):
+    """
+    Sets an attribute on the current span if there is one.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def _otlp_span(span: Span) -> Dict[str, Any]:
+    result = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _otlp_attributes(span.attributes),
+    }
+    if span.parent_id:
+        result["parentSpanId"] = span.parent_id
+    if span.error:
+        result["status"] = {"code": 2, "message": span.error}
+    return result
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            encoded = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded = {"doubleValue": value}
+        else:
+            encoded = {"stringValue": str(value)}
+        result.append({"key": key, "value": encoded})
+    return result
@@ -1,7 +1,8 @@
 import datetime
 import typing
 
-from issues_sync.state import State
+from issues_sync.freshness import LagHistogram
+from issues_sync.state import State, FailedIssue, OutboxEntry
 
 
 class InMemoryState(State):
@@ -11,6 +12,15 @@ class InMemoryState(State):
         self._mapping_jira_to_github = {}
         self._mapping_status_message = {}
         self._last_sync_time = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+        self._last_synced_keys = []
+        self._last_jira_sync_time = None
+        self._failed_issues = {}
+        self._outbox = {}
+        self._rendered_markup = {}
+        self._attachments = {}
+        self._attachment_digests = {}
+        self._attachment_names = {}
+        self._lag_histogram = LagHistogram()
 
     def get_jira_issue(self, github_issue_no: str):
         return self._mapping_github_to_jira.get(str(github_issue_no), None)
@@ -27,6 +37,66 @@ class InMemoryState(State):
 
     def update_last_sync_time(self, sync_time: datetime.datetime):
         self._last_sync_time = sync_time
+        self._last_synced_keys = []
+
+    def get_last_synced_keys(self):
+        return self._last_synced_keys
+
+    def update_sync_cursor(self, sync_time: datetime.datetime, synced_keys):
+        self._last_sync_time = sync_time
+        self._last_synced_keys = list(synced_keys)
+
+    def get_last_jira_sync_time(self):
+        return self._last_jira_sync_time
+
+    def update_last_jira_sync_time(self, sync_time: datetime.datetime):
+        self._last_jira_sync_time = sync_time
+
+    def get_failed_issues(self):
+        return self._failed_issues
+
+    def update_failed_issue(self, failed_issue: FailedIssue):
+        self._failed_issues[failed_issue.github_issue_no] = failed_issue
+
+    def remove_failed_issue(self, github_issue_no):
+        self._failed_issues.pop(github_issue_no, None)
+
+    def get_outbox(self):
+        return self._outbox
+
+    def add_outbox_entry(self, entry: OutboxEntry):
+        self._outbox[entry.key] = entry
+
+    def remove_outbox_entry(self, key: str):
+        self._outbox.pop(key, None)
+
+    def get_rendered_markup(self, digest: str):
+        return self._rendered_markup.get(digest)
+
+    def update_rendered_markup(self, digest: str, rendered: str):
+        self._rendered_markup[digest] = rendered
+
+    def get_attachments(self, jira_issue_key: str):
+        return self._attachments.get(jira_issue_key, {})
+
+    def get_attachment_digest(self, url: str):
+        return self._attachment_digests.get(url)
+
+    def get_attachment_names(self, jira_issue_key: str):
+        return self._attachment_names.get(jira_issue_key, {})
+
+    def update_attachment(self, jira_issue_key: str, url: str, digest: str, attachment_id: str,
+                          name: typing.Optional[str] = None):
+        self._attachments.setdefault(jira_issue_key, {})[digest] = attachment_id
+        self._attachment_digests[url] = digest
+        if name is not None:
+            self._attachment_names.setdefault(jira_issue_key, {})[url] = name
+
+    def get_lag_histogram(self):
+        return self._lag_histogram
+
+    def update_lag_histogram(self, histogram: LagHistogram):
+        self._lag_histogram = histogram
 
     def update_mapping_status(self, github_issue_no, jira_issue_key, status_message):
         self._mapping_status_message[(github_issue_no, jira_issue_key)] = status_message
@@ -39,3 +109,12 @@ def apply_decorator(obj: typing.Any, method: typing.Callable, decorator):
     new_method = decorator(method)
     setattr(obj, method.__name__, new_method)
 
+
+
+def to_utc(time: datetime.datetime) -> datetime.datetime:
+    """
+    Returns the time as timezone aware UTC datetime. Naive datetimes are assumed to be in UTC.
+    """
+    if time.tzinfo is None:
+        return time.replace(tzinfo=datetime.timezone.utc)
+    return time.astimezone(datetime.timezone.utc)
@@ -0,0 +1,73 @@
+from unittest.mock import Mock
+
+from issues_sync.attachments import AttachmentMirror, find_attachment_urls
+from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueField
+from issues_sync.utils import InMemoryState
+
+IMAGE = "https://github.com/user-attachments/assets/0b6ef9c4-1b0a-4a8d-9e1c-3f0d8b7a2c11"
+FILE = "https://github.com/owner/repo/files/123/trace.log"
+COPY = "https://user-images.githubusercontent.com/1/copy.png"
+
+
+def _issue(description, *comments):
+    return BaseIssue(key="1", project="repo", title=BaseIssueField("Issue"), description=BaseIssueField(description),
+                     comments=[BaseIssueComment(c, "user") for c in comments])
+
+
+def test_find_attachment_urls():
+    issue = _issue(f"see ![screenshot]({IMAGE}) and https://github.com/owner/repo/issues/2",
+                   f"<img src=\"{IMAGE}\">", f"[trace.log]({FILE})")
+
+    assert find_attachment_urls(issue) == [IMAGE, FILE]
+    assert find_attachment_urls(_issue(None)) == []
+
+
+def _mirror(state, contents):
+    github = Mock()
+    github.download.side_effect = lambda url, chunk_size: ("image/png", iter([contents[url][:2], contents[url][2:]]))
+    jira = Mock()
+    uploads = []
+
+    def add_attachment(issue_key, file, filename):
+        # the file is streamed from a spooled temporary file
+        uploads.append((issue_key, filename, file.read()))
+        return f"{len(uploads)}"
+
+    jira.add_attachment.side_effect = add_attachment
+    return AttachmentMirror(github, jira, state, workers=2), github, uploads
+
+
+def test_attachments_are_uploaded_once_per_content():
+    state = InMemoryState()
+    contents = {IMAGE: b"png-bytes", FILE: b"log", COPY: b"png-bytes"}
+    mirror, github, uploads = _mirror(state, contents)
+
+    mirror.submit("JIRA-1", _issue(f"![a]({IMAGE})", f"[log]({FILE}) ![b]({COPY})"))
+    mirror.close()
+
+    assert sorted(uploads) == [("JIRA-1", "0b6ef9c4-1b0a-4a8d-9e1c-3f0d8b7a2c11.png", b"png-bytes"),
+                               ("JIRA-1", "trace.log", b"log")]
+    assert len(state.get_attachments("JIRA-1")) == 2
+    # the copy points at the attachment uploaded for the equal file
+    names = state.get_attachment_names("JIRA-1")
+    assert names[COPY] == names[IMAGE] == "0b6ef9c4-1b0a-4a8d-9e1c-3f0d8b7a2c11.png"
+    mirror._jira.link_attachments.assert_called_once_with("JIRA-1", names)
+
+    # a re-sync neither downloads nor uploads again
+    mirror, github, uploads = _mirror(state, contents)
+    mirror.submit("JIRA-1", _issue(f"![a]({IMAGE})", f"[log]({FILE}) ![b]({COPY})"))
+    mirror.close()
+
+    github.download.assert_not_called()
+    assert uploads == []
+
+
+def test_failed_attachment_is_mirrored_again():
+    state = InMemoryState()
+    mirror, github, uploads = _mirror(state, {IMAGE: b"png-bytes"})
+    github.download.side_effect = Exception("not found")
+
+    mirror.submit("JIRA-1", _issue(f"![a]({IMAGE})"))
+    mirror.close()
+
+    assert state.get_attachment_digest(IMAGE) is None
@@ -0,0 +1,119 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from issues_sync.cassette import CassetteMiss, recording, replaying
+from issues_sync.file_state import outbox_file
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._send({"path": self.path})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self._send({"posted": body.decode("utf-8")})
+
+    def _send(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Set-Cookie", "session=secret")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_record_redacts_credentials(server, tmp_path):
+    file = str(tmp_path / "run.cassette.gz")
+    state_file = tmp_path / "state.json"
+    state_file.write_text('{"last_sync_time": "2024-01-01T00:00:00"}')
+
+    with recording(file, str(state_file)):
+        response = requests.get(f"{server}/issues?access_token=abc&page=2", headers={"Authorization": "token abc"})
+
+    assert response.json() == {"path": "/issues?access_token=abc&page=2"}
+    with gzip.open(file, "rt") as f:
+        header, interaction = [json.loads(line) for line in f]
+    assert header["state"] == '{"last_sync_time": "2024-01-01T00:00:00"}'
+    assert interaction["url"].endswith("/issues?access_token=REDACTED&page=2")
+    assert interaction["request_headers"]["Authorization"] == "REDACTED"
+    assert interaction["response_headers"]["Set-Cookie"] == "REDACTED"
+    assert "abc" not in json.dumps(interaction["request_headers"])
+
+
+def test_record_redacts_signed_urls(server, tmp_path):
+    # an attachment download redirected to a pre-signed S3 URL
+    file = str(tmp_path / "run.cassette.gz")
+    query = "X-Amz-Credential=AKIA&X-Amz-Signature=abc&X-Amz-Security-Token=def&jwt=ghi&response-content-type=image"
+
+    with recording(file):
+        requests.get(f"{server}/file.png?{query}")
+
+    with gzip.open(file, "rt") as f:
+        header, interaction = [json.loads(line) for line in f]
+    assert interaction["url"].endswith("/file.png?X-Amz-Credential=REDACTED&X-Amz-Signature=REDACTED"
+                                       "&X-Amz-Security-Token=REDACTED&jwt=REDACTED&response-content-type=image")
+
+
+def test_replay_serves_recorded_responses_offline(server, tmp_path):
+    file = str(tmp_path / "run.cassette.gz")
+    with recording(file):
+        requests.post(f"{server}/issue", data="first")
+        requests.post(f"{server}/issue", data="second")
+        requests.get(f"{server}/search?jql=updated%20%3E%3D%20-5m")
+
+    with replaying(file, timing_scale=0) as cassette:
+        # matched by body, then by URL, then by path (the time window of the search moved)
+        assert requests.post("http://other-host/issue", data="second").json() == {"posted": "second"}
+        assert requests.post("http://other-host/issue", data="changed").json() == {"posted": "first"}
+        assert requests.get("http://other-host/search?jql=updated%20%3E%3D%20-7m").json() == \
+               {"path": "/search?jql=updated%20%3E%3D%20-5m"}
+        with pytest.raises(CassetteMiss):
+            requests.get("http://other-host/search")
+    assert cassette.misses == 1
+    assert cassette.unused == 0
+
+
+def test_replay_reproduces_connection_errors(tmp_path):
+    file = str(tmp_path / "run.cassette.gz")
+    with recording(file):
+        with pytest.raises(requests.ConnectionError):
+            requests.get("http://127.0.0.1:1/down")
+
+    with replaying(file, timing_scale=0):
+        with pytest.raises(requests.ConnectionError):
+            requests.get("http://127.0.0.1:1/down")
+
+
+def test_replay_restores_recorded_state(server, tmp_path):
+    file = str(tmp_path / "run.cassette.gz")
+    state_file = tmp_path / "state.json"
+    state_file.write_text("{}")
+    # an outbox entry of a run that died
+    outbox_file(state_file).write_text('{"key": "gh-repo-1"}\n')
+    with recording(file, str(state_file)):
+        requests.get(server)
+    state_file.write_text('{"changed": true}')
+
+    with replaying(file, timing_scale=0) as cassette:
+        restored = cassette.restore_state(str(tmp_path / "replay"))
+
+    assert open(restored).read() == "{}"
+    assert outbox_file(restored).read_text() == '{"key": "gh-repo-1"}\n'
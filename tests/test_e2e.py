@@ -23,9 +23,17 @@ def _create_or_update_comment(issue: github.Issue.Issue, comment_index: int, com
         issue.create_comment(comment_text)
 
 
+class _Page:
+    def __init__(self, issues):
+        self._issues = issues
+
+    def get_page(self, page):
+        return self._issues if page == 0 else []
+
+
 def decorate_get_issues(issues_to_return):
     def wrapper(*args, **kwargs):
-        return issues_to_return
+        return _Page(issues_to_return)
 
     return wrapper
 
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+
+from issues_sync.file_state import CURSOR_SAVE_INTERVAL, InFileState, outbox_file
+from issues_sync.state import FailedIssue, OutboxEntry
+
+
+def test_state_is_persisted(tmp_path):
+    file = str(tmp_path / "state.json")
+    state = InFileState(file)
+    state.update("1", "JIRA-1")
+    state.update_sync_cursor(datetime(2023, 1, 1), ["1", "2"])
+    state.flush()
+
+    state = InFileState(file)
+
+    assert state.get_jira_issue("1") == "JIRA-1"
+    assert state.get_github_issue("JIRA-1") == "1"
+    assert state.get_last_sync_time() == datetime(2023, 1, 1)
+    assert state.get_last_synced_keys() == ["1", "2"]
+
+
+def test_update_last_sync_time_resets_synced_keys(tmp_path):
+    state = InFileState(str(tmp_path / "state.json"))
+    state.update_sync_cursor(datetime(2023, 1, 1), ["1"])
+
+    state.update_last_sync_time(datetime(2023, 1, 2))
+
+    assert state.get_last_synced_keys() == []
+
+
+def test_failed_issues_are_persisted(tmp_path):
+    file = str(tmp_path / "state.json")
+    state = InFileState(file)
+    state.update_failed_issue(FailedIssue("1", "Exception: error", 2, datetime(2023, 1, 1)))
+    state.update_failed_issue(FailedIssue("2", "Exception: error", 1, datetime(2023, 1, 1)))
+    state.remove_failed_issue("2")
+
+    state = InFileState(file)
+
+    assert state.get_failed_issues() == {"1": FailedIssue("1", "Exception: error", 2, datetime(2023, 1, 1))}
+
+
+def test_last_jira_sync_time_is_persisted(tmp_path):
+    file = str(tmp_path / "state" / "state.json")
+    state = InFileState(file)
+    assert state.get_last_jira_sync_time() is None
+
+    state.update_last_jira_sync_time(datetime(2023, 1, 1))
+
+    assert InFileState(file).get_last_jira_sync_time() == datetime(2023, 1, 1)
+
+
+def test_outbox_is_persisted(tmp_path):
+    file = str(tmp_path / "state.json")
+    state = InFileState(file)
+    state.add_outbox_entry(OutboxEntry("gh-repo-1", "create", "1", None, datetime(2023, 1, 1)))
+    state.add_outbox_entry(OutboxEntry("update-JIRA-2", "update", "2", "JIRA-2", datetime(2023, 1, 1)))
+    state.remove_outbox_entry("gh-repo-1")
+
+    assert InFileState(file).get_outbox() == {
+        "update-JIRA-2": OutboxEntry("update-JIRA-2", "update", "2", "JIRA-2", datetime(2023, 1, 1))}
+
+
+def test_outbox_is_appended_to_a_log_and_compacted(tmp_path):
+    file = tmp_path / "state.json"
+    state = InFileState(str(file))
+    state.update("3", "JIRA-3")
+    written = file.read_text()
+
+    state.add_outbox_entry(OutboxEntry("gh-repo-1", "create", "1", None, datetime(2023, 1, 1)))
+    state.remove_outbox_entry("gh-repo-1")
+    state.add_outbox_entry(OutboxEntry("update-JIRA-2", "update", "2", "JIRA-2", datetime(2023, 1, 1)))
+
+    # the state file is not rewritten for the outbox
+    assert file.read_text() == written
+    assert len(outbox_file(file).read_text().splitlines()) == 3
+    # a line the process did not finish writing is skipped
+    with outbox_file(file).open("a") as f:
+        f.write('{"key": "gh-repo-4", "act')
+    state = InFileState(str(file))
+    assert list(state.get_outbox()) == ["update-JIRA-2"]
+    state.add_outbox_entry(OutboxEntry("gh-repo-5", "create", "5", None, datetime(2023, 1, 1)))
+    assert list(InFileState(str(file)).get_outbox()) == ["update-JIRA-2", "gh-repo-5"]
+
+    # the next write of the state takes over the outbox and empties the log
+    state.update("4", "JIRA-4")
+    assert outbox_file(file).read_text() == ""
+    assert list(InFileState(str(file)).get_outbox()) == ["update-JIRA-2", "gh-repo-5"]
+
+
+def test_rendered_markup_is_persisted_on_flush(tmp_path):
+    file = str(tmp_path / "state.json")
+    state = InFileState(file)
+    state.update_rendered_markup("digest", "*a*")
+    assert InFileState(file).get_rendered_markup("digest") is None
+
+    state.flush()
+
+    assert InFileState(file).get_rendered_markup("digest") == "*a*"
+    assert (tmp_path / "state.markup.json").exists()
+
+
+def test_sync_cursor_is_written_every_interval(tmp_path):
+    file = tmp_path / "state.json"
+    state = InFileState(str(file))
+    state.update("1", "JIRA-1")
+
+    for key in range(1, CURSOR_SAVE_INTERVAL):
+        state.update_sync_cursor(datetime(2023, 1, 1) + timedelta(seconds=key), [str(key)])
+    assert InFileState(str(file)).get_last_synced_keys() == []
+
+    state.update_sync_cursor(datetime(2023, 1, 2), ["100"])
+    assert InFileState(str(file)).get_last_sync_time() == datetime(2023, 1, 2)
+
+    # replaced as a whole, without a temporary file left next to it
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
@@ -0,0 +1,61 @@
+from unittest.mock import Mock
+
+from issues_sync.finder import Finder
+from issues_sync.issue import BaseIssue, BaseIssueField, github_label
+from issues_sync.utils import InMemoryState
+
+
+def _github_issue(key, identity=None):
+    return BaseIssue(key=key, project="repo", title=BaseIssueField(f"Issue {key}"), description=BaseIssueField(""),
+                     identity=identity)
+
+
+def test_github_label():
+    assert github_label("my-repo", "42") == "gh-my-repo-42"
+    assert github_label("org/my repo", "42") == "gh-org-my-repo-42"
+
+
+def test_find_jira_issue_key_by_label_before_title():
+    jira_connection = Mock()
+    jira_connection.find_issue_keys_by_labels.return_value = {"gh-repo-1": "JIRA-1"}
+    state = InMemoryState()
+
+    assert Finder(jira_connection, state).find_jira_issue_key("1", "Issue 1", "gh-repo-1") == "JIRA-1"
+    assert state.get_jira_issue("1") == "JIRA-1"
+    jira_connection.find_issue_id_by_title.assert_not_called()
+
+
+def test_find_jira_issue_keys_in_batch():
+    jira_connection = Mock()
+    jira_connection.find_issue_keys_by_labels.return_value = {"gh-repo-2": "JIRA-2"}
+    jira_connection.find_issue_id_by_title.side_effect = lambda title: "JIRA-3" if title == "Issue 3" else None
+    state = InMemoryState()
+    state.update("1", "JIRA-1")
+    issues = [_github_issue("1", "gh-repo-1"), _github_issue("2", "gh-repo-2"), _github_issue("3", "gh-repo-3"),
+              _github_issue("4", "gh-repo-4")]
+
+    mapping = Finder(jira_connection, state).find_jira_issue_keys(issues)
+
+    assert mapping == {"1": "JIRA-1", "2": "JIRA-2", "3": "JIRA-3", "4": None}
+    # one label search for all unmapped issues, title search only for the ones without a label
+    jira_connection.find_issue_keys_by_labels.assert_called_once_with(["gh-repo-2", "gh-repo-3", "gh-repo-4"])
+    assert jira_connection.find_issue_id_by_title.call_count == 2
+    assert state.get_jira_issue("3") == "JIRA-3"
+
+
+def test_prefetched_labels_are_not_searched_again():
+    jira_connection = Mock()
+    jira_connection.find_issue_keys_by_labels.return_value = {"gh-repo-2": "JIRA-2"}
+    jira_connection.find_issue_id_by_title.return_value = None
+    state = InMemoryState()
+    state.update("1", "JIRA-1")
+    finder = Finder(jira_connection, state)
+
+    finder.prefetch({"1": "gh-repo-1", "2": "gh-repo-2", "3": "gh-repo-3"})
+
+    jira_connection.find_issue_keys_by_labels.assert_called_once_with(["gh-repo-2", "gh-repo-3"])
+    assert finder.find_jira_issue_key("2", "Issue 2", "gh-repo-2") == "JIRA-2"
+    # the label was not found, so only the title is searched
+    assert finder.find_jira_issue_key("3", "Issue 3", "gh-repo-3") is None
+    jira_connection.find_issue_keys_by_labels.assert_called_once()
+    jira_connection.find_issue_id_by_title.assert_called_once_with("Issue 3")
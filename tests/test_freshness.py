@@ -0,0 +1,40 @@
+from issues_sync.file_state import InFileState
+from issues_sync.freshness import LagHistogram, percentile
+
+
+def test_percentile_by_nearest_rank():
+    lags = [5.0, 1.0, 3.0, 2.0, 4.0]
+
+    assert percentile(lags, 0.5) == 3.0
+    assert percentile(lags, 0.95) == 5.0
+    assert percentile(lags, 1.0) == 5.0
+    assert percentile([], 0.5) is None
+
+
+def test_lag_histogram_rolls_over_runs():
+    histogram = LagHistogram(buckets=(60.0, 300.0, 3600.0), window=2)
+    histogram.add_run([10.0, 20.0, 7200.0])
+    histogram.add_run([100.0])
+
+    assert histogram.counts == [2, 1, 0, 1]
+    assert histogram.percentile(0.5) == 60.0
+    assert histogram.percentile(0.95) == 7200.0
+    assert histogram.max == 7200.0
+
+    # the first run drops out
+    histogram.add_run([30.0, 200.0])
+    assert histogram.counts == [1, 2, 0, 0]
+    assert histogram.percentile(1.0) == 200.0
+
+
+def test_lag_histogram_is_kept_in_state_file(tmp_path):
+    file = str(tmp_path / "mapping.state.json")
+    state = InFileState(file)
+    histogram = state.get_lag_histogram()
+    histogram.add_run([42.0, 4200.0])
+    state.update_lag_histogram(histogram)
+
+    restored = InFileState(file).get_lag_histogram()
+
+    assert restored == histogram
+    assert restored.percentile(0.5) == 60.0
@@ -6,7 +6,7 @@ from github.Issue import Issue
 from github.IssueComment import IssueComment
 
 from issues_sync.config import Config
-from issues_sync.github_connection import GithubConnection, convert_to_base_issue
+from issues_sync.github_connection import GithubConnection, api_url, convert_to_base_issue
 from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueStatus
 
 
@@ -20,6 +20,11 @@ def mock_github_issue():
     issue.updated_at = datetime.now()
     issue.body = "This is a test issue"
     issue.state = "open"
+    issue.labels = [MagicMock(), MagicMock()]
+    issue.labels[0].name = "bug"
+    issue.labels[1].name = "ui"
+    issue.assignees = [MagicMock(login="octocat")]
+    issue.milestone.title = "1.0"
     comment = MagicMock(spec=IssueComment)
     comment.body = "Test comment"
     comment.updated_at = datetime.now()
@@ -33,11 +38,18 @@ def mock_github_issue():
 @pytest.fixture
 def github_connection(mock_github_issue):
     with patch('github.Github'):
-        config = MagicMock(spec=Config, project="test_project", token="test_token")
+        config = MagicMock(spec=Config, url="https://github.com", project="test_project", token="test_token")
         connection = GithubConnection(config)
         yield connection
 
 
+def test_api_url():
+    assert api_url("https://github.com") == "https://api.github.com"
+    assert api_url(None) == "https://api.github.com"
+    assert api_url("https://github.example.com/") == "https://github.example.com/api/v3"
+    assert api_url("http://localhost:8080/api/v3") == "http://localhost:8080/api/v3"
+
+
 def test_convert_to_base_issue(mock_github_issue):
     base_issue = convert_to_base_issue(mock_github_issue)
     assert isinstance(base_issue, BaseIssue)
@@ -55,6 +67,9 @@ def test_convert_to_base_issue(mock_github_issue):
     assert base_issue.status.value == BaseIssueStatus.OPEN
     assert base_issue.status.updated_at == mock_github_issue.updated_at
     assert base_issue.updated_at == mock_github_issue.updated_at
+    assert base_issue.labels == ["bug", "ui"]
+    assert base_issue.assignees == ["octocat"]
+    assert base_issue.milestone == "1.0"
 
 
 def test_find_issue_id_by_title(github_connection, mock_github_issue):
@@ -72,10 +87,113 @@ def test_find_issue_id_by_title_no_match(github_connection):
 
 
 def test_get_issues(github_connection, mock_github_issue):
-    github_connection._repo.get_issues.return_value = [mock_github_issue]
+    github_connection._repo.get_issues.return_value.get_page.return_value = [mock_github_issue]
     since_time = datetime.now()
-    issues = github_connection.get_issues(since_time)
+    issues = list(github_connection.get_issues(since_time))
     assert len(issues) == 1
     assert isinstance(issues[0], BaseIssue)
     assert issues[0].key == str(mock_github_issue.number)
+    github_connection._repo.get_issues.assert_called_once_with(since=since_time, state="all",
+                                                               sort="updated", direction="asc")
+
+
+def _mock_issues(updated_at_list, start_number=1):
+    issues = []
+    for number, updated_at in enumerate(updated_at_list, start=start_number):
+        issue = MagicMock(spec=Issue, number=number, updated_at=updated_at, pull_request=None)
+        issue.repository.name = "test_repo"
+        issue.state = "open"
+        issue.get_comments.return_value = []
+        issues.append(issue)
+    return issues
+
+
+def test_get_issues_pages_by_update_time(github_connection):
+    with patch("issues_sync.github_connection.PER_PAGE", 2):
+        first_page = _mock_issues([datetime(2023, 1, 1), datetime(2023, 1, 2)])
+        # issue 2 is returned again as it was updated at the new since time
+        second_page = [first_page[1]] + _mock_issues([datetime(2023, 1, 3)], start_number=3)
+        third_page = []
+        github_connection._repo.get_issues.return_value.get_page.side_effect = [first_page, second_page, third_page]
+
+        issues = list(github_connection.get_issues(datetime(2022, 1, 1)))
+
+    assert [i.key for i in issues] == ["1", "2", "3"]
+    since_values = [c[1]["since"] for c in github_connection._repo.get_issues.call_args_list]
+    assert since_values == [datetime(2022, 1, 1), datetime(2023, 1, 2), datetime(2023, 1, 3)]
+
+
+def test_get_issues_pages_by_number_when_page_has_same_update_time(github_connection):
+    with patch("issues_sync.github_connection.PER_PAGE", 2):
+        same_time = datetime(2023, 1, 1)
+        first_page = _mock_issues([same_time, same_time])
+        second_page = _mock_issues([same_time], start_number=3)
+        github_connection._repo.get_issues.return_value.get_page.side_effect = [first_page, second_page]
+
+        issues = list(github_connection.get_issues(same_time))
+
+    assert [i.key for i in issues] == ["1", "2", "3"]
+    pages = [c[0][0] for c in github_connection._repo.get_issues.return_value.get_page.call_args_list]
+    assert pages == [0, 1]
+
+
+def test_get_issues_reports_identity_labels_per_page(github_connection):
+    with patch("issues_sync.github_connection.PER_PAGE", 2):
+        first_page = _mock_issues([datetime(2023, 1, 1), datetime(2023, 1, 2)])
+        second_page = _mock_issues([datetime(2023, 1, 3)], start_number=3)
+        github_connection._repo.get_issues.return_value.get_page.side_effect = [first_page, second_page]
+        pages = []
+
+        issues = github_connection.get_issues(datetime(2022, 1, 1), on_page=pages.append)
+        next(issues)
+        # the labels of a page are reported before its first issue
+        assert pages == [{"1": "gh-test_repo-1", "2": "gh-test_repo-2"}]
+        list(issues)
+
+    assert pages[1] == {"3": "gh-test_repo-3"}
+
+
+def test_get_issues_reads_comment_threads_only_when_needed(github_connection):
+    issues = _mock_issues([datetime(2023, 1, 1), datetime(2023, 1, 2), datetime(2023, 1, 3)])
+    github_connection._repo.get_issues.return_value.get_page.return_value = issues
+    changed_comment = MagicMock(spec=IssueComment, updated_at=datetime(2023, 1, 2),
+                                issue_url="https://api.github.com/repos/o/test_repo/issues/2")
+    github_connection._repo.get_issues_comments.return_value = [changed_comment]
+
+    # issue 1 is mapped without comment changes, 2 has a changed comment and 3 is not mapped yet
+    result = list(github_connection.get_issues(datetime(2022, 1, 1), is_mapped=lambda key: key in ("1", "2")))
+
+    assert [i.comments for i in result] == [None, [], []]
+    issues[0].get_comments.assert_not_called()
+    issues[1].get_comments.assert_called_once()
+    issues[2].get_comments.assert_called_once()
+    github_connection._repo.get_issues_comments.assert_called_once_with(sort="updated", direction="asc",
+                                                                        since=datetime(2022, 1, 1))
+
+
+def test_convert_to_base_issue_without_comments(mock_github_issue):
+    mock_github_issue.comments = 0
+    assert convert_to_base_issue(mock_github_issue).comments == []
+    assert convert_to_base_issue(mock_github_issue, with_comments=False).comments is None
+    mock_github_issue.get_comments.assert_not_called()
+
+
+def test_update_issue_status(github_connection, mock_github_issue):
+    github_connection._repo.get_issue.return_value = mock_github_issue
+
+    assert not github_connection.update_issue_status("1234", BaseIssueStatus.OPEN)
+    assert github_connection.update_issue_status("1234", BaseIssueStatus.CLOSED)
+
+    mock_github_issue.edit.assert_called_once_with(state="closed")
+
+
+def test_download_streams_content(github_connection):
+    response = MagicMock(headers={"Content-Type": "image/png"})
+    response.iter_content.return_value = iter([b"ab", b"c"])
+    with patch.object(github_connection._download_session, "get", return_value=response) as get:
+        content_type, chunks = github_connection.download("https://github.com/user-attachments/assets/1", 2)
 
+        assert content_type == "image/png"
+        assert list(chunks) == [b"ab", b"c"]
+        get.assert_called_once_with("https://github.com/user-attachments/assets/1", stream=True, timeout=60)
+        response.iter_content.assert_called_once_with(2)
@@ -0,0 +1,85 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from issues_sync.github_export import GithubExport, iter_json_objects
+from issues_sync.issue import BaseIssueStatus
+
+
+def _issue(number, **kwargs):
+    issue = {"number": number, "title": f"Issue {number}", "body": f"Body {number}", "state": "open",
+             "created_at": "2020-01-01T00:00:00Z", "updated_at": f"2020-01-0{number}T00:00:00Z", "closed_at": None,
+             "html_url": f"https://github.com/owner/repo/issues/{number}",
+             "repository_url": "https://api.github.com/repos/owner/repo",
+             "labels": [{"name": "bug"}], "assignees": [{"login": "octocat"}], "milestone": {"title": "v1"},
+             "comments": 0}
+    issue.update(kwargs)
+    return issue
+
+
+def test_iter_json_objects_streams_arrays_and_json_lines(tmp_path):
+    # concatenated arrays, as written by gh api --paginate, with objects spanning several chunks
+    arrays = tmp_path / "issues.json"
+    arrays.write_text(json.dumps([_issue(1), _issue(2)], indent=2) + json.dumps([_issue(3)]))
+    lines = tmp_path / "issues.ndjson.gz"
+    with gzip.open(lines, "wt") as f:
+        f.write("\n".join(json.dumps(_issue(n)) for n in (1, 2, 3)) + "\n")
+
+    assert [o["number"] for o in iter_json_objects(str(arrays), chunk_size=16)] == [1, 2, 3]
+    assert [o["number"] for o in iter_json_objects(str(lines), chunk_size=16)] == [1, 2, 3]
+
+
+def test_iter_json_objects_rejects_truncated_file(tmp_path):
+    file = tmp_path / "issues.json"
+    file.write_text(json.dumps([_issue(1), _issue(2)])[:-40])
+
+    with pytest.raises(ValueError):
+        list(iter_json_objects(str(file), chunk_size=16))
+
+
+def test_export_converts_issues_with_comments(tmp_path):
+    issues = tmp_path / "issues.json"
+    issues.write_text(json.dumps([
+        _issue(1, state="closed", closed_at="2020-01-05T00:00:00Z"),
+        _issue(2, pull_request={"url": "https://api.github.com/repos/owner/repo/pulls/2"}),
+        _issue(3),
+    ]))
+    comments = tmp_path / "comments.ndjson"
+    comments.write_text("\n".join(json.dumps(c) for c in [
+        {"issue_url": "https://api.github.com/repos/owner/repo/issues/1", "body": "second", "user": {"login": "b"},
+         "created_at": "2020-01-03T00:00:00Z", "updated_at": "2020-01-03T00:00:00Z"},
+        {"issue_url": "https://api.github.com/repos/owner/repo/issues/1", "body": "first", "user": {"login": "a"},
+         "created_at": "2020-01-02T00:00:00Z", "updated_at": "2020-01-02T00:00:00Z"},
+    ]))
+
+    issues = list(GithubExport([str(issues)], [str(comments)]).issues())
+
+    assert [i.key for i in issues] == ["1", "3"]
+    closed = issues[0]
+    assert closed.identity == "gh-repo-1"
+    assert closed.status.value == BaseIssueStatus.CLOSED
+    assert closed.status.updated_at == datetime(2020, 1, 5, tzinfo=timezone.utc)
+    assert [(c.user.value, c.body.value) for c in closed.comments] == [("a", "first"), ("b", "second")]
+    assert closed.labels == ["bug"] and closed.assignees == ["octocat"] and closed.milestone == "v1"
+    assert issues[1].comments == []
+
+
+def test_export_reads_migration_archive(tmp_path):
+    issues = tmp_path / "issues_000001.json"
+    issues.write_text(json.dumps([{
+        "type": "issue", "url": "https://github.com/owner/repo/issues/7", "repository": "https://github.com/owner/repo",
+        "user": "https://github.com/octocat", "title": "Old issue", "body": "Text", "labels": [
+            "https://github.com/owner/repo/labels/good%20first%20issue"], "assignee": None, "milestone": None,
+        "created_at": "2012-01-01T00:00:00Z", "closed_at": "2012-02-01T00:00:00Z"}]))
+
+    issue, = GithubExport([str(issues)], project="other").issues()
+
+    assert issue.key == "7"
+    assert issue.identity == "gh-repo-7"
+    assert issue.labels == ["good first issue"]
+    assert issue.status.value == BaseIssueStatus.CLOSED
+    assert issue.updated_at == datetime(2012, 2, 1, tzinfo=timezone.utc)
+    # comments were not exported, so they are left as they are
+    assert issue.comments is None
@@ -1,8 +1,14 @@
+import json
+from datetime import datetime
+
 import pytest
 from unittest.mock import Mock, patch
 
+from jira import JIRAError
+
 from issues_sync.config import JiraConfig
 from issues_sync.jira_connection import JiraConnection
+from issues_sync.metrics import Metrics
 from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueField, BaseIssueStatus
 
 
@@ -12,6 +18,7 @@ def jira_connection():
 
     with patch('issues_sync.jira_connection.JIRA'):
         jira_conn = JiraConnection(config)
+        jira_conn._jira._get_url.side_effect = lambda path: f"http://test.com/rest/api/2/{path}"
         yield jira_conn
 
 
@@ -53,9 +60,20 @@ def _mock_issue():
     # name is not set in the mock as it is argument of Mock constructor
     mock_issue.fields.project.name = "Test Project"
     mock_issue.fields.status.name = "New"
+    mock_issue.fields.labels = []
+    mock_issue.fields.assignee = None
+    mock_issue.fields.fixVersions = []
     return mock_issue
 
 
+def _edits(jira_connection):
+    """
+    Returns the PUT requests of the connection as (path, data).
+    """
+    return [(c[0][0].replace("http://test.com/rest/api/2/", ""), json.loads(c[1]["data"]))
+            for c in jira_connection._jira._session.put.call_args_list]
+
+
 def test_create_issue(jira_connection):
     with patch.object(jira_connection._jira, 'create_issue') as mock_create_issue:
         mock_create_issue.return_value = Mock(key="TEST-123")
@@ -89,9 +107,260 @@ def test_update_issue(jira_connection):
                                status=BaseIssueField(BaseIssueStatus.CLOSED))
         jira_connection.update_issue(base_issue)
 
-        assert mock_issue.return_value.update.call_count == 1
-        assert mock_issue.return_value.update.call_args[1]['fields']['summary'] == "Test Issue Title Updated"
-        assert mock_issue.return_value.update.call_args[1]['fields']['description'] == "Test description updated"
+        # without the current issue it is read first
+        mock_issue.assert_called_once_with("")
+        assert _edits(jira_connection) == [("issue/", {"fields": {"summary": "Test Issue Title Updated",
+                                                                   "description": "Test description updated"}})]
 
         assert jira_connection._jira.transition_issue.call_count == 1
+        assert jira_connection._jira.transition_issue.call_args[0] == ("", "Done")
+
+
+def test_update_issue_does_not_read_the_current_issue_again(jira_connection):
+    current = jira_connection._convert_to_base_issue(_mock_issue())
+    issue = BaseIssue(key="TEST-123", project="Test Project", title=BaseIssueField("Updated"),
+                      description=BaseIssueField("Test description"), status=BaseIssueField(BaseIssueStatus.OPEN))
+
+    jira_connection.update_issue(issue, current)
+
+    jira_connection._jira.issue.assert_not_called()
+    assert _edits(jira_connection) == [("issue/TEST-123", {"fields": {"summary": "Updated"}})]
+    jira_connection._jira.transition_issue.assert_not_called()
+
+
+def test_get_issues(jira_connection):
+    with patch.object(jira_connection._jira, 'search_issues') as mock_search_issues:
+        mock_search_issues.return_value = [_mock_issue()]
+
+        issues = jira_connection.get_issues(["TEST-123", "TEST-124", "TEST-125"], batch_size=2)
+
+        assert [i.key for i in issues] == ["TEST-123", "TEST-123"]
+        assert mock_search_issues.call_count == 2
+        assert mock_search_issues.call_args_list[0][0][0] == "key in (TEST-123, TEST-124)"
+        assert mock_search_issues.call_args_list[1][0][0] == "key in (TEST-125)"
+
+
+def test_create_issue_stamps_identity_label(jira_connection):
+    with patch.object(jira_connection._jira, 'create_issue') as mock_create_issue:
+        mock_create_issue.return_value = Mock(key="TEST-123")
+
+        jira_connection.create_issue(BaseIssue(key=None, project="Test Project", title=BaseIssueField("Test Issue"),
+                                                description=BaseIssueField(""), identity="gh-repo-42"))
+
+        assert mock_create_issue.call_args[1]['fields']['labels'] == ["gh-repo-42"]
+
+
+def test_create_issue_adds_comments_and_closes(jira_connection):
+    with patch.object(jira_connection._jira, 'create_issue') as mock_create_issue:
+        mock_create_issue.return_value = Mock(key="TEST-123")
+
+        jira_connection.create_issue(BaseIssue(key=None, project="Test Project", title=BaseIssueField("Test Issue"),
+                                                description=BaseIssueField(""),
+                                                status=BaseIssueField(BaseIssueStatus.CLOSED),
+                                                comments=[BaseIssueComment("First", "user"),
+                                                          BaseIssueComment("Second", "user")]))
+
+        assert [c[0] for c in jira_connection._jira.add_comment.call_args_list] == [("TEST-123", "First"),
+                                                                                   ("TEST-123", "Second")]
+        jira_connection._jira.transition_issue.assert_called_once_with("TEST-123", "Done")
+
+
+def test_create_issue_is_not_repeated_after_lost_response(jira_connection):
+    # Jira made the issue and its first comment, but the responses were lost
+    jira_connection._jira.create_issue.side_effect = JIRAError(status_code=502)
+    jira_connection._jira.search_issues.return_value = [Mock(key="TEST-123", fields=Mock(labels=["gh-repo-42"]))]
+    jira_connection._jira.add_comment.side_effect = [JIRAError(status_code=502), None]
+    jira_connection._jira.comments.return_value = [Mock()]
+
+    with patch("tenacity.nap.time.sleep"):
+        issue_key = jira_connection.create_issue(
+            BaseIssue(key=None, project="Test Project", title=BaseIssueField("Test Issue"),
+                      description=BaseIssueField(""), identity="gh-repo-42",
+                      comments=[BaseIssueComment("First", "user"), BaseIssueComment("Second", "user")]))
+
+    assert issue_key == "TEST-123"
+    assert jira_connection._jira.create_issue.call_count == 1
+    assert [c[0] for c in jira_connection._jira.add_comment.call_args_list] == [("TEST-123", "First"),
+                                                                               ("TEST-123", "Second")]
+
+
+def test_update_issue_retries_writes_on_their_own(jira_connection):
+    current = BaseIssue(key="TEST-123", project="Test Project", title=BaseIssueField("Test Issue"),
+                        description=BaseIssueField(""), status=BaseIssueField(BaseIssueStatus.OPEN), comments=[])
+    issue = BaseIssue(key="TEST-123", project="Test Project", title=BaseIssueField("New title"),
+                      description=BaseIssueField(""), status=BaseIssueField(BaseIssueStatus.OPEN),
+                      comments=[BaseIssueComment("a", "user"), BaseIssueComment("b", "user")])
+    # Jira added the second comment, but the response was lost
+    jira_connection._jira.add_comment.side_effect = [None, JIRAError(status_code=502)]
+    jira_connection._jira.comments.return_value = [Mock(), Mock()]
+
+    with patch("tenacity.nap.time.sleep"):
+        jira_connection.update_issue(issue, current)
+
+    assert [c[0][1] for c in jira_connection._jira.add_comment.call_args_list] == ["a", "b"]
+    assert _edits(jira_connection) == [("issue/TEST-123", {"fields": {"summary": "New title"}})]
+
+
+def test_update_issue_adds_missing_identity_label(jira_connection):
+    with patch.object(jira_connection._jira, 'issue') as mock_issue:
+        mock_issue.return_value = _mock_issue()
+        mock_issue.return_value.fields.labels = ["team-a"]
+
+        jira_connection.update_issue(BaseIssue(key="TEST-123", project="Test Project", title=BaseIssueField("Test Issue"),
+                                               description=BaseIssueField(""), status=BaseIssueField(BaseIssueStatus.OPEN),
+                                               identity="gh-repo-42"))
+
+        assert _edits(jira_connection)[0][1]["fields"]["labels"] == ["team-a", "gh-repo-42"]
+
+
+def test_create_issue_maps_labels_assignee_and_milestone(jira_connection):
+    jira_connection._jira.search_users.return_value = [Mock(accountId="abc-1")]
+    jira_connection._jira.project_versions.return_value = [Mock(), Mock()]
+    jira_connection._jira.project_versions.return_value[0].name = "1.0"
+    jira_connection._jira.project_versions.return_value[1].name = "2.0"
+    with patch.object(jira_connection._jira, 'create_issue') as mock_create_issue:
+        mock_create_issue.return_value = Mock(key="TEST-123")
+
+        jira_connection.create_issue(BaseIssue(key=None, project="Test Project", title=BaseIssueField("Test Issue"),
+                                                description=BaseIssueField(""), identity="gh-repo-42",
+                                                labels=["bug", "good first issue"], assignees=["octocat"],
+                                                milestone="2.0"))
+
+        fields = mock_create_issue.call_args[1]['fields']
+        assert fields['labels'] == ["gh-repo-42", "bug", "good-first-issue"]
+        assert fields['assignee'] == {"accountId": "abc-1"}
+        assert fields['fixVersions'] == [{"name": "2.0"}]
+
+
+def test_update_issue_writes_only_changed_mapped_fields(jira_connection):
+    jira_connection._jira.search_users.return_value = [Mock(accountId="abc-1")]
+    jira_connection._jira.project_versions.return_value = []
+    with patch.object(jira_connection._jira, 'issue') as mock_issue:
+        mock_issue.return_value = _mock_issue()
+        mock_issue.return_value.fields.labels = ["gh-repo-42", "bug", "team-a"]
+        mock_issue.return_value.fields.assignee = Mock(accountId="abc-1")
+
+        issue = BaseIssue(key="TEST-123", project="Test Project", title=BaseIssueField("Test Issue"),
+                          description=BaseIssueField("Test description"), status=BaseIssueField(BaseIssueStatus.OPEN),
+                          identity="gh-repo-42", labels=["bug"], assignees=["octocat"], milestone="unknown")
+        jira_connection.update_issue(issue)
+        assert _edits(jira_connection) == []
+
+        issue.labels = ["bug", "ui"]
+        jira_connection.update_issue(issue)
+        assert _edits(jira_connection) == [("issue/TEST-123", {"fields": {"labels": ["gh-repo-42", "bug", "team-a", "ui"]}})]
+
+    # users and versions are looked up once
+    assert jira_connection._jira.search_users.call_count == 1
+    assert jira_connection._jira.project_versions.call_count == 1
+
+
+def test_user_mapping_is_used_for_lookup():
+    config = JiraConfig(url="http://test.com", project="Test Project", user_mapping={"octocat": "jane@example.com"})
+    with patch('issues_sync.jira_connection.JIRA'):
+        connection = JiraConnection(config)
+    connection._jira._is_cloud = False
+    connection._jira.search_users.return_value = [Mock(spec=["name"])]
+    connection._jira.search_users.return_value[0].name = "jane"
+
+    assert connection._mapping.user("octocat") == {"name": "jane"}
+    connection._jira.search_users.assert_called_once_with(user="jane@example.com", maxResults=2)
+
+
+def test_rejected_user_search_is_cached(jira_connection, caplog):
+    jira_connection._jira.search_users.side_effect = JIRAError(status_code=403, text="Forbidden")
+
+    assert jira_connection._mapping.user("octocat") is None
+    assert jira_connection._mapping.user("octocat") is None
+    assert jira_connection._mapping.user("hubot") is None
+
+    assert jira_connection._jira.search_users.call_count == 2
+    assert len([r for r in caplog.records if "rejected the user search" in r.message]) == 1
+
+
+def test_get_issue_reads_identity_label(jira_connection):
+    with patch.object(jira_connection._jira, 'issue') as mock_issue:
+        mock_issue.return_value = _mock_issue()
+        mock_issue.return_value.fields.labels = ["team-a", "gh-repo-42"]
+
+        assert jira_connection.get_issue("TEST-123").identity == "gh-repo-42"
+
+
+def test_find_issue_keys_by_labels(jira_connection):
+    def issue(key, *labels):
+        return Mock(key=key, fields=Mock(labels=list(labels)))
+
+    with patch.object(jira_connection._jira, 'search_issues') as mock_search_issues:
+        mock_search_issues.side_effect = [[issue("TEST-1", "gh-repo-1", "team-a"), issue("TEST-2", "gh-repo-2")],
+                                          []]
+
+        keys = jira_connection.find_issue_keys_by_labels(["gh-repo-1", "gh-repo-2", "gh-repo-3"], batch_size=2)
+
+        assert keys == {"gh-repo-1": "TEST-1", "gh-repo-2": "TEST-2"}
+        assert mock_search_issues.call_count == 2
+        assert mock_search_issues.call_args_list[0][0][0] == \
+               'project = "Test Project" AND labels in ("gh-repo-1", "gh-repo-2")'
+        assert mock_search_issues.call_args_list[1][0][0] == 'project = "Test Project" AND labels in ("gh-repo-3")'
+        assert mock_search_issues.call_args_list[0][1]["maxResults"] is False
+
+
+def test_update_issue_writes_only_changes(jira_connection):
+    metrics = Metrics()
+    jira_connection._metrics = metrics
+    with patch.object(jira_connection._jira, 'issue') as mock_issue:
+        mock_issue.return_value = _mock_issue()
+        mock_issue.return_value.fields.comment.comments = [Mock(id="1", body="first\n"), Mock(id="2", body="second")]
+        base_issue = BaseIssue(key="TEST-123",
+                               project="Test Project",
+                               title=BaseIssueField("Test Issue"),
+                               description=BaseIssueField("\nTest description "),
+                               status=BaseIssueField(BaseIssueStatus.OPEN),
+                               comments=[BaseIssueComment("first", "user"), BaseIssueComment("changed", "user")])
+
+        jira_connection.update_issue(base_issue)
+
+        jira_connection._jira.transition_issue.assert_not_called()
+        # only the changed comment is written
+        assert _edits(jira_connection) == [("issue/TEST-123/comment/2", {"body": "changed"})]
+        assert metrics.get("skipped_writes", system="jira") == 3
+
+        base_issue.status.value = BaseIssueStatus.CLOSED
+        base_issue.comments[1] = BaseIssueComment("second", "user")
+        jira_connection.update_issue(base_issue)
+
+        # a status only change is just the transition
+        assert len(_edits(jira_connection)) == 1
         assert jira_connection._jira.transition_issue.call_args[0] == ("TEST-123", "Done")
+
+
+def test_get_changed_issues(jira_connection):
+    def issue(key, status):
+        mock_issue = Mock(key=key, fields=Mock(summary=key, updated="2023-01-02T00:00:00.000+0000",
+                                               labels=[f"gh-repo-{key}"]))
+        mock_issue.fields.status.name = status
+        return mock_issue
+
+    with patch.object(jira_connection._jira, 'search_issues') as mock_search_issues:
+        mock_search_issues.side_effect = [[issue("TEST-1", "Done"), issue("TEST-2", "New")], [issue("TEST-3", "New")]]
+
+        with patch("issues_sync.jira_connection.datetime") as mock_datetime:
+            mock_datetime.datetime.utcnow.return_value = datetime(2023, 1, 2, 1, 0)
+            issues = list(jira_connection.get_changed_issues(datetime(2023, 1, 2), page_size=2))
+
+        assert [(i.key, i.status.value, i.identity) for i in issues] == [
+            ("TEST-1", BaseIssueStatus.CLOSED, "gh-repo-TEST-1"),
+            ("TEST-2", BaseIssueStatus.OPEN, "gh-repo-TEST-2"),
+            ("TEST-3", BaseIssueStatus.OPEN, "gh-repo-TEST-3")]
+        assert all(i.comments is None for i in issues)
+        assert mock_search_issues.call_args_list[0][0][0] == \
+               'project = "Test Project" AND updated >= -61m ORDER BY updated DESC'
+        assert [c[1]["startAt"] for c in mock_search_issues.call_args_list] == [0, 2]
+        assert mock_search_issues.call_args_list[0][1]["fields"] == "summary,status,updated,labels"
+
+
+def test_add_attachment(jira_connection):
+    jira_connection._jira.add_attachment.return_value = Mock(id=10001)
+    file = Mock()
+
+    assert jira_connection.add_attachment("TEST-123", file, "trace.log") == "10001"
+    jira_connection._jira.add_attachment.assert_called_once_with(issue="TEST-123", attachment=file, filename="trace.log")
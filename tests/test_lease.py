@@ -0,0 +1,68 @@
+import datetime
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from issues_sync.lease import FileLease, EXIT, WAIT, acquire
+
+
+@pytest.fixture
+def lock_file(tmp_path):
+    return str(tmp_path / "state.json.lock")
+
+
+def test_lease_is_exclusive(lock_file):
+    first = FileLease(lock_file)
+    second = FileLease(lock_file)
+
+    assert first.acquire()
+    assert not second.acquire()
+
+    first.release()
+
+    assert second.acquire()
+    assert not os.path.exists(lock_file + ".stale")
+
+
+def test_expired_lease_is_taken_over(lock_file):
+    with open(lock_file, "w") as f:
+        json.dump({"id": "other", "host": "other-host", "pid": 1,
+                   "expires_at": (datetime.datetime.utcnow() - datetime.timedelta(minutes=1)).isoformat()}, f)
+
+    lease = FileLease(lock_file)
+
+    assert lease.acquire()
+    with open(lock_file) as f:
+        assert json.load(f)["pid"] == os.getpid()
+
+
+def test_lease_of_dead_process_is_taken_over(lock_file):
+    with open(lock_file, "w") as f:
+        json.dump({"id": "other", "host": FileLease(lock_file)._owner["host"], "pid": 2 ** 22 + 1,
+                   "expires_at": (datetime.datetime.utcnow() + datetime.timedelta(hours=1)).isoformat()}, f)
+
+    assert FileLease(lock_file).acquire()
+
+
+def test_release_keeps_lease_taken_over_by_another_sync(lock_file):
+    lease = FileLease(lock_file, ttl=datetime.timedelta(seconds=0))
+    assert lease.acquire()
+    other = FileLease(lock_file)
+    assert other.acquire()
+
+    lease.release()
+
+    assert not FileLease(lock_file).acquire()
+
+
+def test_acquire_policy(lock_file):
+    FileLease(lock_file).acquire()
+    lease = FileLease(lock_file)
+
+    assert not acquire(lease, EXIT)
+    with patch("issues_sync.lease.time.sleep") as sleep:
+        assert not acquire(lease, WAIT, wait=datetime.timedelta(seconds=0))
+    with pytest.raises(ValueError):
+        acquire(lease, "retry")
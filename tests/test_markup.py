@@ -0,0 +1,70 @@
+from unittest.mock import patch
+
+from issues_sync.markup import MarkupConverter, link_attachments, markdown_to_jira
+from issues_sync.utils import InMemoryState
+
+
+def test_inline_styles():
+    assert markdown_to_jira("**bold**, *italic*, _italic_ and ~~strike~~") == "*bold*, _italic_, _italic_ and -strike-"
+    assert markdown_to_jira("[docs](https://docs.example.com) ![logo](https://example.com/logo.png)") == \
+           "[docs|https://docs.example.com] !https://example.com/logo.png!"
+    assert markdown_to_jira("see <https://example.com>") == "see [https://example.com]"
+    assert markdown_to_jira("`a *b* [c](d)` and snake_case_name, 2 * 3 * 4") == \
+           "{{a *b* [c](d)}} and snake_case_name, 2 * 3 * 4"
+
+
+def test_blocks():
+    markdown = "\n".join([
+        "## Steps",
+        "- first",
+        "  - nested",
+        "1. one",
+        "> quoted",
+        "---",
+    ])
+    assert markdown_to_jira(markdown) == "\n".join(["h2. Steps", "* first", "** nested", "# one", "bq. quoted", "----"])
+
+
+def test_code_block_is_kept():
+    markdown = "```python\ndef f(*args, **kwargs):\n    # comment\n```\n**after**"
+    assert markdown_to_jira(markdown) == "{code:python}\ndef f(*args, **kwargs):\n    # comment\n{code}\n*after*"
+    assert markdown_to_jira("```\nnot closed") == "{code}\nnot closed\n{code}"
+
+
+def test_table():
+    markdown = "| name | value |\n|------|:-----:|\n| **a** | 1 |"
+    assert markdown_to_jira(markdown) == "||name||value||\n|*a*|1|"
+
+
+def test_converter_caches_by_content():
+    state = InMemoryState()
+    converter = MarkupConverter(state, cache_size=1)
+
+    with patch("issues_sync.markup.markdown_to_jira", wraps=markdown_to_jira) as convert:
+        assert converter.convert("**a**") == "*a*"
+        assert converter.convert("**a**") == "*a*"
+        assert converter.convert("**b**") == "*b*"
+        assert convert.call_count == 2
+
+        # evicted from memory, but cached in the state (e.g. by a previous run)
+        assert converter.convert("**a**") == "*a*"
+        assert MarkupConverter(state).convert("**b**") == "*b*"
+        assert convert.call_count == 2
+
+    assert converter.convert(None) is None
+
+
+def test_mirrored_attachments_are_linked():
+    names = {"https://github.com/a.png": "a.png", "https://github.com/files/1/trace.log": "trace.log"}
+    markup = markdown_to_jira("![a](https://github.com/a.png) [log](https://github.com/files/1/trace.log) "
+                              "![b](https://example.com/b.png)")
+
+    assert link_attachments(markup, names) == "!a.png! [log|^trace.log] !https://example.com/b.png!"
+    assert link_attachments("!https://github.com/a.png|width=10!", names) == "!a.png|width=10!"
+
+    state = InMemoryState()
+    state.update_attachment("JIRA-1", "https://github.com/a.png", "digest", "1", "a.png")
+    converter = MarkupConverter(state)
+    assert converter.link("JIRA-1", "!https://github.com/a.png!") == "!a.png!"
+    # not created yet, so nothing is mirrored to the issue
+    assert converter.link(None, "!https://github.com/a.png!") == "!https://github.com/a.png!"
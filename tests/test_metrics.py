@@ -0,0 +1,118 @@
+import urllib.request
+from unittest.mock import Mock
+
+import pytest
+
+from issues_sync.metrics import Metrics, instrument, record_retry, track
+
+
+class Connection:
+    def get_issue(self, key):
+        with track("get_comments"):
+            pass
+        return key
+
+    def get_issues(self):
+        yield "1"
+        yield "2"
+
+    def fail(self):
+        raise ValueError("failed")
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+
+@pytest.fixture
+def connection(metrics):
+    connection = Connection()
+    instrument(connection, "github", {"get_issue": "get_issue", "get_issues": "get_issues", "fail": "update"}, metrics)
+    return connection
+
+
+def test_instrument_counts_calls_and_latency(metrics, connection):
+    assert connection.get_issue("1") == "1"
+    assert connection.get_issue("2") == "2"
+
+    assert metrics.get("api_calls", system="github", operation="get_issue") == 2
+    assert metrics.get("api_calls", system="github", operation="get_comments") == 2
+    assert metrics.get_histogram("api_duration_seconds", system="github", operation="get_issue").count == 2
+
+
+def test_instrument_generator(metrics, connection):
+    assert list(connection.get_issues()) == ["1", "2"]
+
+    assert metrics.get("api_calls", operation="get_issues") == 1
+    assert metrics.get_histogram("api_duration_seconds", system="github", operation="get_issues").count == 1
+
+
+def test_instrument_counts_errors(metrics, connection):
+    with pytest.raises(ValueError):
+        connection.fail()
+
+    assert metrics.get("api_errors", system="github", operation="update") == 1
+
+
+def test_responses_and_retries_attributed_to_current_operation(metrics):
+    with metrics.operation("jira", "search"):
+        metrics.on_response(Mock(content=b"12345"))
+        record_retry()
+    metrics.on_response(Mock(content=b"12"))
+
+    assert metrics.get("http_requests", system="jira", operation="search") == 1
+    assert metrics.get("http_response_bytes", system="jira", operation="search") == 5
+    assert metrics.get("api_retries", system="jira", operation="search") == 1
+    assert metrics.get("http_requests") == 2
+
+
+def test_streamed_response_is_not_read(metrics):
+    response = Mock(headers={"Content-Length": "1048576"})
+    type(response).content = property(lambda self: pytest.fail("the streamed body was read"))
+
+    metrics.on_response(response, stream=True)
+
+    assert metrics.get("http_response_bytes") == 1048576
+
+
+def test_track_without_operation_is_noop(metrics):
+    with track("get_comments"):
+        pass
+    assert metrics.get("api_calls") == 0
+
+
+def test_render_openmetrics(metrics):
+    metrics.inc("issues", result="created")
+    metrics.set("queue_depth", 3, stage="write")
+    metrics.observe("api_duration_seconds", 0.2, buckets=(0.1, 1.0), system="jira", operation="update")
+
+    text = metrics.render()
+
+    assert '# TYPE issues_sync_issues counter' in text
+    assert 'issues_sync_issues_total{result="created"} 1' in text
+    assert 'issues_sync_queue_depth{stage="write"} 3' in text
+    assert 'issues_sync_api_duration_seconds_bucket{operation="update",system="jira",le="0.1"} 0' in text
+    assert 'issues_sync_api_duration_seconds_bucket{operation="update",system="jira",le="1"} 1' in text
+    assert 'issues_sync_api_duration_seconds_bucket{operation="update",system="jira",le="+Inf"} 1' in text
+    assert 'issues_sync_api_duration_seconds_count{operation="update",system="jira"} 1' in text
+    assert text.endswith("# EOF\n")
+
+
+def test_write_textfile(metrics, tmp_path):
+    metrics.inc("issues", result="updated")
+    file = tmp_path / "sync.prom"
+
+    metrics.write_textfile(str(file))
+
+    assert file.read_text() == metrics.render()
+
+
+def test_serve(metrics):
+    metrics.inc("issues", result="created")
+    server = metrics.serve(0, "127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert 'issues_sync_issues_total{result="created"} 1' in response.read().decode()
+    finally:
+        server.shutdown()
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from issues_sync.metrics import Metrics
+from issues_sync.pipeline import Pipeline, Stage
+
+
+def _run(pipeline, items):
+    completed = []
+    with pipeline:
+        for item in items:
+            completed.extend(pipeline.put(item))
+        completed.extend(pipeline.drain())
+    return completed
+
+
+def test_pipeline_runs_items_through_all_stages():
+    metrics = Metrics()
+    pipeline = Pipeline([Stage("double", lambda x: x * 2, workers=3), Stage("inc", lambda x: x + 1, workers=2)],
+                        metrics)
+
+    completed = _run(pipeline, range(50))
+
+    assert sorted((c.item, c.value) for c in completed) == [(i, i * 2 + 1) for i in range(50)]
+    assert metrics.get("pipeline_items", stage="double") == 50
+    assert metrics.get("pipeline_items", stage="inc") == 50
+    assert "double: 50 items" in pipeline.stats()
+
+
+def test_failed_items_skip_remaining_stages():
+    def fail_odd(x):
+        if x % 2:
+            raise ValueError(f"odd {x}")
+        return x
+
+    later = []
+    pipeline = Pipeline([Stage("check", fail_odd), Stage("record", lambda x: later.append(x) or x)])
+
+    completed = {c.item: c for c in _run(pipeline, range(4))}
+
+    assert sorted(later) == [0, 2]
+    assert isinstance(completed[1].error, ValueError)
+    assert completed[1].stage == "check"
+    assert completed[2].error is None
+
+
+def test_slow_stage_bounds_items_in_flight():
+    lock = threading.Lock()
+    started = []
+
+    def fetch(x):
+        with lock:
+            started.append(x)
+        return x
+
+    def slow(x):
+        time.sleep(0.01)
+        return x
+
+    pipeline = Pipeline([Stage("fetch", fetch, queue_size=2), Stage("slow", slow, queue_size=2)])
+    max_ahead = 0
+    finished = 0
+    with pipeline:
+        for item in range(30):
+            finished += len(list(pipeline.put(item)))
+            with lock:
+                max_ahead = max(max_ahead, len(started) - finished)
+        finished += len(list(pipeline.drain()))
+
+    assert finished == 30
+    # queues of 2 plus one item per worker and the queue of completed items
+    assert max_ahead <= 8
+
+
+def test_wait_returns_completed_items():
+    release = threading.Event()
+    pipeline = Pipeline([Stage("blocked", lambda x: release.wait() and x, workers=2, queue_size=3)])
+    assert pipeline.capacity == 8
+
+    with pipeline:
+        list(pipeline.put(1))
+        assert list(pipeline.wait()) == []
+        release.set()
+        completed = []
+        while not completed:
+            completed.extend(pipeline.wait())
+        assert [c.value for c in completed] == [1]
+        assert list(pipeline.drain()) == []
+
+
+def test_error_in_caller_stops_workers():
+    pipeline = Pipeline([Stage("sleep", lambda x: time.sleep(0.01) or x, queue_size=1)])
+    with pytest.raises(RuntimeError):
+        with pipeline:
+            for item in range(5):
+                list(pipeline.put(item))
+            raise RuntimeError("stop")
+    assert not any(thread.is_alive() for thread in pipeline._threads)
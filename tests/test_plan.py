@@ -0,0 +1,192 @@
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import pytest
+
+from issues_sync.config import JiraConfig
+from issues_sync.issue import BaseIssue, BaseIssueField, BaseIssueStatus, BaseIssueComment
+from issues_sync.jira_connection import JiraConnection
+from issues_sync.plan import SyncPlan, PlannedOperation, diff_issues, estimate_update_calls, issue_from_dict, \
+    issue_to_dict, CREATE, UPDATE, NOOP
+from issues_sync.sync_engine import SyncEngine
+from issues_sync.sync_strategy import GithubToJiraSyncStrategy
+from issues_sync.utils import InMemoryState
+
+
+def _issue(key, title="Title", description="Description", status=BaseIssueStatus.OPEN, comments=(), updated_at=None):
+    return BaseIssue(key=key, project="test", title=BaseIssueField(title), description=BaseIssueField(description),
+                     status=BaseIssueField(status), comments=[BaseIssueComment(c, "user") for c in comments],
+                     updated_at=updated_at, html_url=f"https://github.com/test/test/issues/{key}")
+
+
+def test_diff_issues():
+    current = _issue("JIRA-1", comments=["a", "b", "c"])
+    desired = _issue("JIRA-1", title="New title", status=BaseIssueStatus.CLOSED, comments=["a", "B"])
+
+    changes = diff_issues(current, desired)
+
+    assert changes == {
+        "summary": {"from": "Title", "to": "New title"},
+        "status": {"from": "OPEN", "to": "CLOSED"},
+        "comments": {"updated": 1, "added": 0, "removed": 1},
+    }
+    # read, fields, changed comment, removed comment and transition
+    assert estimate_update_calls(current, desired) == 5
+    assert estimate_update_calls(current, _issue("JIRA-1", comments=["a", "b", "c"])) == 1
+
+
+def test_issue_dict_round_trip():
+    issue = _issue("1", comments=["a"])
+    assert issue_to_dict(issue_from_dict(issue_to_dict(issue))) == issue_to_dict(issue)
+
+
+def test_plan_save_load(tmp_path):
+    plan = SyncPlan(since=datetime(2023, 1, 1), until=datetime(2023, 1, 2),
+                    operations=[PlannedOperation(CREATE, "1", None, issue=issue_to_dict(_issue("1")), api_calls=1)])
+    file = str(tmp_path / "plan.json")
+
+    plan.save(file)
+    loaded = SyncPlan.load(file)
+
+    assert loaded == plan
+    assert loaded.api_calls == 1
+
+
+class TestSyncEnginePlan:
+    @pytest.fixture
+    def github_connection(self):
+        return Mock()
+
+    @pytest.fixture
+    def jira_connection(self):
+        jira_connection = Mock()
+        jira_connection.mapped_fields.return_value = {}
+        return jira_connection
+
+    @pytest.fixture
+    def state(self):
+        return InMemoryState()
+
+    @pytest.fixture
+    def sync_engine(self, github_connection, jira_connection, state):
+        strategy = GithubToJiraSyncStrategy(jira_connection, github_connection)
+        return SyncEngine(github_connection, jira_connection, strategy, state)
+
+    def test_plan(self, sync_engine, github_connection, jira_connection, state):
+        github_connection.get_issues.return_value = [
+            _issue("1", status=BaseIssueStatus.CLOSED, comments=["a", "b"], updated_at=datetime(2023, 1, 1)),
+            _issue("3", updated_at=datetime(2023, 1, 2)),
+            _issue("2", title="Changed", comments=["new"], updated_at=datetime(2023, 1, 3))]
+        jira_connection.find_issue_id_by_title.side_effect = [None, "JIRA-3", "JIRA-2"]
+        strategy = GithubToJiraSyncStrategy(jira_connection, github_connection)
+        unchanged = strategy.build_jira_issue(_issue("3"))
+        unchanged.key = "JIRA-3"
+        jira_connection.get_issues.return_value = [_issue("JIRA-2"), unchanged]
+
+        plan = sync_engine.plan()
+
+        assert [(op.action, op.github_issue, op.jira_issue) for op in plan.operations] == [
+            (CREATE, "1", None), (NOOP, "3", "JIRA-3"), (UPDATE, "2", "JIRA-2")]
+        assert plan.operations[2].changes["summary"] == {"from": "Title", "to": "Changed"}
+        assert plan.operations[2].changes["comments"] == {"updated": 0, "added": 1, "removed": 0}
+        # create, two comments and the transition to closed
+        assert plan.operations[0].api_calls == 4
+        assert plan.until == datetime(2023, 1, 3)
+        jira_connection.get_issues.assert_called_once_with(["JIRA-3", "JIRA-2"])
+        jira_connection.create_issue.assert_not_called()
+        jira_connection.update_issue.assert_not_called()
+        # the issues found in Jira are mapped only when the plan is applied
+        assert state.get_jira_issue("3") is None
+
+    @pytest.mark.parametrize("field, github_value, change", [
+        ("labels", ["bug"], {"from": [], "to": ["bug"]}),
+        ("assignees", ["me"], {"from": None, "to": {"accountId": "abc-1"}}),
+        ("milestone", "1.0", {"from": [], "to": [{"name": "1.0"}]}),
+    ])
+    def test_plan_mapped_fields(self, sync_engine, github_connection, jira_connection, field, github_value, change):
+        config = JiraConfig(url="http://test.com", project="test")
+        with patch('issues_sync.jira_connection.JIRA'):
+            mapping = JiraConnection(config)
+        mapping._jira.search_users.return_value = [Mock(accountId="abc-1")]
+        mapping._jira.project_versions.return_value = [Mock()]
+        mapping._jira.project_versions.return_value[0].name = "1.0"
+        jira_connection.mapped_fields.side_effect = mapping.mapped_fields
+        github_issue = _issue("2")
+        setattr(github_issue, field, github_value)
+        github_connection.get_issues.return_value = [github_issue]
+        jira_connection.find_issue_id_by_title.return_value = "JIRA-2"
+        # the Jira issue is up to date except for the field
+        jira_issue = GithubToJiraSyncStrategy(jira_connection, github_connection).build_jira_issue(_issue("2"))
+        jira_issue.key = "JIRA-2"
+        jira_connection.get_issues.return_value = [jira_issue]
+
+        operation = sync_engine.plan().operations[0]
+
+        name = {"assignees": "assignee", "milestone": "fixVersions"}.get(field, field)
+        assert (operation.action, operation.changes) == (UPDATE, {name: change})
+        # read and fields update
+        assert operation.api_calls == 2
+
+    def test_apply(self, sync_engine, jira_connection, state):
+        state.update_last_sync_time(datetime(2023, 1, 1))
+        plan = SyncPlan(since=datetime(2023, 1, 1), until=datetime(2023, 1, 3), operations=[
+            PlannedOperation(CREATE, "1", None, issue=issue_to_dict(_issue(None))),
+            PlannedOperation(UPDATE, "2", "JIRA-2", issue=issue_to_dict(_issue("JIRA-2"))),
+            PlannedOperation(NOOP, "3", "JIRA-3")])
+        jira_connection.create_issue.return_value = "JIRA-1"
+
+        sync_engine.apply(plan, workers=2)
+
+        assert state.get_jira_issue("1") == "JIRA-1"
+        assert state.get_jira_issue("2") == "JIRA-2"
+        assert state.get_jira_issue("3") == "JIRA-3"
+        assert jira_connection.update_issue.call_args[0][0].key == "JIRA-2"
+        assert state.get_last_sync_time() == datetime(2023, 1, 3)
+
+    def test_apply_failure_keeps_last_sync_time(self, sync_engine, jira_connection, state):
+        last_sync_time = state.get_last_sync_time()
+        plan = SyncPlan(since=last_sync_time, until=datetime(2023, 1, 3), operations=[
+            PlannedOperation(UPDATE, "2", "JIRA-2", issue=issue_to_dict(_issue("JIRA-2")))])
+        jira_connection.update_issue.side_effect = Exception("Jira is down")
+
+        sync_engine.apply(plan)
+
+        assert state.get_last_sync_time() == last_sync_time
+
+    def test_apply_rejects_stale_plan(self, sync_engine, jira_connection, state):
+        plan = SyncPlan(since=datetime(2023, 1, 1), until=datetime(2023, 1, 3), operations=[
+            PlannedOperation(CREATE, "1", None, issue=issue_to_dict(_issue(None)))])
+        # a sync ran after the plan was made
+        state.update_last_sync_time(datetime(2023, 1, 2))
+
+        with pytest.raises(ValueError):
+            sync_engine.apply(plan)
+
+        jira_connection.create_issue.assert_not_called()
+        assert state.get_last_sync_time() == datetime(2023, 1, 2)
+
+    def test_apply_skips_creates_of_existing_issues(self, sync_engine, jira_connection, state):
+        state.update_last_sync_time(datetime(2023, 1, 1))
+        state.update("1", "JIRA-1")
+        labelled = _issue(None)
+        labelled.identity = "gh-test-2"
+        plan = SyncPlan(since=datetime(2023, 1, 1), until=datetime(2023, 1, 3), operations=[
+            PlannedOperation(CREATE, "1", None, issue=issue_to_dict(_issue(None))),
+            PlannedOperation(CREATE, "2", None, issue=issue_to_dict(labelled))])
+        jira_connection.find_issue_keys_by_labels.return_value = {"gh-test-2": "JIRA-2"}
+
+        sync_engine.apply(plan)
+
+        jira_connection.find_issue_keys_by_labels.assert_called_once_with(["gh-test-2"])
+        jira_connection.create_issue.assert_not_called()
+        assert state.get_jira_issue("2") == "JIRA-2"
+        assert state.get_last_sync_time() == datetime(2023, 1, 3)
+
+    def test_apply_never_moves_last_sync_time_back(self, sync_engine, jira_connection, state):
+        state.update_last_sync_time(datetime(2023, 1, 5))
+        plan = SyncPlan(since=datetime(2023, 1, 5), until=datetime(2023, 1, 4), operations=[
+            PlannedOperation(UPDATE, "2", "JIRA-2", issue=issue_to_dict(_issue("JIRA-2")))])
+
+        sync_engine.apply(plan)
+
+        assert state.get_last_sync_time() == datetime(2023, 1, 5)
@@ -0,0 +1,80 @@
+import pstats
+
+from issues_sync import tracing
+from issues_sync.profiling import PhaseProfiler, profile
+from issues_sync.tracing import Span, span
+
+
+def _span(profiler, name, start, end, parent=None, **attributes):
+    s = Span(name, parent, attributes)
+    s.start_ns = int(start * 1e9)
+    s.end_ns = int(end * 1e9)
+    profiler.export(s)
+    return s
+
+
+def test_phase_timings_split_nested_spans():
+    profiler = PhaseProfiler()
+    sync = Span("sync", None, {})
+    sync_issue = Span("sync_issue", sync, {"github_issue": "1"})
+    finder = _span(profiler, "finder.find_jira_issue_key", 0, 3, sync_issue, github_issue="1")
+    _span(profiler, "jira.search", 1, 3, finder)
+    sync_issue.start_ns, sync_issue.end_ns = 0, int(5e9)
+    profiler.export(sync_issue)
+    sync.start_ns, sync.end_ns = 0, int(6e9)
+    profiler.export(sync)
+
+    timings = {t.phase: t for t in profiler.phase_timings()}
+
+    assert timings["Finder"].calls == 1
+    assert timings["Finder"].total_seconds == 3
+    assert timings["Finder"].self_seconds == 1
+    assert timings["Jira read"].self_seconds == 2
+    # sync and sync_issue are not phases of their own
+    assert timings["other"].self_seconds == 3
+    assert sum(t.self_seconds for t in timings.values()) == 6
+
+
+def test_issue_timings_sum_spans_of_issue():
+    profiler = PhaseProfiler()
+    transform = _span(profiler, "transform_issue", 0, 2, github_issue="1")
+    _span(profiler, "jira.get_issue", 0, 1.5, transform)
+    write = _span(profiler, "write_issue", 2, 5, github_issue="1")
+    _span(profiler, "jira.update_issue", 2, 5, write)
+    _span(profiler, "transform_issue", 0, 1, github_issue="2")
+
+    slowest, other = profiler.issue_timings()
+
+    assert slowest.github_issue == "1"
+    assert slowest.seconds == 5
+    assert slowest.phases == {"Jira read": 1.5, "Jira write": 3, "other": 0.5}
+    assert other.github_issue == "2"
+    assert "Jira write 3.000s" in profiler.report(6, top=1)
+    assert "      2 " not in profiler.report(6, top=1)
+
+
+def test_profile_writes_dump_and_keeps_tracing_exporter(tmp_path, capsys):
+    class Recorder(tracing.SpanExporter):
+        spans = []
+
+        def export(self, s):
+            self.spans.append(s.name)
+
+    file = tmp_path / "sync.prof"
+    with profile(str(file)) as profiler:
+        tracing.add_exporter(Recorder())
+        with span("config.load"):
+            sum(range(1000))
+
+    assert [t.phase for t in profiler.phase_timings()] == ["config load"]
+    assert Recorder.spans == ["config.load"]
+    assert pstats.Stats(str(file)).total_calls > 0
+    assert "config load" in capsys.readouterr().err
+    # tracing is disabled again
+    assert span("sync") is span("sync_issue")
+
+
+def test_profile_without_file_does_nothing():
+    with profile(None) as profiler:
+        assert profiler is None
+        assert span("sync") is span("sync_issue")
@@ -0,0 +1,75 @@
+import json
+from datetime import datetime, timedelta
+
+from issues_sync.metrics import Metrics
+from issues_sync.report import RunReport, SlowIssue, append_history, compare, load_history
+
+
+def _report(issues=10, seconds_per_issue=1.0, calls_per_issue=5, result="ok", started_at=datetime(2024, 1, 1)):
+    return RunReport(started_at=started_at, finished_at=started_at + timedelta(minutes=1), result=result,
+                     issues={"updated": issues}, issue_seconds=issues * seconds_per_issue,
+                     api={"jira.update": {"calls": issues * calls_per_issue,
+                                          "http_requests": issues * calls_per_issue}})
+
+
+def test_report_from_metrics():
+    metrics = Metrics()
+    metrics.inc("issues", result="created")
+    metrics.inc("issues", 2, result="updated")
+    metrics.inc("api_calls", 4, system="github", operation="get_issues")
+    metrics.inc("http_requests", 6, system="github", operation="get_issues")
+    metrics.observe("api_duration_seconds", 0.5, system="github", operation="get_issues")
+    metrics.observe("issue_sync_seconds", 1.5)
+    metrics.observe("issue_sync_seconds", 1.5)
+    metrics.observe("issue_sync_seconds", 3.0)
+
+    report = RunReport.from_metrics(metrics, datetime(2024, 1, 1), datetime(2024, 1, 1, 0, 1),
+                                    slowest_issues=[SlowIssue("7", 3.0)])
+
+    assert report.issues == {"created": 1, "updated": 2}
+    assert report.api == {"github.get_issues": {"calls": 4, "http_requests": 6, "seconds": 0.5}}
+    assert report.seconds_per_issue == 2.0
+    assert report.http_requests_per_issue == 2.0
+    assert report.duration_seconds == 60
+
+
+def test_report_roundtrip(tmp_path):
+    report = _report()
+    report.watermark_before = datetime(2023, 12, 31)
+    report.slowest_issues = [SlowIssue("1", 2.5)]
+    file = tmp_path / "report.json"
+
+    report.save(str(file))
+
+    data = json.loads(file.read_text())
+    assert data["api_calls_per_issue"] == 5
+    assert RunReport.from_dict(data) == report
+
+
+def test_history_keeps_last_runs(tmp_path):
+    file = str(tmp_path / "state.runs.jsonl")
+    for day in range(5):
+        append_history(file, _report(started_at=datetime(2024, 1, day + 1)), size=3)
+
+    assert [r.started_at.day for r in load_history(file)] == [3, 4, 5]
+
+
+def test_compare_flags_regressions_against_previous_runs():
+    reports = [_report(seconds_per_issue=1.0), _report(seconds_per_issue=1.2), _report(seconds_per_issue=0.9),
+               _report(seconds_per_issue=2.0), _report(calls_per_issue=9), _report(issues=0)]
+
+    comparisons = compare(reports, threshold=0.5, window=3)
+
+    assert [c.regressed for c in comparisons] == [False, False, False, True, True, False]
+    assert comparisons[3].regressions == {"seconds_per_issue": (2.0, 1.0)}
+    assert set(comparisons[4].regressions) == {"api_calls_per_issue", "http_requests_per_issue"}
+
+
+def test_compare_does_not_use_failed_runs_as_baseline():
+    reports = [_report(seconds_per_issue=1.0), _report(seconds_per_issue=10.0, result="failed"),
+               _report(seconds_per_issue=1.1)]
+
+    comparisons = compare(reports, threshold=0.5)
+
+    assert comparisons[1].regressed
+    assert not comparisons[2].regressed
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+from issues_sync.issue import BaseIssue, BaseIssueField, BaseIssueStatus
+from issues_sync.scheduler import IssueScheduler, Priority, DEFAULT_BACKFILL_LIMIT
+from issues_sync.utils import InMemoryState
+
+SINCE = datetime(2023, 1, 10)
+
+
+def _issue(key, status=BaseIssueStatus.OPEN, status_updated_at=None):
+    return BaseIssue(key=key, project="test", title=BaseIssueField(key), description=BaseIssueField(""),
+                     status=BaseIssueField(status, status_updated_at))
+
+
+def test_priority():
+    state = InMemoryState()
+    for key in ["2", "3", "4", "5"]:
+        state.update(key, f"JIRA-{key}")
+    scheduler = IssueScheduler()
+
+    assert scheduler.priority(_issue("1"), state, SINCE) == Priority.NEW
+    assert scheduler.priority(_issue("2", BaseIssueStatus.CLOSED, datetime(2023, 1, 11, tzinfo=timezone.utc)),
+                              state, SINCE) == Priority.CLOSE
+    assert scheduler.priority(_issue("3", BaseIssueStatus.CLOSED, datetime(2023, 1, 9)), state, SINCE) == Priority.EDIT
+    assert scheduler.priority(_issue("4"), state, SINCE) == Priority.EDIT
+    # reopened
+    assert scheduler.priority(_issue("5", BaseIssueStatus.OPEN, datetime(2023, 1, 11)), state, SINCE) == Priority.EDIT
+
+
+def test_order_is_configurable_and_stable():
+    state = InMemoryState()
+    state.update("2", "JIRA-2")
+    state.update("3", "JIRA-3")
+    issues = [_issue("2"), _issue("1"), _issue("3", BaseIssueStatus.CLOSED, datetime(2023, 1, 11)), _issue("4")]
+
+    assert [i.key for i in IssueScheduler().order(issues, state, SINCE)] == ["1", "4", "3", "2"]
+    close_first = IssueScheduler(order=(Priority.CLOSE, Priority.NEW, Priority.EDIT))
+    assert [i.key for i in close_first.order(issues, state, SINCE)] == ["3", "1", "4", "2"]
+
+
+def test_backfill_is_limited_by_default():
+    assert IssueScheduler().backfill_limit == DEFAULT_BACKFILL_LIMIT
+    assert IssueScheduler(backfill_limit=None).backfill_limit is None
+
+
+def test_is_backfill():
+    scheduler = IssueScheduler(fresh_window=timedelta(hours=6))
+    now = datetime(2023, 1, 10, 12)
+
+    assert scheduler.is_backfill(datetime(2023, 1, 10, 5, tzinfo=timezone.utc), now)
+    assert not scheduler.is_backfill(datetime(2023, 1, 10, 7), now)
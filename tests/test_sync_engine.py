@@ -1,8 +1,15 @@
+import threading
+import time
+from datetime import datetime, timedelta
 from unittest.mock import Mock
 
 import pytest
 
-from issues_sync.issue import BaseIssue, BaseIssueField
+from issues_sync.file_state import InFileState
+from issues_sync.issue import BaseIssue, BaseIssueComment, BaseIssueField, BaseIssueStatus
+from issues_sync.metrics import Metrics
+from issues_sync.scheduler import IssueScheduler
+from issues_sync.state import FailedIssue, OutboxEntry
 from issues_sync.sync_engine import SyncEngine
 from issues_sync.utils import InMemoryState
 
@@ -18,18 +25,28 @@ class TestSyncEngine:
 
     @pytest.fixture
     def jira_connection(self):
-        return Mock()
+        jira_connection = Mock()
+        jira_connection.get_changed_issues.return_value = []
+        return jira_connection
 
     @pytest.fixture
     def state(self):
-        return InMemoryState()
+        state = InMemoryState()
+        # not behind, so no fresh issues are prioritized
+        state.update_last_sync_time(datetime.utcnow() - timedelta(minutes=5))
+        return state
+
+    @pytest.fixture
+    def metrics(self):
+        return Metrics()
 
     @pytest.fixture
-    def sync_engine(self, github_connection, jira_connection, sync_strategy, state):
-        return SyncEngine(github_connection, jira_connection, sync_strategy, state)
+    def sync_engine(self, github_connection, jira_connection, sync_strategy, state, metrics):
+        return SyncEngine(github_connection, jira_connection, sync_strategy, state, metrics=metrics)
 
-    def _base_issue(self, key: str, title: str):
-        return BaseIssue(key=key, project="test", title=BaseIssueField(title), description=BaseIssueField(""))
+    def _base_issue(self, key: str, title: str, updated_at=None):
+        return BaseIssue(key=key, project="test", title=BaseIssueField(title), description=BaseIssueField(""),
+                         updated_at=updated_at)
 
     def test_sync(self, sync_engine, github_connection, jira_connection, sync_strategy, state):
         github_issues = [
@@ -48,12 +65,112 @@ class TestSyncEngine:
         assert state.get_jira_issue("2") is not None
         assert state.get_jira_issue("3") is not None
 
+    def test_sync_counts_issues(self, sync_engine, github_connection, jira_connection, sync_strategy, metrics):
+        github_connection.get_issues.return_value = [
+            self._base_issue(key="1", title='Issue 1'),
+            self._base_issue(key="2", title='Issue 2')]
+        jira_connection.find_issue_id_by_title.side_effect = [None, 'JIRA-2']
+        sync_strategy.update.side_effect = Exception("Jira is down")
+
+        sync_engine.sync()
+
+        assert metrics.get("issues", result="created") == 1
+        assert metrics.get("issues", result="failed") == 1
+
+    def test_sync_reports_run(self, sync_engine, github_connection, jira_connection, sync_strategy, state, metrics):
+        updated_at = datetime.utcnow()
+        watermark = state.get_last_sync_time()
+        github_connection.get_issues.return_value = [self._base_issue(key="1", title='Issue 1', updated_at=updated_at),
+                                                     self._base_issue(key="2", title='Issue 2', updated_at=updated_at)]
+        jira_connection.find_issue_id_by_title.side_effect = [None, 'JIRA-2']
+        metrics.inc("api_calls", 3, system="jira", operation="search")
+
+        sync_engine.sync()
+
+        report = sync_engine.report
+        assert report.result == "ok"
+        assert report.issues == {"created": 1, "updated": 1}
+        assert report.watermark_before == watermark
+        assert report.watermark_after == updated_at
+        assert report.api["jira.search"]["calls"] == 3
+        assert report.api_calls_per_issue == 1.5
+        assert sorted(s.github_issue for s in report.slowest_issues) == ["1", "2"]
+
+    def test_sync_records_lag(self, sync_engine, github_connection, jira_connection, sync_strategy, state, metrics):
+        now = datetime.utcnow()
+        github_connection.get_issues.return_value = [
+            self._base_issue(key="1", title='Issue 1', updated_at=now - timedelta(minutes=10)),
+            self._base_issue(key="2", title='Issue 2', updated_at=now - timedelta(minutes=2)),
+            self._base_issue(key="3", title='Issue 3', updated_at=now - timedelta(minutes=1))]
+        jira_connection.find_issue_id_by_title.side_effect = [None, 'JIRA-2', Exception("Jira is down")]
+
+        sync_engine.sync()
+
+        # the failed issue is not in Jira yet, so it has no lag
+        lag = sync_engine.report.lag_seconds
+        assert 600 <= lag["max"] < 610 and 120 <= lag["p50"] < 130
+        assert metrics.get_histogram("sync_lag_seconds").count == 2
+        assert round(metrics.get("sync_lag_p95_seconds", window="run"), 3) == lag["max"]
+        assert state.get_lag_histogram().count == 2
+        assert state.get_lag_histogram().percentile(0.5) == 300
+        # all changes were listed, so the watermark is the start of the listing, not the last sync time
+        assert sync_engine.report.watermark_lag_seconds < 5
+
+    def test_sync_warns_when_watermark_is_behind(self, github_connection, jira_connection, sync_strategy, state,
+                                                 caplog):
+        state.update_last_sync_time(datetime.utcnow() - timedelta(hours=3))
+        github_connection.get_issues.return_value = [
+            self._base_issue(key="1", title='Issue 1', updated_at=datetime.utcnow() - timedelta(hours=2)),
+            self._base_issue(key="2", title='Issue 2', updated_at=datetime.utcnow() - timedelta(hours=1))]
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state,
+                                 max_watermark_lag=timedelta(hours=1))
+
+        sync_engine.sync(max_issues=1)
+
+        assert 7200 <= sync_engine.report.watermark_lag_seconds < 7210
+        assert "The sync is behind" in caplog.text
+
+    def test_import_syncs_exported_issues_and_moves_cursor(self, sync_engine, github_connection, jira_connection,
+                                                           sync_strategy, state, metrics):
+        exported = [self._base_issue(key="1", title='Issue 1', updated_at=datetime(2015, 1, 1)),
+                    self._base_issue(key="2", title='Issue 2', updated_at=datetime(2016, 1, 1)),
+                    self._base_issue(key="3", title='Issue 3', updated_at=datetime(2014, 1, 1))]
+        exported[2].identity = "gh-test-3"
+        jira_connection.find_issue_keys_by_labels.return_value = {"gh-test-3": "JIRA-3"}
+        jira_connection.find_issue_id_by_title.side_effect = [None, 'JIRA-2']
+        sync_strategy.create_jira_issue.return_value = 'JIRA-1'
+
+        sync_engine.import_issues(iter(exported))
+
+        github_connection.get_issues.assert_not_called()
+        assert state.get_jira_issue("1") == 'JIRA-1'
+        assert state.get_jira_issue("3") == 'JIRA-3'
+        # the identity labels of the batch are looked up with one search
+        jira_connection.find_issue_keys_by_labels.assert_called_once_with(["gh-test-3"])
+        assert sync_engine.report.issues == {"created": 1, "updated": 2}
+        # the next sync reads the changes since the latest one in the export from GitHub
+        assert state.get_last_sync_time() == datetime(2016, 1, 1)
+        # changes from years ago are not counted in the lag
+        assert metrics.get_histogram("sync_lag_seconds") is None
+
+        sync_engine.import_issues(iter([]), exported_at=datetime(2017, 1, 1))
+        assert state.get_last_sync_time() == datetime(2017, 1, 1)
+
+    def test_failed_sync_is_reported(self, sync_engine, github_connection):
+        github_connection.get_issues.side_effect = Exception("GitHub is down")
+
+        with pytest.raises(Exception):
+            sync_engine.sync()
+
+        assert sync_engine.report.result == "failed"
+        assert sync_engine.report.error == "Exception: GitHub is down"
+
     def test_sync_resume_on_outages(self, sync_engine, github_connection, jira_connection, sync_strategy, state):
         # Simulate an outage for the Github platform by mocking the `get_issues()` method to raise an exception
         github_connection.get_issues.side_effect = Exception("Github platform is currently down")
 
         # Create a SyncEngine instance with the mocked platforms and sync strategy
-        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy)
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state)
 
         # Call the sync method to trigger the syncing process and verify that an exception is raised
         with pytest.raises(Exception):
@@ -64,3 +181,312 @@ class TestSyncEngine:
 
         # Call the sync method again and verify that syncing resumes
         sync_engine.sync()
+
+    def test_sync_stops_at_max_issues_and_resumes(self, sync_engine, github_connection, jira_connection,
+                                                  sync_strategy, state):
+        same_time = datetime(2023, 1, 1)
+        github_issues = [
+            self._base_issue(key="1", title='Issue 1', updated_at=same_time),
+            self._base_issue(key="2", title='Issue 2', updated_at=same_time),
+            self._base_issue(key="3", title='Issue 3', updated_at=datetime(2023, 1, 2))]
+        github_connection.get_issues.side_effect = lambda since, **kwargs: iter(github_issues)
+        jira_connection.find_issue_id_by_title.return_value = None
+
+        sync_engine.sync(max_issues=1)
+
+        assert sync_strategy.create_jira_issue.call_count == 1
+        assert state.get_last_sync_time() == same_time
+        assert state.get_last_synced_keys() == ["1"]
+
+        sync_engine.sync()
+
+        # issue 1 is returned again (same update time) but not synced again
+        assert sync_strategy.create_jira_issue.call_count == 3
+        assert [c[0][0].key for c in sync_strategy.create_jira_issue.call_args_list] == ["1", "2", "3"]
+        assert state.get_last_sync_time() == datetime(2023, 1, 2)
+        assert state.get_last_synced_keys() == ["3"]
+
+    def test_sync_stops_at_max_duration(self, sync_engine, github_connection, jira_connection, sync_strategy):
+        github_connection.get_issues.return_value = [self._base_issue(key="1", title='Issue 1')]
+
+        sync_engine.sync(max_duration=timedelta(seconds=0))
+
+        assert sync_strategy.create_jira_issue.call_count == 0
+
+    def test_sync_dead_letters_failed_issue_and_continues(self, sync_engine, github_connection, jira_connection,
+                                                          sync_strategy, state):
+        github_connection.get_issues.return_value = [
+            self._base_issue(key="1", title='Issue 1', updated_at=datetime(2023, 1, 1)),
+            self._base_issue(key="2", title='Issue 2', updated_at=datetime(2023, 1, 2))]
+        jira_connection.find_issue_id_by_title.return_value = None
+        sync_strategy.create_jira_issue.side_effect = [Exception("Jira is down"), "JIRA-2"]
+
+        sync_engine.sync()
+
+        failed_issue = state.get_failed_issues()["1"]
+        assert failed_issue.attempts == 1
+        assert failed_issue.error == "Exception: Jira is down"
+        assert failed_issue.next_retry_time > datetime.utcnow()
+        assert state.get_jira_issue("2") == "JIRA-2"
+        assert state.get_last_sync_time() == datetime(2023, 1, 2)
+
+    def test_sync_retries_due_failed_issues(self, sync_engine, github_connection, jira_connection,
+                                            sync_strategy, state):
+        state.update_failed_issue(FailedIssue("1", "error", 1, datetime.utcnow() - timedelta(minutes=1)))
+        state.update_failed_issue(FailedIssue("2", "error", 3, datetime.utcnow() + timedelta(minutes=1)))
+        github_connection.get_issue.side_effect = lambda key: self._base_issue(key=key, title=f'Issue {key}')
+        github_connection.get_issues.return_value = []
+        jira_connection.find_issue_id_by_title.return_value = None
+        sync_strategy.create_jira_issue.return_value = "JIRA-1"
+
+        sync_engine.sync()
+
+        github_connection.get_issue.assert_called_once_with("1")
+        assert list(state.get_failed_issues().keys()) == ["2"]
+
+    def test_sync_retry_backoff(self, sync_engine, github_connection, jira_connection, sync_strategy, state):
+        state.update_failed_issue(FailedIssue("1", "error", 2, datetime.utcnow() - timedelta(minutes=1)))
+        github_connection.get_issue.side_effect = lambda key: self._base_issue(key=key, title=f'Issue {key}')
+        github_connection.get_issues.return_value = []
+        jira_connection.find_issue_id_by_title.return_value = None
+        sync_strategy.create_jira_issue.side_effect = Exception("Jira is down")
+
+        sync_engine.sync()
+
+        failed_issue = state.get_failed_issues()["1"]
+        assert failed_issue.attempts == 3
+        assert failed_issue.next_retry_time > datetime.utcnow() + timedelta(minutes=59)
+
+    def test_sync_behind_syncs_fresh_issues_first(self, github_connection, jira_connection, sync_strategy, state):
+        now = datetime.utcnow()
+        state.update_last_sync_time(now - timedelta(days=100))
+        old = [self._base_issue(key=str(i), title=f'Old {i}', updated_at=now - timedelta(days=50 - i))
+               for i in range(3)]
+        fresh = [self._base_issue(key="10", title='Fresh', updated_at=now - timedelta(hours=1))]
+        github_connection.get_issues.side_effect = \
+            lambda since, **kwargs: iter([i for i in old + fresh if i.updated_at >= since])
+        jira_connection.find_issue_id_by_title.return_value = None
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state,
+                                 scheduler=IssueScheduler(backfill_limit=2))
+
+        sync_engine.sync()
+
+        synced = [c[0][0].key for c in sync_strategy.create_jira_issue.call_args_list]
+        assert synced == ["10", "0", "1"]
+        assert state.get_last_sync_time() == old[1].updated_at
+
+        sync_engine.sync()
+
+        # the backfill continues after the cursor and does not sync the fresh issue twice
+        synced = [c[0][0].key for c in sync_strategy.create_jira_issue.call_args_list]
+        assert synced == ["10", "0", "1", "2"]
+        assert [c[0][1].key for c in sync_strategy.update.call_args_list] == ["10"]
+        assert state.get_last_sync_time() == fresh[0].updated_at
+
+    def test_sync_closes_github_issues_closed_in_jira(self, sync_engine, github_connection, jira_connection, state,
+                                                      metrics):
+        github_connection.get_issues.return_value = []
+        state.update("1", "JIRA-1")
+        state.update("2", "JIRA-2")
+        since = datetime.utcnow() - timedelta(hours=1)
+        state.update_last_jira_sync_time(since)
+
+        def jira_issue(key, status):
+            return BaseIssue(key=key, project="test", title=BaseIssueField(key), description=BaseIssueField(None),
+                             status=BaseIssueField(status), comments=None)
+
+        jira_connection.get_changed_issues.return_value = [
+            jira_issue("JIRA-1", BaseIssueStatus.CLOSED), jira_issue("JIRA-2", BaseIssueStatus.OPEN),
+            jira_issue("JIRA-3", BaseIssueStatus.CLOSED)]
+        github_connection.update_issue_status.return_value = True
+
+        sync_engine.sync()
+
+        jira_connection.get_changed_issues.assert_called_once_with(since)
+        github_connection.update_issue_status.assert_called_once_with("1", BaseIssueStatus.CLOSED)
+        assert metrics.get("github_issues_closed") == 1
+        assert state.get_last_jira_sync_time() > since
+
+    def test_sync_does_not_read_github_issues_synced_as_closed(self, sync_engine, github_connection,
+                                                               jira_connection, state, metrics):
+        state.update("1", "JIRA-1")
+        state.update_last_jira_sync_time(datetime.utcnow() - timedelta(hours=1))
+        closed = self._base_issue(key="1", title="Issue 1")
+        closed.status = BaseIssueField(BaseIssueStatus.CLOSED)
+        github_connection.get_issues.return_value = [closed]
+        jira_connection.get_changed_issues.return_value = [
+            BaseIssue(key="JIRA-1", project="test", title=BaseIssueField("JIRA-1"), description=BaseIssueField(None),
+                      status=BaseIssueField(BaseIssueStatus.CLOSED), comments=None)]
+
+        sync_engine.sync()
+
+        github_connection.update_issue_status.assert_not_called()
+        assert metrics.get("skipped_writes", system="github", write="status") == 1
+
+    def test_sync_recovers_unconfirmed_mutations(self, sync_engine, github_connection, jira_connection,
+                                                 sync_strategy, state):
+        # a previous run died after creating JIRA-1 and while updating JIRA-2
+        state.update("2", "JIRA-2")
+        state.add_outbox_entry(OutboxEntry("gh-test-1", "create", "1", None, datetime(2023, 1, 1)))
+        state.add_outbox_entry(OutboxEntry("update-JIRA-2", "update", "2", "JIRA-2", datetime(2023, 1, 1)))
+        jira_connection.find_issue_keys_by_labels.return_value = {"gh-test-1": "JIRA-1"}
+        github_connection.get_issue.side_effect = lambda key: self._base_issue(key=key, title=f"Issue {key}")
+        github_connection.get_issues.return_value = [self._base_issue(key="1", title="Issue 1")]
+
+        sync_engine.sync()
+
+        jira_connection.find_issue_keys_by_labels.assert_called_once_with(["gh-test-1"])
+        assert state.get_jira_issue("1") == "JIRA-1"
+        sync_strategy.create_jira_issue.assert_not_called()
+        # the comments and status of the created issue may be missing, so it is synced again
+        assert [c[0][1].key for c in sync_strategy.update.call_args_list] == ["2", "1", "1"]
+        jira_connection.find_issue_id_by_title.assert_not_called()
+        assert state.get_outbox() == {}
+
+    def test_recovery_waits_for_retry_of_failed_issue(self, sync_engine, github_connection, sync_strategy, state):
+        # the update of a poisoned issue failed and keeps its outbox entry
+        state.update("2", "JIRA-2")
+        state.add_outbox_entry(OutboxEntry("update-JIRA-2", "update", "2", "JIRA-2", datetime(2023, 1, 1)))
+        state.update_failed_issue(FailedIssue("2", "Exception: poisoned", 3, datetime.utcnow() + timedelta(hours=1)))
+        github_connection.get_issues.return_value = []
+        github_connection.get_issue.side_effect = lambda key: self._base_issue(key=key, title=f"Issue {key}")
+
+        sync_engine.sync()
+
+        github_connection.get_issue.assert_not_called()
+        assert list(state.get_outbox()) == ["update-JIRA-2"]
+        # meanwhile its comments are read when it is listed, as the failed update may have missed some
+        assert not github_connection.get_issues.call_args[1]["is_mapped"]("2")
+
+        state.update_failed_issue(FailedIssue("2", "Exception: poisoned", 3, datetime.utcnow() - timedelta(minutes=1)))
+        sync_engine.sync()
+
+        github_connection.get_issue.assert_called_once_with("2")
+        assert state.get_outbox() == {}
+        assert state.get_failed_issues() == {}
+
+    @pytest.mark.parametrize("pipeline", [None, {}])
+    def test_sync_reads_comments_when_one_was_deleted(self, github_connection, jira_connection, sync_strategy, state,
+                                                     pipeline):
+        state.update("1", "JIRA-1")
+        state.update("2", "JIRA-2")
+        # the comment feed has no deleted comments, so both are listed without their comments
+        listed = [BaseIssue(key=key, project="test", title=BaseIssueField(key), description=BaseIssueField(""),
+                            comments=None, comment_count=1) for key in ("1", "2")]
+        github_connection.get_issues.return_value = listed
+        jira_connection.get_issue.side_effect = lambda key: BaseIssue(
+            key=key, project="test", title=BaseIssueField(key), description=BaseIssueField(""),
+            comments=[BaseIssueComment("a", "user"), BaseIssueComment("b", "user")][:1 if key == "JIRA-1" else 2])
+        github_connection.get_issue.return_value = BaseIssue(key="2", project="test", title=BaseIssueField("2"),
+                                                             description=BaseIssueField(""),
+                                                             comments=[BaseIssueComment("a", "user")])
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state, pipeline=pipeline)
+
+        sync_engine.sync()
+
+        github_connection.get_issue.assert_called_once_with("2")
+        assert listed[0].comments is None
+        assert len(listed[1].comments) == 1
+
+    def test_create_is_written_ahead(self, sync_engine, github_connection, jira_connection, sync_strategy, state):
+        github_connection.get_issues.return_value = [self._base_issue(key="1", title="Issue 1")]
+        jira_connection.find_issue_id_by_title.return_value = None
+        sync_strategy.create_jira_issue.side_effect = KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            sync_engine.sync()
+
+        assert list(state.get_outbox()) == ["create-1"]
+
+    def test_sync_is_skipped_while_another_sync_holds_the_lease(self, github_connection, jira_connection,
+                                                                 sync_strategy, metrics, tmp_path):
+        state = InFileState(str(tmp_path / "state.json"))
+        other = state.lease(timedelta(hours=1))
+        assert other.acquire()
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state, metrics=metrics)
+
+        sync_engine.sync()
+
+        github_connection.get_issues.assert_not_called()
+        assert metrics.get("skipped_syncs") == 1
+
+        other.release()
+        github_connection.get_issues.return_value = []
+        sync_engine.sync()
+
+        github_connection.get_issues.assert_called()
+        assert not (tmp_path / "state.json.lock").exists()
+
+    def test_pipelined_sync_commits_in_order(self, github_connection, jira_connection, sync_strategy, state, metrics):
+        github_connection.get_issues.return_value = [
+            self._base_issue(key=str(i), title=f"Issue {i}", updated_at=datetime(2023, 1, i)) for i in range(1, 6)]
+        jira_connection.find_issue_id_by_title.side_effect = lambda title: "JIRA-2" if title == "Issue 2" else None
+        jira_connection.create_issue.side_effect = lambda issue: f"JIRA-{issue.key}"
+        sync_strategy.build_jira_issue.side_effect = lambda github_issue: self._base_issue(github_issue.key, "")
+        sync_strategy.transform.return_value = False
+
+        jira_connection.update_issue.side_effect = Exception("Jira is down")
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state, metrics=metrics,
+                                 pipeline={"find": 2, "write": 3}, pipeline_queue_size=2)
+
+        sync_engine.sync()
+
+        assert {state.get_jira_issue(str(i)) for i in (1, 3, 4, 5)} == {"JIRA-1", "JIRA-3", "JIRA-4", "JIRA-5"}
+        assert list(state.get_failed_issues()) == ["2"]
+        # issue 2 was not mapped when it entered the pipeline, so its entry is a create that the next run reconciles
+        assert list(state.get_outbox()) == ["create-2"]
+        assert state.get_last_sync_time() == datetime(2023, 1, 5)
+        assert metrics.get("issues", result="created") == 4
+        assert metrics.get("pipeline_items", stage="write") == 5
+
+    def test_pipelined_sync_holds_listing_behind_slow_issue(self, github_connection, jira_connection, sync_strategy,
+                                                            state):
+        for i in range(1, 201):
+            state.update(str(i), f"JIRA-{i}")
+        listed = []
+        released = threading.Event()
+
+        def listing(since, **kwargs):
+            for i in range(1, 201):
+                listed.append(i)
+                if len(listed) == 100:
+                    released.set()
+                yield self._base_issue(key=str(i), title=f"Issue {i}", updated_at=datetime(2023, 1, 1))
+
+        listed_behind_first = []
+
+        def update_issue(jira_issue, current):
+            if jira_issue.key == "JIRA-1":
+                released.wait(timeout=1)
+                listed_behind_first.append(len(listed))
+
+        github_connection.get_issues.side_effect = listing
+        jira_connection.get_issue.side_effect = lambda key: self._base_issue(key, "")
+        jira_connection.update_issue.side_effect = update_issue
+        sync_strategy.transform.return_value = False
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state,
+                                 pipeline={"find": 1, "transform": 1, "write": 2}, pipeline_queue_size=2)
+
+        sync_engine.sync()
+
+        # the stages hold 3 queues of 2, 4 workers and 2 completed issues
+        assert listed_behind_first[0] <= 13
+        assert jira_connection.update_issue.call_count == 200
+
+    def test_pipelined_sync_holds_issue_listed_again(self, github_connection, jira_connection, sync_strategy, state):
+        # issue 1 changed while the listing ran, so it is listed again
+        github_connection.get_issues.return_value = [
+            self._base_issue(key="1", title="Issue 1", updated_at=datetime(2023, 1, 1)),
+            self._base_issue(key="1", title="Issue 1", updated_at=datetime(2023, 1, 2))]
+        jira_connection.find_issue_id_by_title.return_value = None
+        jira_connection.create_issue.side_effect = lambda issue: time.sleep(0.1) or "JIRA-1"
+        jira_connection.get_issue.side_effect = lambda key: self._base_issue(key, "")
+        sync_strategy.build_jira_issue.side_effect = lambda github_issue: self._base_issue(github_issue.key, "")
+        sync_strategy.transform.return_value = False
+        sync_engine = SyncEngine(github_connection, jira_connection, sync_strategy, state, pipeline={})
+
+        sync_engine.sync()
+
+        jira_connection.create_issue.assert_called_once()
+        jira_connection.update_issue.assert_called_once()
+        assert state.get_jira_issue("1") == "JIRA-1"
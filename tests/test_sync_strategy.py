@@ -60,11 +60,20 @@ def sync_strategy(jira_connection_mock, github_connection_mock):
 
 def test_update_calls_jira_connection_update_issue_with_updated_issue(jira_connection_mock, jira_issue, github_issue,
                                                                       sync_strategy):
+    title = jira_issue.title
+    description = jira_issue.description.value
+
     # Act
     sync_strategy.update(jira_issue, github_issue)
 
     # Assert
-    jira_connection_mock.update_issue.assert_called_once_with(jira_issue)
+    jira_connection_mock.update_issue.assert_called_once()
+    issue, current = jira_connection_mock.update_issue.call_args[0]
+    assert issue is jira_issue
+    # the issue as read from Jira is passed along, so it is not read again
+    assert current.title is title
+    assert current.description.value == description
+    assert len(current.comments) == 1
 
 
 def test_update_updates_jira_issue_fields(jira_issue, github_issue, sync_strategy):
@@ -101,6 +110,16 @@ def test_update_creates_jira_issue_comments(jira_issue, github_issue, sync_strat
     assert jira_issue.comments[1].user.value == "user2"
 
 
+def test_update_keeps_jira_comments_when_github_comments_not_read(jira_issue, github_issue, sync_strategy,
+                                                                  jira_connection_mock):
+    github_issue.comments = None
+
+    sync_strategy.update(jira_issue, github_issue)
+
+    assert jira_issue.comments is None
+    assert jira_connection_mock.update_issue.call_args[0][0] is jira_issue
+
+
 def test_update_jira_issue_status_both_open(jira_issue, github_issue, sync_strategy):
     # Arrange
     github_issue.status.value = BaseIssueStatus.OPEN
@@ -144,3 +163,36 @@ def test_update_jira_issue_jire_closed_github_open(jira_issue, github_issue, syn
 
     assert sync_strategy._jira_connection.update_issue.call_count == 1
     assert sync_strategy._github_connection.update_issue.call_count == 1
+
+
+def test_create_jira_issue(jira_connection_mock, github_issue, sync_strategy):
+    jira_connection_mock.create_issue.return_value = "JIRA-1"
+    github_description = github_issue.description.value
+
+    assert sync_strategy.create_jira_issue(github_issue) == "JIRA-1"
+
+    jira_issue = jira_connection_mock.create_issue.call_args[0][0]
+    assert jira_issue.key is None
+    assert jira_issue.title.value == github_issue.title.value
+    assert jira_issue.description.value.endswith(github_description)
+    assert jira_issue.comments[1].body.value.strip() == "user2 wrote on GitHub:\nTest comment 2."
+    # the GitHub issue is not changed
+    assert github_issue.description.value == github_description
+    assert github_issue.comments[1].body.value == "Test comment 2."
+
+
+def test_comment_is_compact():
+    comment = BaseIssueComment("body", "user1", datetime(2022, 1, 1))
+    assert not hasattr(comment, "__dict__")
+    assert not hasattr(comment.body, "__dict__")
+    assert comment.user.value is BaseIssueComment("other", "".join(["user", "1"])).user.value
+
+
+def test_update_converts_markdown(jira_issue, github_issue, sync_strategy):
+    github_issue.description.value = "Run `make test`"
+    github_issue.comments[0].body.value = "**works**"
+
+    sync_strategy.update(jira_issue, github_issue)
+
+    assert jira_issue.description.value.endswith("Run {{make test}}")
+    assert jira_issue.comments[0].body.value.strip().endswith("*works*")
@@ -0,0 +1,86 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from issues_sync import tracing
+from issues_sync.finder import Finder
+from issues_sync.tracing import SpanExporter, span
+from issues_sync.utils import InMemoryState
+
+
+class InMemoryExporter(SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemoryExporter()
+    tracing.configure(exporter)
+    yield exporter
+    tracing.shutdown()
+
+
+def test_span_disabled_is_noop():
+    assert span("sync") is span("sync_issue", github_issue="1")
+    with span("sync"):
+        tracing.set_attribute("key", "value")
+
+
+def test_nested_spans(exporter):
+    with span("sync"):
+        with span("sync_issue", github_issue="1"):
+            tracing.set_attribute("jira_issue", "JIRA-1")
+
+    child, parent = exporter.spans
+    assert child.name == "sync_issue"
+    assert child.attributes == {"github_issue": "1", "jira_issue": "JIRA-1"}
+    assert child.parent_id == parent.span_id
+    assert child.trace_id == parent.trace_id
+    assert parent.parent_id is None
+    assert child.end_ns >= child.start_ns
+
+
+def test_span_records_error(exporter):
+    with pytest.raises(ValueError):
+        with span("jira.update_issue"):
+            raise ValueError("boom")
+
+    assert exporter.spans[0].error == "ValueError: boom"
+
+
+def test_finder_span(exporter):
+    jira_connection = Mock()
+    jira_connection.find_issue_id_by_title.return_value = "JIRA-1"
+
+    Finder(jira_connection, InMemoryState()).find_jira_issue_key("1", "Issue 1")
+
+    assert exporter.spans[0].name == "finder.find_jira_issue_key"
+    assert exporter.spans[0].attributes == {"github_issue": "1"}
+
+
+def test_json_file_exporter(tmp_path):
+    file = tmp_path / "trace.jsonl"
+    tracing.configure(tracing.JsonFileExporter(str(file)))
+    with span("sync"):
+        pass
+    tracing.shutdown()
+
+    spans = [json.loads(line) for line in file.read_text().splitlines()]
+    assert spans[0]["name"] == "sync"
+
+
+def test_otlp_span_encoding():
+    s = tracing.Span("sync_issue", None, {"github_issue": "1", "comments": 2})
+    s.end_ns = s.start_ns + 10
+
+    encoded = tracing._otlp_span(s)
+
+    assert encoded["traceId"] == s.trace_id and len(encoded["traceId"]) == 32
+    assert "parentSpanId" not in encoded
+    assert encoded["attributes"] == [{"key": "github_issue", "value": {"stringValue": "1"}},
+                                     {"key": "comments", "value": {"intValue": "2"}}]